@@ -0,0 +1,8 @@
+"""Python tools for the RRIFT notebook.
+
+The modules mirror the MATLAB code in ``RRIFT/mfiles`` and the ``RRIFT/b*``
+and ``RRIFT/c*`` scripts, vectorized over voxels so that the simulations and
+in-vivo analyses can be re-run from Python.
+"""
+
+__version__ = '0.1.0'
@@ -0,0 +1,180 @@
+"""Agreement between the ETM and the reference region fits of the tumours.
+
+Python version of the CCC part of ``c03_showResults.m``. For every study
+in ``c02_postprocessed``, every parameter (Ktrans, ve, vp) and every
+reference region method (RRM with assumed muscle parameters, RRIFT with
+the assumed and with the measured AIF tail), the concordance correlation
+coefficient and Pearson's r against the ETM are computed, per study and
+for the pooled cohort as in Figure 5.
+
+All coefficients follow from six sums per (study, parameter, method) (see
+``stats.pair_sums``), which are taken in one pass over the concatenated
+voxels of all studies; pooling adds up the sums of the studies. Bootstrap
+confidence intervals resample the voxels of each study with a matrix of
+random indices per block of replications; the blocks run in a process
+pool, each on its own counter-based random stream (see ``rriftpy.rng``),
+and the pooled coefficient of replication b combines replication b of
+every study.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.agreement --boot 1000 --workers 8
+"""
+
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.io import loadmat
+
+from .downsampled import study_index
+from .patients import study_name
+from .postprocess import DEFAULT_POSTPROCESSED_DIR
+from .rng import cell_generator
+from .stats import ccc_from_sums, pair_terms, quantile
+
+PARAMETERS = ('Kt', 'Ve', 'Vp')
+# In the order of the Figure 5 buttons
+METHODS = ('RRM', 'RRIFT_Pop', 'RRIFT')
+METHOD_TITLES = ('RRM with assumed K<sub>RR</sub><sup>trans</sup>', 'RRIFT with assumed AIF tail',
+                 'RRIFT with measured AIF tail')
+LIMITS = (0.2, 0.5, 0.05)  # values above are left out, as in c03 (doLog = 0)
+ASSUMED_KT_RR = 0.07
+ASSUMED_VE_RR = 0.14
+MAX_DRAWS = 2000000  # bootstrap indices drawn at a time
+
+
+def tumour_values(path):
+    """ETM and reference region values of the tumour voxels of one c02 study.
+
+    Returns ``(x, y)``: x [nParam x nVox] from the ETM and y [nParam x
+    nMethod x nVox], ordered as PARAMETERS and METHODS. Negative values and
+    values above LIMITS are set to NaN, as for Figure 5.
+    """
+    f = loadmat(path)
+    maskCt = f['maskCt'].astype(bool).ravel(order='F')
+    m = {name: f[name].ravel(order='F')[maskCt] for name in
+         ('mapKt', 'mapVe', 'mapVp', 'mapKtR', 'mapVeR', 'mapVpR')}
+    estKtRR, estVeRR, estKtRRPop, estVeRRPop = (
+        float(np.squeeze(f[name])) for name in ('estKtRR', 'estVeRR', 'estKtRRPop', 'estVeRRPop'))
+    x = np.stack([m['mapKt'], m['mapVe'], m['mapVp']])
+    y = np.stack([
+        [m['mapKtR'] / estKtRR * ASSUMED_KT_RR, m['mapKtR'] * estKtRRPop / estKtRR, m['mapKtR']],
+        [m['mapVeR'] / estVeRR * ASSUMED_VE_RR, m['mapVeR'] * estVeRRPop / estVeRR, m['mapVeR']],
+        [m['mapVpR'] / estKtRR * ASSUMED_KT_RR, m['mapVpR'] * estKtRRPop / estKtRR, m['mapVpR']]])
+    limits = np.array(LIMITS)
+    with np.errstate(invalid='ignore'):
+        x[(x < 0) | (x > limits[:, None])] = np.nan
+        y[(y < 0) | (y > limits[:, None, None])] = np.nan
+    return x, y
+
+
+def _terms(x, y):
+    # pair_terms of the ETM values against every method: [6 x nParam x nMethod x nVox]
+    return pair_terms(x[:, None], y)
+
+
+def _bootstrap_task(x, y, seed, studyIdx, block, reps):
+    # pair sums [6 x nParam x nMethod x reps] of ``reps`` resamples of one study
+    rng = cell_generator(seed, studyIdx, block)
+    terms = _terms(x, y)
+    nVox = x.shape[-1]
+    sums = []
+    step = max(MAX_DRAWS // max(nVox, 1), 1)
+    for start in range(0, reps, step):
+        nb = min(step, reps - start)
+        index = rng.integers(0, nVox, (nb, nVox))
+        # How often every voxel is drawn in each replication
+        counts = np.bincount((index + nVox * np.arange(nb)[:, None]).ravel(),
+                             minlength=nb * nVox).reshape(nb, nVox)
+        sums.append(terms @ counts.T.astype(float))
+    return np.concatenate(sums, axis=-1)
+
+
+def cohort_agreement(inDir=DEFAULT_POSTPROCESSED_DIR, nBoot=1000, level=0.95, seed=12345,
+                     workers=None, blockSize=100, verbose=True):
+    """CCC and Pearson's r for every study, parameter and method.
+
+    Returns a dict with studies (the last entry, 'All', is the pooled
+    cohort), ccc, pearson and n [nStudies+1 x nParam x nMethod], and with
+    nBoot > 0 also cccCI and pearsonCI [... x 2], the percentile bootstrap
+    intervals at ``level``.
+    """
+    inFiles = sorted(glob.glob(os.path.join(inDir, '*.mat')))
+    studies = [study_name(inFile) for inFile in inFiles]
+    values = [tumour_values(inFile) for inFile in inFiles]
+
+    # One pass over the voxels of all studies
+    terms = _terms(np.concatenate([x for x, _ in values], axis=-1),
+                   np.concatenate([y for _, y in values], axis=-1))
+    starts = np.cumsum([0] + [x.shape[-1] for x, _ in values[:-1]])
+    sums = np.moveaxis(np.add.reduceat(terms, starts, axis=-1), -1, 0)
+    sums = np.concatenate([sums, sums.sum(axis=0, keepdims=True)])
+    cccoeff, pearson, n = ccc_from_sums(np.moveaxis(sums, 1, 0))
+    result = dict(studies=studies + ['All'], parameters=list(PARAMETERS), methods=list(METHODS),
+                  ccc=cccoeff, pearson=pearson, n=n)
+    if not nBoot:
+        return result
+
+    tic = time.time()
+    tasks = [(k, block, min(blockSize, nBoot - block * blockSize)) for k in range(len(values))
+             for block in range((nBoot + blockSize - 1) // blockSize)]
+
+    def submit(k, block, reps):
+        return (values[k][0], values[k][1], seed, study_index(studies[k]), block, reps)
+
+    if workers == 1:
+        blocks = [_bootstrap_task(*submit(*task)) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            blocks = list(pool.map(_bootstrap_task, *zip(*[submit(*task) for task in tasks])))
+    boot = np.zeros((len(values),) + sums.shape[1:] + (nBoot,))
+    for (k, block, reps), bootSums in zip(tasks, blocks):
+        boot[k, ..., block * blockSize:block * blockSize + reps] = bootSums
+    boot = np.concatenate([boot, boot.sum(axis=0, keepdims=True)])
+    bootCcc, bootPearson, _ = ccc_from_sums(np.moveaxis(boot, 1, 0))
+    p = [(1 - level) / 2, (1 + level) / 2]
+    result.update(cccCI=quantile(bootCcc, p, axis=-1), pearsonCI=quantile(bootPearson, p, axis=-1),
+                  nBoot=nBoot, level=level)
+    if verbose:
+        print('Bootstrap of {} studies x {} replications took {:.1f} s'.format(
+            len(values), nBoot, time.time() - tic))
+    return result
+
+
+def annotation(result, method, parameter='Kt', study='All'):
+    """Text of a Figure 5 annotation: CCC and Pearson's r (with CIs if bootstrapped)."""
+    index = (result['studies'].index(study), result['parameters'].index(parameter),
+             result['methods'].index(method))
+    text = []
+    for label, name in (('CCC', 'ccc'), ('ρ', 'pearson')):
+        value = '{}: {:.3f}'.format(label, result[name][index])
+        if name + 'CI' in result:
+            value += ' [{:.3f}, {:.3f}]'.format(*result[name + 'CI'][index])
+        text.append(value)
+    return ' \n '.join(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--in-dir', default=DEFAULT_POSTPROCESSED_DIR)
+    parser.add_argument('--boot', type=int, default=1000, help='bootstrap replications (0: none)')
+    parser.add_argument('--level', type=float, default=0.95)
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    result = cohort_agreement(args.in_dir, args.boot, args.level, args.seed, args.workers)
+    for parameter in result['parameters']:
+        print('------ {} ------'.format(parameter))
+        for k, study in enumerate(result['studies']):
+            print('{:<16s}'.format(study) + '  '.join(
+                annotation(result, method, parameter, study).replace(' \n ', ' ')
+                for method in result['methods']))
+
+
+if __name__ == '__main__':
+    main()
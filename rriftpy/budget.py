@@ -0,0 +1,284 @@
+"""Size budget of the figure pages.
+
+Every page in ``figures/`` is one self-contained HTML file, so a cell that
+embeds a larger array than intended only shows up as a slower page. This
+tool parses each page and attributes its bytes to:
+
+* library code: inline scripts that do not draw a figure (plotly.js and
+  its configuration); scripts loaded from a URL cost nothing here;
+* the layout and config of the figure;
+* every trace, split into its data arrays (x, y, z, error bars, ...) and
+  its other attributes;
+* the swap payload, shared store and views of the pages written by
+  ``figures.write_html`` and ``figures.write_views_html``;
+* everything else (markup and glue code).
+
+Both the pages of ``plotly.offline.plot`` (the notebook) and those of
+``rriftpy.figures`` are understood. Traces and swap payload options (of
+the page or of any of its views) over ``--max-trace`` are flagged, and
+the exit status is non-zero if a page is over its size limit
+(``--max-size``, or ``--max-size-for PATTERN=SIZE`` for the pages
+matching a glob pattern).
+
+Usage (from the repository root)::
+
+    python -m rriftpy.budget figures --max-size 5M --max-trace 500k \
+        --max-size-for 'fig5-voxels-*.html=8M'
+"""
+
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import re
+import sys
+
+SCRIPT = re.compile(r'<script([^>]*)>(.*?)</script>', re.S)
+NEWPLOT = re.compile(r'Plotly\.newPlot\(\s*"[^"]*"\s*,\s*')
+# Variables of the pages of rriftpy.figures, in the order they are written
+VARIABLES = ('data', 'layout', 'config', 'payload', 'store', 'views')
+UNITS = {'': 1, 'k': 1e3, 'm': 1e6, 'g': 1e9}
+
+
+def parse_size(text):
+    """Bytes of a size such as '500k', '5M' or '1200' (decimal units)."""
+    match = re.match(r'^\s*([0-9.]+)\s*([kmg]?)b?\s*$', text.lower())
+    if not match:
+        raise ValueError('not a size: {!r}'.format(text))
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+def format_size(n):
+    return '{:.1f} kB'.format(n / 1e3)
+
+
+def _skip(text, pos, chars=' \t\r\n'):
+    while pos < len(text) and text[pos] in chars:
+        pos += 1
+    return pos
+
+
+def _decode_array(text, pos, decoder=json.JSONDecoder()):
+    # The items of the JSON array starting at text[pos] with the length of
+    # their source text, and the position after the array
+    if text[pos] != '[':
+        raise ValueError('expected a JSON array at {}'.format(pos))
+    items = []
+    pos = _skip(text, pos + 1)
+    while text[pos] != ']':
+        item, end = decoder.raw_decode(text, pos)
+        items.append((item, end - pos))
+        pos = _skip(text, _skip(text, end) + (text[_skip(text, end)] == ','))
+    return items, pos + 1
+
+
+def _figure_parts(body, decoder=json.JSONDecoder()):
+    # Source lengths and values of the figure parts of a script, or None if
+    # it does not draw a figure
+    parts = {}
+    call = NEWPLOT.search(body)
+    if call:
+        # plotly.offline: Plotly.newPlot("id", data, layout, config)
+        pos = call.end()
+        data, end = _decode_array(body, pos)
+        parts['data'] = (end - pos, data)
+        for name in ('layout', 'config'):
+            pos = _skip(body, _skip(body, end) + 1)
+            if body[pos] != '{':
+                break
+            value, end = decoder.raw_decode(body, pos)
+            parts[name] = (end - pos, value)
+        return parts
+    for name in VARIABLES:
+        match = re.search(r'^var {} = (?=[\[{{])'.format(name), body, re.M)
+        if not match:
+            continue
+        pos = match.end()
+        if name == 'data':
+            data, end = _decode_array(body, pos)
+            parts[name] = (end - pos, data)
+        else:
+            value, end = decoder.raw_decode(body, pos)
+            parts[name] = (end - pos, value)
+    return parts or None
+
+
+def _compact(x):
+    return len(json.dumps(x, separators=(',', ':')))
+
+
+def _arrays(x, refs, prefix=''):
+    # (attribute, compact JSON length, shared) of the arrays in a trace
+    out = []
+    for key, value in x.items():
+        name = prefix + key
+        if isinstance(value, list):
+            out.append((name, _compact(value), False))
+        elif isinstance(value, dict) and '@ref' in value:
+            out.append((name, refs.get(value['@ref'], 0), True))
+        elif isinstance(value, dict):
+            out.extend(_arrays(value, refs, name + '.'))
+    return out
+
+
+def _refs(x):
+    # The {'@ref': key} entries of x
+    if isinstance(x, dict):
+        if '@ref' in x:
+            yield x
+        else:
+            for value in x.values():
+                yield from _refs(value)
+    elif isinstance(x, list):
+        for value in x:
+            yield from _refs(value)
+
+
+def option_size(option, refs=None):
+    """Compact JSON bytes of a swap payload option.
+
+    Arrays of the shared store (``{'@ref': key}``, sizes in ``refs``) are
+    counted in full, as in trace_report, since the option draws them.
+    """
+    refs = refs or {}
+    return _compact(option) + sum(refs.get(ref['@ref'], 0) - _compact(ref)
+                                  for ref in _refs(option))
+
+
+def trace_report(trace, size, refs=None):
+    """Bytes of a trace (``size`` in the page) and of each of its data arrays.
+
+    The arrays are measured as compact JSON and scaled to the trace's size
+    in the page, so that pages written with spaces are measured alike.
+    Arrays of the shared store (``{'@ref': key}``, sizes in ``refs``) are
+    added to the size of every trace that refers to them.
+    """
+    arrays = _arrays(trace, refs or {})
+    compact = _compact(trace)
+    scale = size / compact if compact else 1
+    size += sum(n for _, n, shared in arrays if shared)
+    arrays = [(name + ' (shared)', n) if shared else (name, int(n * scale))
+              for name, n, shared in arrays]
+    label = trace.get('name') or trace.get('uid') or ''
+    return dict(type=trace.get('type', 'scatter'), name=str(label), size=size,
+                arrays=sorted(arrays, key=lambda a: -a[1]))
+
+
+def page_report(path):
+    """Byte attribution of one page.
+
+    Returns a dict with the page's total size, the sizes of the categories
+    above, the trace_report of every trace (of every view), the
+    option_size of every option of the swap payload of the page
+    (``options``) and of each view (``viewOptions``, by view name) and the
+    URLs of external scripts.
+    """
+    with open(path, 'rb') as fid:
+        html = fid.read().decode('utf-8')
+    total = len(html.encode('utf-8'))
+    sizes = dict(library=0, layout=0, config=0, traces=0, payload=0, store=0, views=0)
+    traces, options, viewOptions, external, refs = [], [], {}, [], {}
+    for match in SCRIPT.finditer(html):
+        attrs, body = match.groups()
+        src = re.search(r'src="([^"]*)"', attrs)
+        if src:
+            external.append(src.group(1))
+            continue
+        parts = _figure_parts(body)
+        if parts is None:
+            sizes['library'] += len(body.encode('utf-8'))
+            continue
+        # The JSON is ASCII (ensure_ascii), so its length is its size in bytes
+        for name, (size, value) in parts.items():
+            if name == 'data':
+                for trace, traceSize in value:
+                    traces.append(dict(trace_report(trace, traceSize), view=''))
+                sizes['traces'] += size
+            elif name == 'views':
+                sizes['views'] += size
+                for view in value:
+                    for trace in view['data']:
+                        traces.append(dict(trace_report(trace, _compact(trace), refs),
+                                           view=view['name']))
+                    if view.get('payload'):
+                        viewOptions[view['name']] = [option_size(option, refs)
+                                                     for option in view['payload']['options']]
+            elif name == 'payload':
+                sizes['payload'] += size
+                options = [option_size(option, refs) for option in value['options']]
+            elif name == 'store':
+                sizes['store'] += size
+                refs = {key: _compact(x) for key, x in value.items()}
+            else:
+                sizes[name] += size
+    sizes['other'] = total - sum(sizes.values())
+    return dict(path=path, total=total, sizes=sizes, traces=traces, options=options,
+                viewOptions=viewOptions, external=external)
+
+
+def size_limit(path, default, patterns):
+    """Size limit of a page: that of the last matching pattern, else default."""
+    limit = default
+    for pattern, size in patterns:
+        if fnmatch.fnmatch(os.path.basename(path), pattern):
+            limit = size
+    return limit
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='*', default=['figures'],
+                        help='pages, or directories of pages (default: figures)')
+    parser.add_argument('--max-size', default='5M', help='size limit of a page')
+    parser.add_argument('--max-size-for', action='append', default=[], metavar='PATTERN=SIZE',
+                        help='size limit of the pages matching a glob pattern')
+    parser.add_argument('--max-trace', default='500k', help='budget of one trace')
+    parser.add_argument('-v', '--verbose', action='store_true', help='list every trace')
+    args = parser.parse_args(argv)
+
+    maxSize, maxTrace = parse_size(args.max_size), parse_size(args.max_trace)
+    patterns = []
+    for entry in args.max_size_for:
+        pattern, _, size = entry.rpartition('=')
+        patterns.append((pattern, parse_size(size)))
+    pages = []
+    for path in args.paths:
+        pages += sorted(glob.glob(os.path.join(path, '*.html'))) if os.path.isdir(path) \
+            else [path]
+
+    over = 0
+    for path in pages:
+        report = page_report(path)
+        limit = size_limit(path, maxSize, patterns)
+        status = 'OVER LIMIT of ' + format_size(limit) if report['total'] > limit else 'ok'
+        over += report['total'] > limit
+        print('{}: {} ({})'.format(path, format_size(report['total']), status))
+        for name, size in report['sizes'].items():
+            if size:
+                print('    {:<8s}{:>12s}'.format(name, format_size(size)))
+        for url in report['external']:
+            print('    loads {}'.format(url))
+        for k, trace in enumerate(report['traces']):
+            flagged = trace['size'] > maxTrace
+            if not (flagged or args.verbose):
+                continue
+            arrays = ', '.join('{} {}'.format(name, format_size(n))
+                               for name, n in trace['arrays'][:4])
+            print('    {} trace {}{} ({} {!r}): {}{}'.format(
+                '!' if flagged else ' ', k, ' in view ' + trace['view'] if trace['view'] else '',
+                trace['type'], trace['name'], format_size(trace['size']),
+                ' [' + arrays + ']' if arrays else ''))
+        optionLists = [('', report['options'])] + list(report['viewOptions'].items())
+        for view, options in optionLists:
+            for k, size in enumerate(options):
+                if size > maxTrace:
+                    print('    ! swap option {}{}: {}'.format(
+                        k, ' in view ' + view if view else '', format_size(size)))
+    if over:
+        print('{} of {} pages over their size limit'.format(over, len(pages)))
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
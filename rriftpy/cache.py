@@ -0,0 +1,158 @@
+"""Simulation result cache for the notebook figures.
+
+Instead of downloading ``simResults.mat`` and ``simResultsTRes15-var*.mat``,
+the figure cells ask this cache for their summaries. Results are stored per
+simulation cell, keyed on a hash of everything that determines the cell:
+reference parameters, noise level and temporal resolution (quantised like
+the noise streams, see ``simulation.cell_indices``), number of
+replications, seed, the phantom and the source of the modules the results
+are computed with, so that any change to the fitting code invalidates the
+cells without a version bump. On a miss only the missing cells are
+simulated, so changing one noise level reruns one column of the figure,
+not the whole simulation. Cells of adaptive runs (``tol``, see
+``simulation.run_adaptive_cell``) are keyed on their stopping rule too.
+
+Usage from a notebook cell::
+
+    from rriftpy.cache import SimulationCache
+    file = SimulationCache().fig4vars()
+"""
+
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from . import models, rng, simulation, stats
+from .mainsim import LIST_SIGMA_C, TRES, assemble_main, main_specs, summarize_fig2_fig3
+from .simulation import (DEFAULT_SIM_MAP, cached_sim_map, cell_indices, compute_cells,
+                         compute_cells_adaptive)
+from .sweep import assemble_sweep, reference_grid, summarize_fig4, sweep_specs
+
+DEFAULT_CACHE_DIR = os.path.join('RRIFT', 'data', 'simCache')
+# Modules whose code determines the results of a cell
+CODE_MODULES = (models, rng, simulation, stats)
+
+
+@lru_cache(maxsize=None)
+def code_digest():
+    """Hash of the source of CODE_MODULES."""
+    h = hashlib.sha1()
+    for module in CODE_MODULES:
+        with open(module.__file__, 'rb') as fid:
+            h.update(fid.read())
+    return h.hexdigest()
+
+
+class SimulationCache(object):
+    """Per-cell store of simulation results under ``root``.
+
+    seed, simMapPath, workers and blockSize are passed on to
+    ``simulation.compute_cells`` when cells are missing, and to
+    ``simulation.compute_cells_adaptive`` with minRep for the cells asked
+    for with a ``tol``.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, simMapPath=DEFAULT_SIM_MAP, seed=12345,
+                 workers=None, blockSize=50, minRep=100, verbose=True):
+        self.root = root
+        self.simMapPath = simMapPath
+        self.seed = seed
+        self.workers = workers
+        self.blockSize = blockSize
+        self.minRep = minRep
+        self.verbose = verbose
+        self._simMapDigest = None
+
+    @property
+    def simMap(self):
+        return cached_sim_map(self.simMapPath)
+
+    def sim_map_digest(self):
+        """Hash of the phantom the cells are simulated from."""
+        if self._simMapDigest is None:
+            h = hashlib.sha1()
+            for x in (self.simMap.t, self.simMap.Cp, self.simMap.Ct):
+                h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+            self._simMapDigest = h.hexdigest()
+        return self._simMapDigest
+
+    def cell_key(self, spec, repF, tol=None):
+        """Hash of the configuration of one (ktRR, kepRR, sigmaC, TRes) cell.
+
+        Specs are identified by their noise stream indices, so two specs
+        that share a stream share a key. With tol, repF is the cap of an
+        adaptive run.
+        """
+        config = dict(cell=list(cell_indices(*spec)), repF=int(repF), seed=int(self.seed),
+                      simMap=self.sim_map_digest(), code=code_digest())
+        if tol is not None:
+            config['adaptive'] = dict(tol=float(tol), minRep=int(self.minRep),
+                                      blockSize=int(self.blockSize))
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key + '.npz')
+
+    def cells(self, specs, repF, tol=None):
+        """Results of every cell in ``specs``, simulating only the missing ones.
+
+        With tol, the cells are run adaptively with at most repF replications.
+        """
+        keys = [self.cell_key(spec, repF, tol) for spec in specs]
+        missing = [spec for spec, key in zip(specs, keys) if not os.path.exists(self._path(key))]
+        if missing:
+            if self.verbose:
+                print('Simulating {} of {} cells'.format(len(missing), len(specs)))
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root)
+            if tol is None:
+                computed = compute_cells(missing, repF, self.seed, self.simMapPath,
+                                         self.workers, self.blockSize)
+            else:
+                computed = compute_cells_adaptive(missing, tol, repF, self.seed, self.simMapPath,
+                                                  self.workers, self.blockSize, self.minRep)
+            for spec, cell in zip(missing, computed):
+                path = self._path(self.cell_key(spec, repF, tol))
+                # Write then rename, so an interrupted run never leaves a partial cell
+                tmp = path + '.tmp.npz'
+                np.savez(tmp, **cell)
+                os.replace(tmp, path)
+        out = []
+        for key in keys:
+            with np.load(self._path(key)) as f:
+                out.append({name: f[name] for name in f.files})
+        return out
+
+    def main_results(self, TRes=TRES, listSigmaC=LIST_SIGMA_C, repF=1000, ktRR=0.07, kepRR=0.5,
+                     tol=None):
+        """The variables of ``simResults.mat`` (see mainsim.assemble_main).
+
+        With tol, as ``mainsim.run_main_simulation`` with tol.
+        """
+        cells = self.cells(main_specs(TRes, listSigmaC, ktRR, kepRR), repF, tol)
+        return assemble_main(cells, self.simMap, TRes, listSigmaC, ktRR, kepRR)
+
+    def sweep_results(self, ktRR=None, veRR=None, ktRRNominal=0.07, veRRNominal=0.14,
+                      sigmaC=0.02, TRes=15, repF=1000):
+        """Both reference-parameter sweeps (see sweep.assemble_sweep)."""
+        defaultKt, defaultVe = reference_grid()
+        ktRR = defaultKt if ktRR is None else ktRR
+        veRR = defaultVe if veRR is None else veRR
+        specs = sweep_specs(ktRR, veRR, ktRRNominal, veRRNominal, sigmaC, TRes)
+        cells = {experiment: self.cells(experimentSpecs, repF)
+                 for experiment, experimentSpecs in specs.items()}
+        return assemble_sweep(cells, ktRR, veRR, ktRRNominal, veRRNominal)
+
+    def fig2and3vars(self, TRes=TRES, listSigmaC=LIST_SIGMA_C, repF=1000, tol=None):
+        """Summaries read by the Figure 2 and 3 cells (``fig2andfig3vars.mat``)."""
+        return summarize_fig2_fig3(self.main_results(TRes, listSigmaC, repF, tol=tol),
+                                   self.simMap)
+
+    def fig4vars(self, nGrid=9, sigmaC=0.02, TRes=15, repF=1000, summary='quartile'):
+        """Summaries read by the Figure 4 cells (``fig4vars.mat``)."""
+        ktRR, veRR = reference_grid(nGrid)
+        results = self.sweep_results(ktRR, veRR, sigmaC=sigmaC, TRes=TRes, repF=repF)
+        return summarize_fig4(results, self.simMap, summary=summary)
@@ -0,0 +1,418 @@
+"""Local HTTP server for the data behind the figures.
+
+Serves, from the converted array stores (see ``rriftpy.mapstore`` and
+``rriftpy.voxelstore``), only what a page asks for:
+
+* ``/studies`` - per study the volume shape, map names and attributes,
+  or an ``error`` if its store cannot be read;
+* ``/summary/<study>`` - the attributes, the number of tumour voxels and
+  the quartiles of every map over them;
+* ``/maps/<study>/<map>/<z>.json`` (rows, ``null`` for NaN) or ``.bin``
+  (little-endian float64, row-major) - one slice of a map;
+* ``/tiles/<study>/<map>/<z>/<factor>/<row>_<col>.json`` - a tile of the
+  pyramid of ``rriftpy.pyramid``, made on request, so that its viewer
+  pages can point at the server (``--data-url``) instead of written tiles;
+  only the factors of the pyramid (``--factors``) are served;
+* ``/curves/<study>/<z>/<row>/<col>.json`` - t, Cp, Crr and the Ct of one
+  voxel (0-based indices, negative concentrations set to zero as in c02),
+  and for the stores of ``rriftpy.inspector`` its ETM and RRIFT fits and
+  parameters;
+* any other path - a file under the root directory (e.g. ``figures``);
+  if the client accepts it, its brotli or gzip variant (``.br``, ``.gz``,
+  see ``rriftpy.static``) is sent instead, and files named by their
+  content hash may be cached for a year without revalidation.
+
+Every response has an ETag derived from the path and the modification
+times and sizes of the files it is made from, and their latest
+modification time as Last-Modified; a request that matches either (If-
+None-Match, If-Modified-Since) gets an empty 304 without the data being
+read. Single byte ranges (``Range: bytes=...``) get 206 responses, and
+every response allows cross-origin requests, so that pages opened from
+anywhere can fetch from the server. Errors are JSON too: 404 for what
+does not exist and 500, with the traceback in the server log, for a
+request that fails. Only the standard library is used.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.dataserver --root figures --maps-dir maps --vox-dir vox --port 8000
+"""
+
+import argparse
+import collections
+import email.utils
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import traceback
+from functools import lru_cache
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+
+from . import __version__
+from .inspector import find_voxel, voxel_curves
+from .mapstore import EXTENSION as MAPS_EXTENSION, MapFile
+from .pyramid import FACTORS, TILE_SIZE, block_mean, json_image
+from .static import HASH_LENGTH, SUFFIXES
+from .stats import quantile
+from .voxelstore import EXTENSION as VOX_EXTENSION, VoxelStore
+
+# A response: the files it is made from, its content type, a function making its
+# body, and its content coding (None: identity) and Cache-Control
+Resource = collections.namedtuple('Resource', 'sources contentType build encoding cacheControl')
+Resource.__new__.__defaults__ = (None, 'no-cache')
+JSON_TYPE = 'application/json'
+# Files named by rriftpy.static, whose content never changes under that name
+HASHED_NAME = re.compile(r'\.[0-9a-f]{%d}\.[^./]+$' % HASH_LENGTH)
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class NotFound(Exception):
+    pass
+
+
+@lru_cache(maxsize=64)
+def _map_file(path, mtime):
+    return MapFile(path)
+
+
+@lru_cache(maxsize=16)
+def _voxel_store(path, mtime):
+    return VoxelStore(path)
+
+
+def map_file(path):
+    """MapFile of a ``.maps`` file, reopened only when the file changes."""
+    return _map_file(path, os.path.getmtime(path))
+
+
+def voxel_store(path):
+    """VoxelStore of a ``.vox`` directory, reopened only when it changes."""
+    return _voxel_store(path, os.path.getmtime(os.path.join(path, 'meta.json')))
+
+
+@lru_cache(maxsize=256)
+def _level(path, mtime, name, z, factor):
+    f = map_file(path)
+    return block_mean(f.read_slice(name, z), factor, f.read_slice('maskCt', z))
+
+
+def _json(x):
+    return json.dumps(x, separators=(',', ':')).encode()
+
+
+class DataServer(ThreadingMixIn, HTTPServer):
+    """HTTP server of the map and voxel stores and of the files under root.
+
+    mapsDir holds ``<study>.maps`` files and voxDir ``<study>.vox`` stores;
+    either may be None, and their routes then answer 404. tileSize and
+    factors are those of the pyramid (see pyramid.TILE_SIZE and FACTORS);
+    tiles of other factors answer 404.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, root=None, mapsDir=None, voxDir=None, tileSize=TILE_SIZE,
+                 factors=FACTORS):
+        HTTPServer.__init__(self, address, DataHandler)
+        self.root = os.path.realpath(root) if root else None
+        self.mapsDir, self.voxDir, self.tileSize = mapsDir, voxDir, tileSize
+        self.factors = frozenset(int(factor) for factor in factors)
+        self.routes = [
+            (re.compile(r'^/studies$'), self.studies),
+            (re.compile(r'^/summary/(?P<study>[\w.-]+)$'), self.summary),
+            (re.compile(r'^/maps/(?P<study>[\w.-]+)/(?P<name>\w+)/(?P<z>\d+)\.(?P<fmt>json|bin)$'),
+             self.map_slice),
+            (re.compile(r'^/tiles/(?P<study>[\w.-]+)/(?P<name>\w+)/(?P<z>\d+)/(?P<factor>\d+)/'
+                        r'(?P<row>\d+)_(?P<col>\d+)\.json$'), self.tile),
+            (re.compile(r'^/curves/(?P<study>[\w.-]+)/(?P<z>\d+)/(?P<row>\d+)/(?P<col>\d+)\.json$'),
+             self.curves),
+        ]
+
+    def resource(self, path, encodings=()):
+        """The Resource of a URL path; raises NotFound.
+
+        encodings are the content codings the client accepts, for the
+        precompressed variants of static files.
+        """
+        for pattern, route in self.routes:
+            match = pattern.match(path)
+            if match:
+                return route(**match.groupdict())
+        return self.static(path, encodings)
+
+    def _study_file(self, directory, study, extension):
+        path = os.path.join(directory or '', study + extension)
+        if directory is None or study.startswith('.') or not os.path.exists(path):
+            raise NotFound(study)
+        return path
+
+    def _maps(self, study, name, z):
+        path = self._study_file(self.mapsDir, study, MAPS_EXTENSION)
+        f = map_file(path)
+        if name not in f.names or not 0 <= int(z) < f.shape[2]:
+            raise NotFound('{}/{}/{}'.format(study, name, z))
+        return path, f
+
+    def studies(self):
+        paths = sorted(os.path.join(self.mapsDir, name) for name in os.listdir(self.mapsDir)
+                       if name.endswith(MAPS_EXTENSION)) if self.mapsDir else []
+
+        def build():
+            out = {}
+            for path in paths:
+                study = os.path.basename(path)[:-len(MAPS_EXTENSION)]
+                try:
+                    f = map_file(path)
+                except Exception:
+                    # One broken store must not hide the others
+                    out[study] = dict(error='cannot read ' + os.path.basename(path))
+                    continue
+                out[study] = dict(shape=f.shape, maps=f.names, attrs=f.attrs)
+            return _json(out)
+        return Resource(paths + ([self.mapsDir] if self.mapsDir else []), JSON_TYPE, build)
+
+    def summary(self, study):
+        path = self._study_file(self.mapsDir, study, MAPS_EXTENSION)
+
+        def build():
+            f = map_file(path)
+            mask = f.read('maskCt').astype(bool)
+            quartiles = {name: json_image(quantile(f.read(name)[mask], [0.25, 0.5, 0.75]))
+                         for name in f.names if name != 'maskCt'}
+            return _json(dict(shape=f.shape, attrs=f.attrs, voxels=int(mask.sum()),
+                              quartiles=quartiles))
+        return Resource([path], JSON_TYPE, build)
+
+    def map_slice(self, study, name, z, fmt):
+        path, f = self._maps(study, name, z)
+
+        def build():
+            x = np.asarray(f.read_slice(name, int(z)), dtype=float)
+            return _json(json_image(x)) if fmt == 'json' else x.astype('<f8').tobytes()
+        return Resource([path], JSON_TYPE if fmt == 'json' else 'application/octet-stream',
+                        build)
+
+    def tile(self, study, name, z, factor, row, col):
+        # Any other factor would make a level of its own, of any size
+        if int(factor) not in self.factors:
+            raise NotFound('no level with factor ' + factor)
+        path, _ = self._maps(study, name, z)
+        tileSize = self.tileSize
+        row, col = int(row) * tileSize, int(col) * tileSize
+
+        def build():
+            image = _level(path, os.path.getmtime(path), name, int(z), int(factor))
+            if row >= image.shape[0] or col >= image.shape[1]:
+                raise NotFound('tile outside the image')
+            return _json(json_image(image[row:row + tileSize, col:col + tileSize]))
+        return Resource([path], JSON_TYPE, build)
+
+    def curves(self, study, z, row, col):
+        path = self._study_file(self.voxDir, study, VOX_EXTENSION)
+
+        def build():
+            store = voxel_store(path)
+            k = find_voxel(store, int(z), int(row), int(col))
+            if k is None:
+                raise NotFound('voxel not in maskCt')
+            out = voxel_curves(store, k)
+            if 'params' in out:
+                out['params'] = dict(zip(out['params'], json_image(list(out['params'].values()))))
+            return _json({name: json_image(x) if isinstance(x, np.ndarray) else x
+                          for name, x in out.items()})
+        return Resource([os.path.join(path, name) for name in ('meta.json', 'Ct.npy', 'vars.npz')],
+                        JSON_TYPE, build)
+
+    def static(self, path, encodings=()):
+        if self.root is None:
+            raise NotFound(path)
+        filePath = os.path.realpath(os.path.join(self.root, posixpath.normpath(path).lstrip('/')))
+        if os.path.isdir(filePath):
+            filePath = os.path.join(filePath, 'index.html')
+        if not (filePath == self.root or filePath.startswith(self.root + os.sep)) or \
+                not os.path.isfile(filePath):
+            raise NotFound(path)
+
+        contentType = mimetypes.guess_type(filePath)[0] or 'application/octet-stream'
+        cacheControl = IMMUTABLE if HASHED_NAME.search(filePath) else 'no-cache'
+        encoding = None
+        for coding, suffix in SUFFIXES:
+            if coding in encodings and os.path.isfile(filePath + suffix):
+                encoding, filePath = coding, filePath + suffix
+                break
+
+        def build():
+            with open(filePath, 'rb') as fid:
+                return fid.read()
+        return Resource([filePath], contentType, build, encoding, cacheControl)
+
+
+def accepted_encodings(header):
+    """Content codings of an Accept-Encoding header, without those with q=0."""
+    codings = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.partition(';')
+        q = re.search(r'q=([0-9.]+)', params)
+        if coding.strip() and not (q and float(q.group(1)) == 0):
+            codings.add(coding.strip().lower())
+    return codings
+
+
+def byte_range(header, size):
+    """(start, stop) of a single ``bytes=`` range of a body of size bytes.
+
+    Returns None for no or an unsupported (e.g. multi-part) range, which
+    is answered with the whole body, and raises ValueError if the range is
+    not satisfiable.
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)$', (header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, stop = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        stop = min(int(last) + 1, size) if last else size
+    if start >= size or stop <= start:
+        raise ValueError('unsatisfiable range')
+    return start, stop
+
+
+class DataHandler(BaseHTTPRequestHandler):
+    server_version = 'rriftpy-dataserver/' + __version__
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def do_OPTIONS(self):
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Headers', 'Range, If-None-Match')
+        self.end_headers()
+
+    def send_error_json(self, status, message):
+        data = _json(dict(error=message))
+        self.send_response(status)
+        self.send_header('Content-Type', JSON_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def send_server_error(self, path):
+        self.log_error('%s failed:\n%s', path, traceback.format_exc())
+        self.send_error_json(HTTPStatus.INTERNAL_SERVER_ERROR, 'server error: ' + path)
+
+    def respond(self, body=True):
+        path = unquote(urlsplit(self.path).path)
+        try:
+            resource = self.server.resource(
+                path, accepted_encodings(self.headers.get('Accept-Encoding')))
+            stats = [os.stat(source) for source in resource.sources]
+        except (NotFound, OSError):
+            return self.send_error_json(HTTPStatus.NOT_FOUND, 'not found: ' + path)
+        except Exception:
+            return self.send_server_error(path)
+        seed = path + ''.join('{}:{}:{};'.format(source, s.st_mtime_ns, s.st_size)
+                              for source, s in zip(resource.sources, stats))
+        etag = '"{}"'.format(hashlib.sha1(seed.encode()).hexdigest()[:20])
+        mtime = int(max([s.st_mtime for s in stats] or [0]))
+        headers = [('ETag', etag), ('Last-Modified', email.utils.formatdate(mtime, usegmt=True)),
+                   ('Cache-Control', resource.cacheControl), ('Access-Control-Allow-Origin', '*'),
+                   ('Access-Control-Expose-Headers', 'ETag, Content-Range'),
+                   ('Vary', 'Accept-Encoding')]
+        if resource.encoding:
+            headers.append(('Content-Encoding', resource.encoding))
+
+        if self.not_modified(etag, mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            for header in headers:
+                self.send_header(*header)
+            return self.end_headers()
+        try:
+            data = resource.build()
+        except NotFound as e:
+            return self.send_error_json(HTTPStatus.NOT_FOUND, str(e))
+        except Exception:
+            return self.send_server_error(path)
+
+        status = HTTPStatus.OK
+        ifRange = self.headers.get('If-Range')
+        if ifRange is None or ifRange == etag:
+            try:
+                span = byte_range(self.headers.get('Range'), len(data))
+            except ValueError:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                for header in headers:
+                    if header[0] != 'Content-Encoding':  # there is no body to decode
+                        self.send_header(*header)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                return self.end_headers()
+            if span is not None:
+                status = HTTPStatus.PARTIAL_CONTENT
+                headers.append(('Content-Range', 'bytes {}-{}/{}'.format(
+                    span[0], span[1] - 1, len(data))))
+                data = data[span[0]:span[1]]
+        self.send_response(status)
+        for header in headers + [('Content-Type', resource.contentType),
+                                 ('Content-Length', str(len(data))), ('Accept-Ranges', 'bytes')]:
+            self.send_header(*header)
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def not_modified(self, etag, mtime):
+        # If-None-Match takes precedence over If-Modified-Since (RFC 7232)
+        ifNoneMatch = self.headers.get('If-None-Match')
+        if ifNoneMatch is not None:
+            tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+            return '*' in tags or etag in tags or 'W/' + etag in tags
+        ifModifiedSince = self.headers.get('If-Modified-Since')
+        if ifModifiedSince:
+            try:
+                since = email.utils.parsedate_to_datetime(ifModifiedSince).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return mtime <= since
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--root', default='figures', help='directory of the files served as is')
+    parser.add_argument('--maps-dir', default=None, help='directory of <study>.maps files')
+    parser.add_argument('--vox-dir', default=None, help='directory of <study>.vox stores')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE,
+                        help='of the pyramid tiles, as given to rriftpy.pyramid')
+    parser.add_argument('--factors', type=int, nargs='+', default=list(FACTORS[1:]),
+                        help='downsampling factors of the pyramid besides full resolution')
+    args = parser.parse_args(argv)
+
+    server = DataServer((args.host, args.port), args.root, args.maps_dir, args.vox_dir,
+                        args.tile_size, {1} | set(args.factors))
+    print('Serving on http://{}:{}/'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
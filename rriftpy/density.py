@@ -0,0 +1,121 @@
+"""2-D density images of Figure 5 from the c02 voxel maps.
+
+``fig5vars.mat`` holds the density images of ``c03_showResults.m``, which
+bins the pooled tumour voxels (ETM against each reference region method)
+with ``histogram2(valsA, valsB, 100)`` and shows
+``imgaussfilt(log10(h.Values' + 1), 0.5)``. Here the same images are made
+from ``c02_postprocessed`` for any number of bins, range and set of
+studies: the voxels are binned with one ``bincount`` per method, and both
+the voxel values of every study (keyed on the file's modification time)
+and the finished images (keyed on bins, range, studies and smoothing) are
+cached, so that only the first variant pays for reading the maps.
+
+Usage from a notebook cell::
+
+    from rriftpy.density import cohort_density
+    images, edges = cohort_density(c02Dir, 'Kt', bins=200, range=(0, 0.1))
+"""
+
+import os
+from functools import lru_cache
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from .agreement import LIMITS, PARAMETERS, tumour_values
+from .patients import study_name
+from .postprocess import DEFAULT_POSTPROCESSED_DIR
+
+SIGMA = 0.5  # of the Gaussian smoothing in c03, in bins
+
+
+def histogram2(x, y, bins=100, range=((0, 1), (0, 1))):
+    """Counts of the (x, y) pairs in a bins x bins grid over range, like histogram2.
+
+    The bins are those between ``np.linspace(lo, hi, bins + 1)``, closed on
+    the left except for the last one, which also holds the upper edge;
+    pairs with a NaN or outside the range are left out. x and y may have
+    leading axes, which are kept: the counts are [... x bins x bins], with
+    rows for the x bins (as ``h.Values``).
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    lead = x.shape[:-1]
+    index = np.zeros(x.shape, dtype=np.int64)
+    inside = np.ones(x.shape, dtype=bool)
+    for v, (lo, hi) in zip((x, y), range):
+        with np.errstate(invalid='ignore'):
+            inside &= (v >= lo) & (v <= hi)
+            k = np.floor((v - lo) * (bins / (hi - lo)))
+        k = np.clip(np.where(inside, k, 0), 0, bins - 1).astype(np.int64)
+        # The scaled value can round across an edge; compare with the edges
+        # themselves, so that a value on an edge always opens its bin
+        edges = np.linspace(lo, hi, bins + 1)
+        edges[-1] = np.inf  # the last bin holds the upper edge
+        k -= v < edges[k]
+        k += v >= edges[k + 1]
+        index = index * bins + np.where(inside, k, 0)
+    # Every leading slice gets its own block of bins x bins counts
+    index += np.arange(int(np.prod(lead)), dtype=np.int64).reshape(lead + (1,)) * bins * bins
+    counts = np.bincount(index[inside], minlength=int(np.prod(lead)) * bins * bins)
+    return counts.reshape(lead + (bins, bins))
+
+
+def log_density(counts, sigma=SIGMA):
+    """The image of c03: log10(counts + 1), transposed (y along rows) and smoothed.
+
+    ``sigma`` is that of imgaussfilt (0 for none), with its default
+    3 x 3 kernel and replicated edges.
+    """
+    image = np.log10(np.swapaxes(counts, -1, -2) + 1.0)
+    if sigma:
+        sigmas = (0,) * (image.ndim - 2) + (sigma, sigma)
+        image = gaussian_filter(image, sigmas, mode='nearest', truncate=2.0)
+    return image
+
+
+@lru_cache(maxsize=None)
+def _study_values(path, mtime):
+    return tumour_values(path)
+
+
+def study_values(path):
+    """agreement.tumour_values of a c02 study, cached until the file changes."""
+    return _study_values(os.path.abspath(path), os.path.getmtime(path))
+
+
+@lru_cache(maxsize=64)
+def _cohort_density(files, parameter, bins, range, sigma):
+    p = PARAMETERS.index(parameter)
+    x = np.concatenate([study_values(path)[0][p] for path, _ in files])
+    y = np.concatenate([study_values(path)[1][p] for path, _ in files], axis=-1)
+    counts = histogram2(x, y, bins, (range, range))
+    image = log_density(counts, sigma)
+    edges = np.linspace(range[0], range[1], bins + 1)
+    for x in (image, edges):
+        x.setflags(write=False)  # shared by every caller of the cache
+    return image, edges
+
+
+def cohort_density(inDir=DEFAULT_POSTPROCESSED_DIR, parameter='Kt', bins=100, range=None,
+                   studies=None, sigma=SIGMA):
+    """Figure 5 density images of the pooled tumour voxels, for every method.
+
+    Returns ``(images, edges)``: images [nMethod x bins x bins] in the
+    order of agreement.METHODS, with the reference region values along
+    the rows, and the bin edges (the same for both axes). range defaults
+    to [0, limit] of the parameter (0.2 for Ktrans, as in fig5vars.mat);
+    studies restricts the pooled voxels to these study names. Results are
+    cached on (bins, range, studies, sigma) and the files' modification
+    times; the arrays are read-only.
+    """
+    paths = sorted(os.path.join(inDir, name) for name in os.listdir(inDir)
+                   if name.endswith('.mat'))
+    if studies is not None:
+        paths = [path for path in paths if study_name(path) in set(studies)]
+    if not paths:
+        raise ValueError('no c02 studies in {}'.format(inDir))
+    if range is None:
+        range = (0, LIMITS[PARAMETERS.index(parameter)])
+    files = tuple((os.path.abspath(path), os.path.getmtime(path)) for path in paths)
+    return _cohort_density(files, parameter, int(bins), tuple(float(r) for r in range),
+                           float(sigma))
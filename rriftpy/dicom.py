@@ -0,0 +1,241 @@
+"""DICOM ingest for new TCGA-style studies.
+
+Python version of the reading part of ``x01_dicomReader.m`` (via
+``SortItOutForMe.m`` and ``getDicomImage.m``). Instead of calling dicominfo
+and dicomread on every file in turn, a series is read in two passes:
+
+1. headers only, in a process pool, to sort the files by InstanceNumber and
+   check that they form one consistent series;
+2. pixel data, in a thread pool, decoded straight into a preallocated
+   [sX x sY x sZ x sT] array.
+
+T1 mapping and the conversion to concentration are not part of this stage.
+Needs pydicom.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.dicom --root RRIFT/data/TCGA-GBM --out RRIFT/data/TCGA-GBM-Mat
+"""
+
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from scipy.io import savemat
+
+# Header fields needed to sort and validate a series
+SORT_TAGS = ('SeriesInstanceUID', 'InstanceNumber', 'Rows', 'Columns', 'TriggerTime',
+             'AcquisitionTime', 'FlipAngle')
+# Header fields kept for the later T1 mapping and signal conversion
+HEADER_TAGS = ('PatientID', 'SeriesDescription', 'RepetitionTime', 'EchoTime', 'FlipAngle',
+               'MagneticFieldStrength', 'ContrastBolusAgent', 'PixelSpacing', 'SliceThickness')
+
+
+def _pydicom():
+    try:
+        import pydicom
+    except ImportError:
+        raise ImportError('pydicom is required to read DICOM files')
+    return pydicom
+
+
+def _value(ds, tag):
+    # Plain Python value of a header field (None if missing)
+    value = ds.get(tag)
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)) or type(value).__name__ == 'MultiValue':
+        return [float(v) for v in value]
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value)
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def read_header(path, tags=SORT_TAGS):
+    """Selected fields of one DICOM file, without reading its pixel data."""
+    ds = _pydicom().dcmread(path, stop_before_pixels=True, specific_tags=list(tags))
+    header = {tag: _value(ds, tag) for tag in tags}
+    header['path'] = path
+    return header
+
+
+def read_headers(paths, workers=None):
+    """read_header for every file, parsed in a process pool."""
+    if workers == 1:
+        return list(map(read_header, paths))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_header, paths, chunksize=32))
+
+
+def sort_series(headers):
+    """Sort the headers of one series by InstanceNumber and validate them.
+
+    Raises ValueError if the files come from more than one series, the
+    image sizes differ or the instance numbers are not 1..n without gaps or
+    duplicates, which getDicomImage.m would silently turn into blank or
+    overwritten slices.
+    """
+    if not headers:
+        raise ValueError('no DICOM files')
+    series = {h['SeriesInstanceUID'] for h in headers}
+    if len(series) > 1:
+        raise ValueError('files belong to {} different series'.format(len(series)))
+    sizes = {(h['Rows'], h['Columns']) for h in headers}
+    if len(sizes) > 1:
+        raise ValueError('image sizes differ within the series: {}'.format(sorted(sizes)))
+    missing = [h['path'] for h in headers if h['InstanceNumber'] is None]
+    if missing:
+        raise ValueError('InstanceNumber missing in {} of {} files, e.g. {}'.format(
+            len(missing), len(headers), missing[0]))
+    headers = sorted(headers, key=lambda h: h['InstanceNumber'])
+    instances = [int(h['InstanceNumber']) for h in headers]
+    if instances != list(range(1, len(headers) + 1)):
+        raise ValueError('InstanceNumber is not 1..{} (got {}..{} with {} unique)'.format(
+            len(headers), instances[0], instances[-1], len(set(instances))))
+    return headers
+
+
+def acquisition_times(headers):
+    """TriggerTime of every frame, or AcquisitionTime if there is none (as getDicomImage.m)."""
+    return np.array([h['TriggerTime'] if h['TriggerTime'] is not None
+                     else float(h['AcquisitionTime']) for h in headers])
+
+
+def decode_series(headers, shape=None, dtype=np.float32, workers=None):
+    """Decode the pixel data of sorted headers into one preallocated array.
+
+    Frame k (0-based, in InstanceNumber order) goes to ``[:, :, k]`` or, when
+    ``shape`` = (sX, sY, sZ, sT) is given, to ``[:, :, k % sZ, k // sZ]`` -
+    the layout of reshaping the stack in MATLAB. Files are decoded in a
+    thread pool and written in place.
+    """
+    pydicom = _pydicom()
+    sX, sY = int(headers[0]['Rows']), int(headers[0]['Columns'])
+    if shape is None:
+        shape = (sX, sY, len(headers))
+    if np.prod(shape[2:]) != len(headers):
+        raise ValueError('shape {} does not match {} frames'.format(shape, len(headers)))
+    # Column-major, so that the frame stack below is a view of imgData
+    imgData = np.zeros(shape, dtype=dtype, order='F')
+    stack = imgData.reshape((sX, sY, -1), order='F')
+
+    def decode(k):
+        stack[:, :, k] = pydicom.dcmread(headers[k]['path']).pixel_array
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(decode, range(len(headers))))
+    return imgData
+
+
+def read_series(dcmDir, workers=None):
+    """Sorted and validated headers of the ``*.dcm`` files in ``dcmDir``."""
+    return sort_series(read_headers(sorted(glob.glob(os.path.join(dcmDir, '*.dcm'))), workers))
+
+
+def full_header(path):
+    """The HEADER_TAGS of one file, e.g. to save along with the images."""
+    header = read_header(path, HEADER_TAGS)
+    del header['path']
+    return {k: v for k, v in header.items() if v is not None}
+
+
+def read_visit(dcePath, vfaPath, workers=None):
+    """Read the DCE and variable flip angle series of one visit, see SortItOutForMe.m.
+
+    Returns a dict with dceData [sX x sY x sZ x sT], t [sT] in minutes,
+    flipData [sX x sY x sZ x sF], flipAngles [sZ x sF] and the dceHdr and
+    vfaHdr fields of HEADER_TAGS.
+    """
+    vfa = read_series(vfaPath, workers)
+    flipAngles = np.array([h['FlipAngle'] for h in vfa], dtype=float)
+    sF = len(np.unique(flipAngles))
+    if len(vfa) % sF:
+        # As SortItOutForMe.m: drop a leading extra 5-degree acquisition,
+        # before any pixel data is read
+        estSZ = int(np.sum(flipAngles == 5))
+        vfa, flipAngles = vfa[estSZ:], flipAngles[estSZ:]
+        sF = len(np.unique(flipAngles))
+        if len(vfa) % sF:
+            raise ValueError('Mismatch between number of slices in flip angle data')
+    sZ = len(vfa) // sF
+    sX, sY = int(vfa[0]['Rows']), int(vfa[0]['Columns'])
+
+    dce = read_series(dcePath, workers)
+    if (int(dce[0]['Rows']), int(dce[0]['Columns'])) != (sX, sY):
+        raise ValueError('DCE and flip angle images differ in size')
+    if len(dce) % sZ:
+        raise ValueError('Mismatch between number of slices in DCE data')
+    sT = len(dce) // sZ
+
+    acqTime = acquisition_times(dce)
+    timeStep = acqTime[sZ] - acqTime[0]
+    return dict(dceData=decode_series(dce, (sX, sY, sZ, sT), workers=workers),
+                t=timeStep * np.arange(1, sT + 1) / 60 / 1000,
+                flipData=decode_series(vfa, (sX, sY, sZ, sF), workers=workers),
+                flipAngles=flipAngles.reshape((sZ, sF), order='F'),
+                dceHdr=full_header(dce[-1]['path']), vfaHdr=full_header(vfa[-1]['path']))
+
+
+def ingest(rootDir, outDir, workers=None, verbose=True):
+    """Read every patient and visit under ``rootDir``, as x01_dicomReader.m.
+
+    The layout is rootDir/<patient>/<visit>/{*DYN*, *T1 MAP*}/*.dcm. Each
+    visit is saved as <patient>-<q>.mat in outDir/DCE (dceData, dceHdr, t)
+    and outDir/T1 (flipData, flipAngles, vfaHdr), the folders of x01; the
+    t1Data and m0Data that x01 adds to the T1 file come from the T1 mapping,
+    which is not part of this stage. Visits that already have a DCE file
+    are skipped.
+    """
+    outDirDCE = os.path.join(outDir, 'DCE')
+    outDirT1 = os.path.join(outDir, 'T1')
+    for d in (outDirDCE, outDirT1):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+    for curPatient in sorted(os.listdir(rootDir)):
+        patientPath = os.path.join(rootDir, curPatient)
+        for q, visit in enumerate(sorted(os.listdir(patientPath)), start=1):
+            curName = '{}-{}.mat'.format(curPatient, q)
+            if os.path.exists(os.path.join(outDirDCE, curName)):
+                continue
+            visitPath = os.path.join(patientPath, visit)
+            dceDir = sorted(glob.glob(os.path.join(visitPath, '*DYN*')))
+            vfaDir = sorted(glob.glob(os.path.join(visitPath, '*T1 MAP*')))
+            if not dceDir:
+                raise ValueError('Could not find DCE data in ' + visitPath)
+            if not vfaDir:
+                raise ValueError('Could not find variable flip angle data in ' + visitPath)
+            tic = time.time()
+            visitData = read_visit(dceDir[0], vfaDir[0], workers)
+            # Saved as single, like x01, to save disk space
+            savemat(os.path.join(outDirT1, curName),
+                    {k: visitData[k] for k in ('flipData', 'flipAngles', 'vfaHdr')},
+                    do_compression=True)
+            savemat(os.path.join(outDirDCE, curName),
+                    {k: visitData[k] for k in ('dceData', 'dceHdr', 't')},
+                    do_compression=True, oned_as='column')
+            if verbose:
+                print('{} ({:.1f} s)'.format(curName, time.time() - tic))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--root', default=os.path.join('RRIFT', 'data', 'TCGA-GBM'))
+    parser.add_argument('--out', default=os.path.join('RRIFT', 'data', 'TCGA-GBM-Mat'))
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    tic = time.time()
+    ingest(args.root, args.out, args.workers)
+    print('Done reading DICOM data in {:.1f} s'.format(time.time() - tic))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""RRIFT and the ETM on temporally downsampled in-vivo data.
+
+Python version of ``c06_doRRIFT_downsampled.m``. Every (patient, dFactor)
+pair is an independent task, so the tasks are spread over a process pool.
+Within a task each voxel is downsampled with its own random phase, as in
+c06; voxels that share a phase also share the downsampled time, AIF and
+reference curves, so they are fitted together as one batch per phase.
+The phases of a task come from a counter-based stream keyed on the study
+name and dFactor (see ``rriftpy.rng``), so results do not depend on the
+number of workers or the order the tasks run in.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.downsampled --workers 8
+"""
+
+import argparse
+import os
+import time
+import traceback
+import zlib
+from functools import lru_cache
+
+import numpy as np
+from scipy.io import savemat
+
+from . import models
+from .patients import DEFAULT_PREPROCESSED_DIR, list_studies, load_preprocessed, study_name
+from .rng import cell_generator
+from .taskpool import run_tasks
+
+DEFAULT_DOWNSAMPLED_DIR = os.path.join('RRIFT', 'data', 'TCGA-GBM-Results', 'c06_downsampled')
+D_FACTORS = tuple(range(1, 11))
+TAIL_START = 3  # minutes
+# Study variables that save_downsampled writes along with the fits
+STUDY_FIELDS = ('maskCt', 'Cp', 'Crr', 't')
+
+# Tasks are submitted study by study, so a worker mostly runs several
+# dFactors of a study in a row and loads it once for them; a study is
+# still loaded by up to one process per worker
+cached_study = lru_cache(maxsize=2)(load_preprocessed)
+
+
+def study_index(name):
+    """Stream index of a study, derived from its name only."""
+    return zlib.crc32(name.encode())
+
+
+def fit_dfactor(f, dFactor, rng):
+    """Fit one study downsampled by ``dFactor``, one c06 loop iteration.
+
+    f is a study from load_preprocessed and rng the task's stream. Returns
+    pkETM [nVox x 3], pkCE [nVox x 5] (already scaled by the RRIFT
+    reference parameters, as c06 saves it), estKtRR, estKtRRPop, estKepRR
+    and TRes (in seconds).
+    """
+    Ct, Cp, Crr, t = f['Ct'], f['Cp'], f['Crr'], f['t']
+    CpPop = models.georgiou_aif(t, t[6])[0]
+    nVox = Ct.shape[1]
+    phaseValues = rng.integers(0, dFactor, nVox)
+    groups = [(phase, np.flatnonzero(phaseValues == phase)) for phase in range(dFactor)]
+    groups = [(phase, voxels) for phase, voxels in groups if voxels.size]
+
+    pkETM = np.zeros((nVox, 3))
+    pkERRM = np.zeros((nVox, 5))
+    for phase, voxels in groups:
+        frames = slice(phase, None, dFactor)
+        curCt = Ct[frames][:, voxels]
+        pkETM[voxels] = models.tofts_llsq(curCt, Cp[frames], t[frames], 1)[0]
+        pkERRM[voxels] = models.errm(curCt, Crr[frames], t[frames])[0]
+    estKepRR = models.estimate_kep_rr(pkERRM)
+
+    pkCE = np.zeros((nVox, 5))
+    for phase, voxels in groups:
+        frames = slice(phase, None, dFactor)
+        pkCE[voxels] = models.cerrm(Ct[frames][:, voxels], Crr[frames], t[frames], estKepRR)[0]
+
+    # RRIFT uses the curves at the first voxel's phase
+    frames = slice(phaseValues[0], None, dFactor)
+    curT, curCp, curCrr, curCpPop = t[frames], Cp[frames], Crr[frames], CpPop[frames]
+    afterTail = curT > TAIL_START
+    if not afterTail.any():
+        raise ValueError('no frame after {} min when downsampled by {} (last frame at {:.2f} min)'
+                         .format(TAIL_START, dFactor, curT[-1]))
+    tail = slice(np.argmax(afterTail), None)
+    estKtRR = models.rrift(curCp[tail], curCrr[tail], curT[tail], estKepRR)[0]
+    estKtRRPop = models.rrift(curCpPop[tail], curCrr[tail], curT[tail], estKepRR)[0]
+
+    pkCE[:, 0] *= estKtRR
+    pkCE[:, 1] *= estKtRR / estKepRR
+    pkCE[:, 3] *= estKtRR
+    return dict(pkETM=pkETM, pkCE=pkCE, estKtRR=estKtRR, estKtRRPop=estKtRRPop,
+                estKepRR=estKepRR, TRes=(curT[1] - curT[0]) * 60)
+
+
+def _task(inFile, dFactor, seed, withStudy=False):
+    # withStudy: also return the STUDY_FIELDS, so the parent need not load the study
+    tic = time.time()
+    f = cached_study(inFile)
+    rng = cell_generator(seed, study_index(study_name(inFile)), dFactor)
+    result = fit_dfactor(f, dFactor, rng)
+    if withStudy:
+        result['study'] = {name: f[name] for name in STUDY_FIELDS}
+    result['seconds'] = time.time() - tic
+    return result
+
+
+def save_downsampled(outFile, f, dFactors, results):
+    """Write one study in the layout of the c06_downsampled files.
+
+    f holds the STUDY_FIELDS of the study and results the fit_dfactor
+    output for each of dFactors.
+    """
+    savemat(outFile, dict(
+        dFactors=np.array(dFactors, dtype=float)[None, :],
+        TRes=np.array([r['TRes'] for r in results])[None, :],
+        estKtRRs=np.array([r['estKtRR'] for r in results])[None, :],
+        estKtRRsPop=np.array([r['estKtRRPop'] for r in results])[None, :],
+        estKepRRs=np.array([r['estKepRR'] for r in results])[None, :],
+        maskCt=f['maskCt'],
+        pkETM=np.stack([r['pkETM'] for r in results], axis=-1),
+        pkCE=np.stack([r['pkCE'] for r in results], axis=-1),
+        Crr=f['Crr'][:, None], Cp=f['Cp'][:, None], t=f['t'][:, None]),
+        do_compression=True)
+
+
+def run_downsampled(inDir=DEFAULT_PREPROCESSED_DIR, outDir=DEFAULT_DOWNSAMPLED_DIR,
+                    dFactors=D_FACTORS, seed=12345, workers=None, verbose=True):
+    """Run c06 for every study in ``inDir`` and write ``c06_downsampled``.
+
+    Each study is saved as soon as all of its dFactors are done. A failing
+    task, or one that kills its worker process, is reported and only its
+    study is left unsaved; the tasks lost with the pool are run again (see
+    taskpool.run_tasks). Returns a report per study with its status and
+    the summed task run time.
+    """
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    inFiles = list_studies(inDir)
+    dFactors = list(dFactors)
+    results = {inFile: {} for inFile in inFiles}
+    studies = {}
+    reports = {inFile: dict(study=study_name(inFile), status='ok', seconds=0.0, error='')
+               for inFile in inFiles}
+
+    def finished(inFile, dFactor, result=None, error=None):
+        # Collect a task's result; save and report the study once it is complete
+        report = reports[inFile]
+        if error is None:
+            report['seconds'] += result.pop('seconds')
+            if 'study' in result:
+                studies[inFile] = result.pop('study')
+            results[inFile][dFactor] = result
+            if len(results[inFile]) < len(dFactors):
+                return
+            try:
+                save_downsampled(os.path.join(outDir, study_name(inFile) + '.mat'),
+                                 studies.pop(inFile), dFactors,
+                                 [results[inFile][d] for d in dFactors])
+            except Exception:
+                error = traceback.format_exc()
+        if error is not None:
+            report['status'] = 'failed'
+            report['error'] = error
+        results[inFile] = None
+        studies.pop(inFile, None)
+        if verbose:
+            print('{study}: {status} ({seconds:.1f} s)'.format(**report))
+            if report['error']:
+                print(report['error'])
+
+    tasks = [(inFile, dFactor) for inFile in inFiles for dFactor in dFactors]
+    if workers == 1:
+        for inFile, dFactor in tasks:
+            if results[inFile] is None:
+                continue
+            try:
+                finished(inFile, dFactor,
+                         _task(inFile, dFactor, seed, dFactor == dFactors[0]))
+            except Exception:
+                finished(inFile, dFactor, error=traceback.format_exc())
+    else:
+        for (inFile, dFactor), result, error in run_tasks(
+                _task, [(task, task + (seed, task[1] == dFactors[0])) for task in tasks],
+                workers):
+            if results[inFile] is not None:
+                finished(inFile, dFactor, result, error)
+    return [reports[inFile] for inFile in inFiles]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--in-dir', default=DEFAULT_PREPROCESSED_DIR)
+    parser.add_argument('--out-dir', default=DEFAULT_DOWNSAMPLED_DIR)
+    parser.add_argument('--max-factor', type=int, default=D_FACTORS[-1],
+                        help='downsample by 1..max-factor')
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    tic = time.time()
+    reports = run_downsampled(args.in_dir, args.out_dir, range(1, args.max_factor + 1),
+                              args.seed, args.workers)
+    failed = [r['study'] for r in reports if r['status'] == 'failed']
+    print('Processed {} studies in {:.1f} s, {} failed{}'.format(
+        len(reports), time.time() - tic, len(failed), ': ' + ', '.join(failed) if failed else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
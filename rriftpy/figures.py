@@ -0,0 +1,687 @@
+"""Figures 5, 6 and 9 of the notebook.
+
+The CCC and Pearson's r annotations of Figure 5 come from
+``rriftpy.agreement`` (with bootstrap CIs) when the c02 results are
+available, and otherwise from the values saved in ``fig5vars.mat``; so do
+the density images (see ``rriftpy.density``, for any bins and range). With
+the c02 results, ``fig5_voxels`` also shows every tumour voxel as a point
+(WebGL scatter, one trace per study so that outliers can be traced back);
+above ``MAX_SCATTER_POINTS`` points per method it bins them into a log
+count image instead, like the density images of fig5vars.mat.
+
+The map images in ``fig6pat*.mat`` and the slices of ``fig9patient*.mat``
+are mostly zero background around the tumour. Before the heatmaps are
+embedded, every patient's images are cropped to the union bounding box of
+the non-zero pixels of all its maps (see AutoCrop.m), so that the three
+parameter figures of a patient show the same region. The box is computed
+once per patient file and cached. The axes keep the pixel coordinates of
+the uncropped images.
+
+Figures are plain plotly dicts; ``write_html`` embeds them in a page like
+``plotly.offline.plot`` does, so plotly itself is only needed to embed
+plotly.js (``--plotlyjs cdn`` loads it from the CDN instead). The pages
+with a dropdown are built by ``map_dropdown`` from the panel images of
+every option (e.g. patient): the heatmaps, their shared colour axis and
+the visibility mask of every option. With ``--swap`` each panel holds a
+single heatmap and the dropdown replaces its data from a per-patient
+payload (see ``swap_payload``) instead of toggling hidden traces. The time
+spent reading, cropping, building and writing each page is printed.
+
+With ``--inspect-url``, clicking a pixel of a Figure 9 page fetches the
+curves of that voxel (Ct and its ETM and RRIFT fits, see
+``rriftpy.inspector``) from a ``rriftpy.dataserver`` at that URL and plots
+them under the maps.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.figures --out figures \
+        --agreement-dir RRIFT/data/TCGA-GBM-Results/c02_postprocessed
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from scipy.io import loadmat
+
+from .agreement import (LIMITS, METHOD_TITLES, METHODS, PARAMETERS as AGREEMENT_PARAMETERS,
+                        annotation, cohort_agreement)
+from .density import cohort_density, histogram2, log_density, study_values
+from .patients import list_studies, study_name
+from .postprocess import DEFAULT_POSTPROCESSED_DIR
+from .sparsemap import SparseMap, dense_slice
+
+CONFIG = {'showLink': False, 'displayModeBar': False}
+PLOTLYJS_CDN = 'https://cdn.plot.ly/plotly-1.58.4.min.js'  # the version bundled with plotly 4.14
+HOVER = 'z: %{z}<extra></extra>'
+CROP_PAD = 1  # pixels of background kept around the tumour
+MAX_SCATTER_POINTS = 500000  # per method; above, fig5_voxels bins the voxels instead
+SCATTER_DECIMALS = 5  # values are rounded to keep the embedded JSON short
+
+# Patients 1 and 2 of Figure 6 have no data
+FIG6_PATIENTS = (3, 4, 5, 6, 7, 8)
+FIG9_PATIENTS = (1, 2, 3, 7, 8)
+# (file names, subplot titles, colour limits, colour bar title) of every figure
+FIG6 = {
+    'Ktrans': (('Ktrans_image_12', 'Ktrans_image_13', 'Ktrans_image_22', 'Ktrans_image_23'),
+               (0, 0.16), 'K<sup>trans</sup>[min<sup>-1</sup>]'),
+    'Ve': (('Ve_image_12', 'Ve_image_13', 'Ve_image_22', 'Ve_image_23'),
+           (0, 0.6), 'v<sub>e</sub>'),
+    'Vp': (('Vp_image_12', 'Vp_image_13', 'Vp_image_22', 'Vp_image_23'),
+           (0, 0.1), 'v<sub>p</sub>'),
+}
+FIG6_TITLES = ('ETM', 'ETM', 'RRIFT', 'RRIFT')
+FIG9 = {
+    'Ktrans': (('mapKtE1', 'mapKtR1', 'mapKtE2', 'mapKtR2'),
+               (0, 0.15), 'K<sup>trans</sup>[min<sup>-1</sup>]'),
+    'Ve': (('mapVeE1', 'mapVeR1', 'mapVeE2', 'mapVeR2'), (0, 0.5), 'v<sub>e</sub>'),
+    'Vp': (('mapVpE1', 'mapVpR1', 'mapVpE2', 'mapVpR2'), (0, 0.15), 'v<sub>p</sub>'),
+}
+FIG9_TITLES = ('ETM', 'RRIFT', 'ETM', 'RRIFT')
+PARAMETERS = ('Ktrans', 'Ve', 'Vp')
+# Density image and (CCC, Pearson's r) of every Figure 5 method, in the order of METHODS
+FIG5 = (('RRM_assumed_Ktrans_RR', 'overlay_assumed_Ktrans_RR'),
+        ('RRIFT_assumed_AIF_tail', 'overlay_assumed_AIF_tail'),
+        ('RRIFT_measured_AIF_tail', 'overlay_measured_AIF_tail'))
+
+
+def fig6_file(patient, dataDir=os.curdir):
+    return os.path.join(dataDir, 'fig6pat{}.mat'.format(patient))
+
+
+def fig9_file(patient, dataDir=os.curdir):
+    return os.path.join(dataDir, 'fig9patient{}.mat'.format(patient))
+
+
+def read_images(path, names=None):
+    """The 2-D images of a figure file, NaNs set to 0 as in the notebook.
+
+    3-D maps are reduced to the slice the file shows (``myS``, 1-based).
+    Returns a dict of name -> image for ``names`` (default: every map).
+    """
+    f = {k: v for k, v in loadmat(path).items() if not k.startswith('__')}
+    z = int(np.squeeze(f.pop('myS'))) - 1 if 'myS' in f else None
+    names = [k for k, v in f.items() if np.ndim(v) >= 2 and np.size(v) > 1] \
+        if names is None else names
+    images = {}
+    for name in names:
+        x = np.array(dense_slice(f[name], z), dtype=float)
+        x[~np.isfinite(x)] = 0
+        images[name] = x
+    return images
+
+
+def union_bbox(images, pad=0):
+    """(rows, columns) slices around the non-zero pixels of all images.
+
+    The box is grown by ``pad`` pixels on every side and clipped to the
+    largest image; if every image is empty, the box covers the largest one.
+    """
+    shape = np.max([np.shape(x) for x in images], axis=0)
+    boxes = [SparseMap.from_dense(x).bbox() for x in images if np.any(x)]
+    if not boxes:
+        return tuple(slice(0, int(n)) for n in shape)
+    return tuple(slice(max(min(b[k].start for b in boxes) - pad, 0),
+                       min(max(b[k].stop for b in boxes) + pad, int(shape[k])))
+                 for k in range(2))
+
+
+# Crop box of every (figure file, modification time, pad) seen
+_bboxes = {}
+
+
+def patient_bbox(path, pad=CROP_PAD, images=None):
+    """Crop box of a patient: the union over all maps in its figure file (cached).
+
+    images are the maps of the file if they have been read already (all
+    of them, as read_images(path) returns them), so that the file is not
+    read a second time to compute the box.
+    """
+    key = (os.path.abspath(path), os.path.getmtime(path), pad)
+    if key not in _bboxes:
+        if images is None:
+            images = read_images(path)
+        _bboxes[key] = union_bbox(list(images.values()), pad)
+    return _bboxes[key]
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the seconds spent in the block to ``timings[stage]`` (if timings is a dict)."""
+    tic = time.time()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + time.time() - tic
+
+
+def _grid(titles, cols=2, hSpacing=0.1, vSpacing=0.15):
+    # Axes and subplot titles of a make_subplots grid with one panel per title
+    rows = (len(titles) + cols - 1) // cols
+    layout, axes = {'annotations': []}, []
+    width = (1 - hSpacing * (cols - 1)) / cols
+    height = (1 - vSpacing * (rows - 1)) / rows
+    for k, title in enumerate(titles):
+        row, col = divmod(k, cols)
+        suffix = str(k + 1) if k else ''
+        x0 = col * (width + hSpacing)
+        y1 = 1 - row * (height + vSpacing)
+        layout['xaxis' + suffix] = dict(domain=[x0, x0 + width], anchor='y' + suffix,
+                                        showticklabels=False)
+        layout['yaxis' + suffix] = dict(domain=[y1 - height, y1], anchor='x' + suffix,
+                                        autorange='reversed', showticklabels=False,
+                                        scaleanchor='x' + suffix)
+        layout['annotations'].append(dict(text=title, x=x0 + width / 2, y=y1, xref='paper',
+                                          yref='paper', xanchor='center', yanchor='bottom',
+                                          showarrow=False, font=dict(size=16)))
+        axes.append(('x' + suffix, 'y' + suffix))
+    return layout, axes
+
+
+def visibility_masks(nOptions, nPanels):
+    """``visible`` list of every dropdown option, for traces ordered option by option."""
+    return [[k == j for j in range(nOptions) for _ in range(nPanels)] for k in range(nOptions)]
+
+
+def _crop(image, box):
+    # z, y0 and x0 of a heatmap of image cropped to box (None: the whole image)
+    if box is None:
+        return dict(z=image, y0=0, x0=0)
+    return dict(z=image[box], y0=box[0].start, x0=box[1].start)
+
+
+def map_dropdown(options, titles, zLims, colorbarTitle, cols=2, panelSize=350, swap=False,
+                 timings=None):
+    """A grid of heatmaps, one panel per title, with a dropdown to choose the option.
+
+    options is a list of (label, images, box), e.g. one per patient: the
+    panel images (in the order of titles) and the box to crop them to
+    (None to embed them whole). All panels share one colour axis. With
+    swap, every panel has a single trace and the images of each option go
+    into the figure's payload (see write_html) instead of hidden traces.
+    The seconds spent on the traces and the layout are added to ``timings``.
+    """
+    with timed(timings, 'traces'):
+        layout, axes = _grid(titles, cols)
+        data, updates = [], []
+        for k, (label, images, box) in enumerate(options):
+            if len(images) != len(axes):
+                raise ValueError('{}: {} images for {} panels'.format(label, len(images),
+                                                                     len(axes)))
+            panels = [_crop(image, box) for image in images]
+            if swap:
+                updates.append([{key: [panel[key] for panel in panels] for key in panels[0]},
+                                {'title.text': label}])
+                if k:
+                    continue
+            for panel, (xAxis, yAxis) in zip(panels, axes):
+                data.append(dict(panel, type='heatmap', coloraxis='coloraxis',
+                                 hovertemplate=HOVER, visible=k == 0, xaxis=xAxis, yaxis=yAxis))
+    with timed(timings, 'layout'):
+        if swap:
+            buttons = [dict(label=label, method='skip', args=[]) for label, _, _ in options]
+        else:
+            masks = visibility_masks(len(options), len(axes))
+            buttons = [dict(label=label, method='update',
+                            args=[{'visible': mask}, {'title': label}])
+                       for (label, _, _), mask in zip(options, masks)]
+        rows = (len(axes) + cols - 1) // cols
+        layout.update(width=panelSize * cols, height=panelSize * rows,
+                      title={'text': options[0][0]}, plot_bgcolor='rgba(0,0,0,0)',
+                      coloraxis=dict(cmin=zLims[0], cmax=zLims[1], colorscale='Jet',
+                                     colorbar={'title': {'text': colorbarTitle}}),
+                      updatemenus=[dict(active=0, x=0.09, y=1.13, xanchor='left', yanchor='top',
+                                        direction='down', type='dropdown', buttons=buttons)])
+    fig = dict(data=data, layout=layout)
+    if swap:
+        fig['payload'] = swap_payload(updates, range(len(axes)))
+    return fig
+
+
+def swap_payload(updates, traces):
+    """Payload of a figure whose controls swap the data of ``traces``.
+
+    updates holds, for every option of the dropdown or slider, the trace
+    and layout updates ``[traceUpdate, layoutUpdate]`` that Plotly.update
+    applies to the traces when the option is chosen; the controls
+    themselves use method 'skip'. The traces must show the first option,
+    whose data is therefore left out of the payload and read back from
+    them (keys such as 'error_y.array' name nested attributes).
+    """
+    updates = [list(update) for update in updates]
+    keys = list(updates[0][0])
+    updates[0][0] = None
+    return dict(traces=list(traces), keys=keys, options=updates)
+
+
+def patient_options(files, names, crop=True, timings=None):
+    """map_dropdown options of patient figure files: ('Patient n', images, box).
+
+    files is a list of (patient number, path); names are the maps shown in
+    the panels. Reading and cropping are timed as 'read' and 'crop'; to
+    crop, every map of a file is read once and the box computed from them.
+    """
+    options = []
+    for patient, path in files:
+        with timed(timings, 'read'):
+            images = read_images(path, None if crop else names)
+        with timed(timings, 'crop'):
+            box = patient_bbox(path, images=images) if crop else None
+        options.append(('Patient {}'.format(patient), [images[n] for n in names], box))
+    return options
+
+
+def fig5(dataDir=os.curdir, agreement=None, density=None):
+    """Figure 5: ETM vs reference region Ktrans densities, one button per method.
+
+    agreement is a result of agreement.cohort_agreement; without it the
+    annotations show the values saved in fig5vars.mat. density is
+    ``(images, edges)`` from density.cohort_density, to show instead of
+    the images of fig5vars.mat.
+    """
+    f = loadmat(os.path.join(dataDir, 'fig5vars.mat'))
+    if agreement is None:
+        texts = ['CCC: {:.3f} \n ρ: {:.3f}'.format(*f[overlay].ravel()) for _, overlay in FIG5]
+    else:
+        texts = [annotation(agreement, method) for method in METHODS]
+    if density is None:
+        images = [f[image] for image, _ in FIG5]
+        ticks = dict(tickmode='array', tickvals=[0, 25, 50, 75, 100],
+                     ticktext=['0', '0.05', '0.10', '0.15', '0.20'])
+        coords, diagonal = {}, (0, 100)
+    else:
+        images, edges = density
+        ticks = {}
+        coords = dict(x=(edges[:-1] + edges[1:]) / 2, y=(edges[:-1] + edges[1:]) / 2)
+        diagonal = (edges[0], edges[-1])
+    colorbar = dict(tickmode='array', tickvals=[0, 1, 2, 3],
+                    ticktext=['<b>0</b>', '<b>10<sup>1</sup></b>', '<b>10<sup>2</sup></b>',
+                              '<b>10<sup>3</sup></b>'])
+    data = [dict(coords, type='heatmap', z=image, colorscale='Jet', zmin=0, zmax=3,
+                 hovertemplate=HOVER, colorbar=colorbar, visible=k == 0)
+            for k, image in enumerate(images)]
+    annotations = [[dict(text=text, xref='paper', yref='paper', x=0.05, y=0.9, showarrow=False,
+                         font=dict(size=14, color='#fff'))] for text in texts]
+    buttons = [dict(label=title, method='update',
+                    args=[{'visible': mask}, {'title': title, 'annotations': annotations[k]}])
+               for k, (title, mask) in enumerate(zip(METHOD_TITLES,
+                                                     visibility_masks(len(FIG5), 1)))]
+    layout = dict(title={'text': METHOD_TITLES[0]}, annotations=annotations[0],
+                  xaxis=dict(ticks, title={'text': 'ETM - K<sup>trans</sup>[min<sup>-1</sup>]'}),
+                  yaxis=dict(ticks, title={'text': 'K<sup>trans</sup>[min<sup>-1</sup>]'}),
+                  shapes=[dict(type='line', x0=diagonal[0], y0=diagonal[0], x1=diagonal[1],
+                               y1=diagonal[1], line=dict(color='white', width=2, dash='dot'))],
+                  plot_bgcolor='#fff', width=700, height=700,
+                  updatemenus=[dict(active=0, x=0, y=1.076, xanchor='left', yanchor='top',
+                                    direction='right', type='buttons', buttons=buttons)])
+    return dict(data=data, layout=layout)
+
+
+def fig5_voxels(inDir, parameter='Kt', maxPoints=MAX_SCATTER_POINTS, bins=100, agreement=None):
+    """Figure 5 from the voxels of c02_postprocessed, one button per method.
+
+    parameter is 'Kt', 'Ve' or 'Vp' (see agreement.tumour_values). Every
+    finite (ETM, reference region) pair is drawn with scattergl, one trace
+    per study; if a method has more than maxPoints pairs, its voxels are
+    binned into a bins x bins log10(count + 1) image over [0, limit]
+    instead. agreement (from cohort_agreement) adds the annotations.
+    """
+    p = AGREEMENT_PARAMETERS.index(parameter)
+    limit = LIMITS[p]
+    inFiles = sorted(glob.glob(os.path.join(inDir, '*.mat')))
+    studies = [study_name(inFile) for inFile in inFiles]
+    pairs = []  # [study][method] -> (x, y) of the finite pairs
+    for inFile in inFiles:
+        x, y = study_values(inFile)
+        x, y = x[p], y[p]
+        valid = np.isfinite(x) & np.isfinite(y)
+        pairs.append([(x[v], y[k, v]) for k, v in enumerate(valid)])
+
+    data, traceMethod = [], []
+    for k in range(len(METHODS)):
+        if sum(study[k][0].size for study in pairs) > maxPoints:
+            x = np.concatenate([study[k][0] for study in pairs])
+            y = np.concatenate([study[k][1] for study in pairs])
+            image = log_density(histogram2(x, y, bins, ((0, limit), (0, limit))), sigma=0)
+            centres = (np.arange(bins) + 0.5) * (limit / bins)
+            data.append(dict(type='heatmap', z=np.round(image, 3), x=centres,
+                             y=centres, colorscale='Jet', zmin=0, zmax=3, hovertemplate=HOVER,
+                             visible=k == 0))
+            traceMethod.append(k)
+            continue
+        for j, study in enumerate(studies):
+            x, y = pairs[j][k]
+            data.append(dict(type='scattergl', mode='markers', name=study,
+                             x=np.round(x, SCATTER_DECIMALS), y=np.round(y, SCATTER_DECIMALS),
+                             marker=dict(size=3, opacity=0.5), visible=k == 0,
+                             hovertemplate='ETM: %{x}<br>RR: %{y}<extra>%{fullData.name}</extra>'))
+            traceMethod.append(k)
+
+    annotations = [[] for _ in METHODS]
+    if agreement is not None:
+        annotations = [[dict(text=annotation(agreement, method, parameter), xref='paper',
+                             yref='paper', x=0.05, y=0.95, showarrow=False,
+                             font=dict(size=14))] for method in METHODS]
+    buttons = [dict(label=title, method='update',
+                    args=[{'visible': [j == k for j in traceMethod]},
+                          {'title': title, 'annotations': annotations[k]}])
+               for k, title in enumerate(METHOD_TITLES)]
+    axis = dict(range=[0, limit], constrain='domain')
+    layout = dict(title={'text': METHOD_TITLES[0]}, annotations=annotations[0],
+                  xaxis=dict(axis, title={'text': 'ETM'}),
+                  yaxis=dict(axis, title={'text': 'Reference region'}, scaleanchor='x'),
+                  shapes=[dict(type='line', x0=0, y0=0, x1=limit, y1=limit,
+                               line=dict(color='grey', width=2, dash='dot'))],
+                  plot_bgcolor='#fff', width=800, height=700,
+                  updatemenus=[dict(active=0, x=0, y=1.076, xanchor='left', yanchor='top',
+                                    direction='right', type='buttons', buttons=buttons)])
+    return dict(data=data, layout=layout)
+
+
+def fig6(parameter, dataDir=os.curdir, crop=True, swap=False, timings=None):
+    """Figure 6 for 'Ktrans', 'Ve' or 'Vp' (swap: see map_dropdown)."""
+    names, zLims, colorbarTitle = FIG6[parameter]
+    files = [(patient, fig6_file(patient, dataDir)) for patient in FIG6_PATIENTS]
+    return map_dropdown(patient_options(files, names, crop, timings), FIG6_TITLES, zLims,
+                        colorbarTitle, swap=swap, timings=timings)
+
+
+def fig9(parameter, dataDir=os.curdir, crop=True, swap=False, timings=None):
+    """Figure 9 for 'Ktrans', 'Ve' or 'Vp' (swap: see map_dropdown)."""
+    names, zLims, colorbarTitle = FIG9[parameter]
+    files = [(patient, fig9_file(patient, dataDir)) for patient in FIG9_PATIENTS]
+    return map_dropdown(patient_options(files, names, crop, timings), FIG9_TITLES, zLims,
+                        colorbarTitle, swap=swap, timings=timings)
+
+
+def fig9_inspect(url, c02Dir=DEFAULT_POSTPROCESSED_DIR, dataDir=os.curdir):
+    """Voxel inspector of the Figure 9 pages: the 'inspect' entry of a figure.
+
+    Patient q of Figure 9 is the q-th c02 study; its maps are cropped to
+    the rows and columns of maskCt (see AutoCrop.m), which map the pixels
+    of the heatmaps back to the voxels of the study. Curves are fetched
+    from the ``/curves`` route of a rriftpy.dataserver at ``url``.
+
+    Raises ValueError if the maps of a patient do not have the size of the
+    crop of its study, i.e. the c02 directory is not the one of the figure.
+    """
+    studies = list_studies(c02Dir)
+    mapName = FIG9['Ktrans'][0][0]
+    patients = []
+    for patient in FIG9_PATIENTS:
+        path = studies[patient - 1]
+        maskCt = loadmat(path, variable_names=['maskCt'])['maskCt'].astype(bool)
+        rows = np.flatnonzero(maskCt.any(axis=(1, 2)))
+        cols = np.flatnonzero(maskCt.any(axis=(0, 2)))
+        f = loadmat(fig9_file(patient, dataDir), variable_names=['myS', mapName])
+        if np.shape(f[mapName])[:2] != (rows.size, cols.size):
+            raise ValueError('patient {}: {} is {}, but maskCt of {} spans {} x {} voxels'.format(
+                patient, mapName, 'x'.join(map(str, np.shape(f[mapName]))), study_name(path),
+                rows.size, cols.size))
+        patients.append(dict(study=study_name(path), z=int(np.squeeze(f['myS'])) - 1,
+                             rows=rows, cols=cols))
+    return dict(url=url.rstrip('/'), patients=patients)
+
+
+def _json_default(x):
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError('{} is not JSON serializable'.format(type(x).__name__))
+
+
+def to_json(x):
+    """Compact JSON of a figure (or part of one) holding numpy arrays."""
+    return json.dumps(x, separators=(',', ':'), default=_json_default)
+
+
+def plotlyjs_tag(include=True):
+    """Script tag for plotly.js: embedded (needs plotly), 'cdn' or nothing (False)."""
+    if include == 'cdn':
+        return '<script src="{}"></script>'.format(PLOTLYJS_CDN)
+    if not include:
+        return ''
+    try:
+        from plotly.offline import get_plotlyjs
+    except ImportError:
+        raise ImportError("plotly is required to embed plotly.js; use include_plotlyjs='cdn'")
+    return '<script type="text/javascript">{}</script>'.format(get_plotlyjs())
+
+
+# Data of the traces of a swap payload as shown by the first option, and
+# the update of option k
+SWAP_FUNCTIONS = """\
+function swapInitial(data, payload) {
+    var initial = {};
+    payload.keys.forEach(function (key) {
+        initial[key] = payload.traces.map(function (i) {
+            return key.split(".").reduce(function (x, name) { return x[name]; }, data[i]);
+        });
+    });
+    return initial;
+}
+function swapOption(gd, payload, initial, k) {
+    var update = payload.options[k];
+    return Plotly.update(gd, update[0] || initial, update[1], payload.traces);
+}"""
+# Applies payload.options[k] when option k of a dropdown, buttons or slider is chosen
+SWAP_SCRIPT = SWAP_FUNCTIONS + """
+var initial = swapInitial(data, payload);
+Plotly.newPlot(gd, data, layout, config).then(function () {
+    gd.on("plotly_buttonclicked", function (e) { swapOption(gd, payload, initial, e.active); });
+    gd.on("plotly_sliderchange", function (e) {
+        swapOption(gd, payload, initial, e.slider.active);
+    });
+});"""
+# Plots the curves of the voxel under a click on the maps in a second div,
+# for the patient chosen in the dropdown
+INSPECT_SCRIPT = """\
+var curvesDiv = document.getElementById("curves");
+var patient = 0;
+gd.on("plotly_buttonclicked", function (e) { patient = e.active; });
+gd.on("plotly_click", function (e) {
+    var p = inspect.patients[patient], point = e.points[0];
+    var row = p.rows[point.y], col = p.cols[point.x];
+    if (row === undefined || col === undefined) { return; }
+    var title = p.study + ", row " + (row + 1) + ", column " + (col + 1) + ", slice " + (p.z + 1);
+    fetch(inspect.url + "/curves/" + [p.study, p.z, row, col].join("/") + ".json")
+        .then(function (r) { return r.ok ? r.json() : null; })
+        .then(function (c) {
+            var traces = !c ? [] : [
+                {x: c.t, y: c.Ct, mode: "markers", name: "C<sub>t</sub>"},
+                {x: c.t, y: c.etm, mode: "lines", name: "ETM fit"},
+                {x: c.t, y: c.rrift, mode: "lines", name: "RRIFT fit"}
+            ].filter(function (trace) { return trace.y; });
+            Plotly.react(curvesDiv, traces, {
+                title: {text: c ? title : title + ": no curves"}, width: layout.width,
+                height: 350, xaxis: {title: {text: "Time [min]"}},
+                yaxis: {title: {text: "Concentration [mM]"}}
+            }, config);
+        });
+});"""
+# Shows the view named by the URL fragment (default: the first), resolving its
+# references into the shared store of arrays
+VIEWS_SCRIPT = SWAP_FUNCTIONS + """
+function resolve(x) {
+    if (Array.isArray(x)) { return x.map(resolve); }
+    if (x === null || typeof x !== "object") { return x; }
+    if ("@ref" in x) { return store[x["@ref"]]; }
+    var out = {};
+    for (var key in x) { out[key] = resolve(x[key]); }
+    return out;
+}
+var current = {};
+function showView(name) {
+    var view = views.filter(function (v) { return v.name === name; })[0] || views[0];
+    var data = resolve(view.data);
+    current = {payload: view.payload ? resolve(view.payload) : null};
+    if (current.payload) { current.initial = swapInitial(data, current.payload); }
+    views.forEach(function (v) {
+        document.getElementById("view-" + v.name).style.fontWeight =
+            v === view ? "bold" : "normal";
+    });
+    return Plotly.react(gd, data, resolve(view.layout), config);
+}
+function onOption(k) {
+    if (current.payload) { swapOption(gd, current.payload, current.initial, k); }
+}
+showView(location.hash.slice(1)).then(function () {
+    gd.on("plotly_buttonclicked", function (e) { onOption(e.active); });
+    gd.on("plotly_sliderchange", function (e) { onOption(e.slider.active); });
+});
+window.addEventListener("hashchange", function () { showView(location.hash.slice(1)); });"""
+
+
+def _write_page(path, body, script, include_plotlyjs):
+    html = '\n'.join([
+        '<html>', '<head><meta charset="utf-8" /></head>', '<body>'] + body + [
+        plotlyjs_tag(include_plotlyjs),
+        '<script type="text/javascript">'] + script + [
+        '</script>', '</body>', '</html>', ''])
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fid:
+        fid.write(html)
+    os.replace(tmp, path)
+
+
+def write_html(fig, path, config=CONFIG, include_plotlyjs=True, script=None):
+    """Write a figure dict as a stand-alone HTML page.
+
+    A figure with a 'payload' (see swap_payload) gets the script that
+    swaps its traces' data when a control changes, or ``script`` if given:
+    JavaScript that draws the figure from gd, data, layout, config and
+    payload (see pyramid.PYRAMID_SCRIPT). A figure with an 'inspect' entry
+    (see fig9_inspect) also gets a div and the script that plot the curves
+    of a clicked voxel.
+    """
+    lines = ['var gd = document.getElementById("figure");',
+             'var data = {};'.format(to_json(fig['data'])),
+             'var layout = {};'.format(to_json(fig['layout'])),
+             'var config = {};'.format(to_json(config))]
+    if 'payload' in fig:
+        lines += ['var payload = {};'.format(to_json(fig['payload'])), script or SWAP_SCRIPT]
+    else:
+        lines.append(script or 'Plotly.newPlot(gd, data, layout, config);')
+    body = ['<div id="figure"></div>']
+    if 'inspect' in fig:
+        lines += ['var inspect = {};'.format(to_json(fig['inspect'])), INSPECT_SCRIPT]
+        body.append('<div id="curves"></div>')
+    _write_page(path, body, lines, include_plotlyjs)
+
+
+def share_arrays(figs):
+    """Store every distinct numpy array of ``figs`` once.
+
+    Returns ``(store, figs)``: a dict of key -> array, and copies of the
+    figures in which each array is replaced by ``{'@ref': key}``. Arrays
+    with the same dtype, shape and values share a key.
+    """
+    store, keys = {}, {}
+
+    def walk(x):
+        if isinstance(x, np.ndarray):
+            digest = hashlib.sha1(('{}{}'.format(x.dtype.str, x.shape)).encode() +
+                                  np.ascontiguousarray(x).tobytes()).digest()
+            key = keys.setdefault(digest, str(len(keys)))
+            store[key] = x
+            return {'@ref': key}
+        if isinstance(x, dict):
+            return {k: walk(v) for k, v in x.items()}
+        if isinstance(x, (list, tuple)):
+            return [walk(v) for v in x]
+        return x
+
+    return store, [walk(fig) for fig in figs]
+
+
+def write_views_html(views, path, config=CONFIG, include_plotlyjs=True):
+    """Write several figures as views of one page that share their data.
+
+    views is a list of (name, label, fig). The page loads plotly.js and
+    the arrays of all views once (see share_arrays), shows links to the
+    views, and draws the view named by the URL fragment (``page.html#name``),
+    by default the first one. Payloads (see swap_payload) work as in
+    write_html.
+    """
+    store, figs = share_arrays([fig for _, _, fig in views])
+    entries = [dict(name=name, data=fig['data'], layout=fig['layout'],
+                    payload=fig.get('payload')) for (name, _, _), fig in zip(views, figs)]
+    links = ' | '.join('<a id="view-{0}" href="#{0}">{1}</a>'.format(name, label)
+                       for name, label, _ in views)
+    script = ['var gd = document.getElementById("figure");',
+              'var store = {};'.format(to_json(store)),
+              'var views = {};'.format(to_json(entries)),
+              'var config = {};'.format(to_json(config)), VIEWS_SCRIPT]
+    _write_page(path, ['<div id="views">{}</div>'.format(links), '<div id="figure"></div>'],
+                script, include_plotlyjs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--data-dir', default=os.curdir, help='where the fig*.mat files are')
+    parser.add_argument('--out', default='figures')
+    parser.add_argument('--no-crop', action='store_true', help='embed the full images')
+    parser.add_argument('--swap', action='store_true',
+                        help='one trace per panel, whose data the controls swap from a payload')
+    parser.add_argument('--agreement-dir', default=None,
+                        help='c02_postprocessed directory to compute the Figure 5 CCCs from')
+    parser.add_argument('--boot', type=int, default=1000,
+                        help='bootstrap replications for the CCC confidence intervals')
+    parser.add_argument('--bins', type=int, default=100,
+                        help='bins per axis of the Figure 5 densities made with --agreement-dir')
+    parser.add_argument('--range', type=float, nargs=2, default=None,
+                        help='Ktrans range of those densities (default: 0 0.2)')
+    parser.add_argument('--max-points', type=int, default=MAX_SCATTER_POINTS,
+                        help='voxels per method above which fig5-voxels-*.html bins them')
+    parser.add_argument('--plotlyjs', default='embed', choices=['embed', 'cdn'],
+                        help='embed plotly.js in every page (needs plotly) or load it from the CDN')
+    parser.add_argument('--inspect-url', default=None,
+                        help='URL of a rriftpy.dataserver with inspector stores: clicking a '
+                             'Figure 9 pixel plots the curves of its voxel')
+    parser.add_argument('--c02-dir', default=DEFAULT_POSTPROCESSED_DIR,
+                        help='c02_postprocessed directory (for --inspect-url)')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    include = True if args.plotlyjs == 'embed' else 'cdn'
+    agreement = density = None
+    if args.agreement_dir:
+        agreement = cohort_agreement(args.agreement_dir, args.boot)
+        density = cohort_density(args.agreement_dir, 'Kt', args.bins, args.range)
+    write_html(fig5(args.data_dir, agreement, density), os.path.join(args.out, 'fig5.html'),
+               include_plotlyjs=include)
+    if args.agreement_dir:
+        for k, parameter in enumerate(AGREEMENT_PARAMETERS, start=1):
+            tic = time.time()
+            fig = fig5_voxels(args.agreement_dir, parameter, args.max_points, agreement=agreement)
+            path = os.path.join(args.out, 'fig5-voxels-{}.html'.format(k))
+            write_html(fig, path, include_plotlyjs=include)
+            print('{}: {:.1f} kB of figure data ({:.2f} s)'.format(
+                path, len(to_json(fig)) / 1e3, time.time() - tic))
+    inspect = fig9_inspect(args.inspect_url, args.c02_dir, args.data_dir) \
+        if args.inspect_url else None
+    for figName, build in (('fig6', fig6), ('fig9', fig9)):
+        for k, parameter in enumerate(PARAMETERS, start=1):
+            timings = {}
+            fig = build(parameter, args.data_dir, crop=not args.no_crop, swap=args.swap,
+                        timings=timings)
+            if figName == 'fig9' and inspect:
+                fig['inspect'] = inspect
+            path = os.path.join(args.out, '{}-{}.html'.format(figName, k))
+            with timed(timings, 'write'):
+                write_html(fig, path, include_plotlyjs=include)
+            print('{}: {:.1f} kB of figure data ({})'.format(
+                path, len(to_json(fig)) / 1e3,
+                ', '.join('{} {:.3f} s'.format(stage, t) for stage, t in timings.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Per-voxel curves behind the Figure 9 maps.
+
+The maps only show fitted parameters; the concentration curve of a pixel
+and the fits to it are in ``c01_preprocessed`` and ``c02_postprocessed``,
+far too large to embed in a page. ``build_index`` writes, per study, a
+voxel store (see ``rriftpy.voxelstore``) of the voxels fitted by c02: Ct
+(negative concentrations set to zero, as c02 fits it) memory-mapped, and
+with it Cp, Crr, t and the ETM and RRIFT parameters of every voxel.
+Finding a voxel is a binary search in the run of its slice, so a lookup
+reads one row of Ct and takes a few milliseconds.
+
+The curves of a voxel are Ct, the extended Tofts fit (mapKt, mapKep,
+mapVp) and the RRIFT fit: the extended Tofts curve of the CERRM
+parameters scaled by RRIFT's KtransRR (mapKtR, mapKepR, mapVpR) with the
+measured AIF, i.e. the curve those parameters predict. They are served by
+``rriftpy.dataserver`` (``/curves/<study>/<z>/<row>/<col>.json``) from a
+directory of these stores, and ``python -m rriftpy.figures --inspect-url``
+makes Figure 9 pages that fetch and plot them when a pixel is clicked.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.inspector RRIFT/data/TCGA-GBM-Results/c01_preprocessed \
+        RRIFT/data/TCGA-GBM-Results/c02_postprocessed vox
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from scipy.io import loadmat
+
+from . import models
+from .patients import list_studies, load_preprocessed, study_name
+from .voxelstore import EXTENSION, VoxelStore, save_store
+
+# Per-voxel parameters kept from the c02 maps, in the order of the 'params' columns
+PARAMS = ('mapKt', 'mapKep', 'mapVe', 'mapVp', 'mapKtR', 'mapKepR', 'mapVeR', 'mapVpR')
+SCALARS = ('estKtRR', 'estKepRR', 'estVeRR')
+
+
+def build_index(c01File, c02File, outPath, dtype=None):
+    """Write the inspector voxel store of a study from its c01 and c02 files.
+
+    The voxels are those c02 fitted (its maskCt), which load_preprocessed
+    reproduces from the c01 file.
+    """
+    f = load_preprocessed(c01File)
+    g = loadmat(c02File)
+    maskCt = g['maskCt'].astype(bool)
+    if not np.array_equal(maskCt, f['maskCt']):
+        raise ValueError('{} and {} do not have the same tumour voxels'.format(c01File, c02File))
+    flatMask = maskCt.ravel(order='F')
+    params = np.column_stack([g[name].ravel(order='F')[flatMask] for name in PARAMS])
+    variables = dict(Cp=f['Cp'], Crr=f['Crr'], t=f['t'], params=params,
+                     paramNames=np.array(PARAMS))
+    variables.update((name, float(np.squeeze(g[name]))) for name in SCALARS)
+    save_store(outPath, f['Ct'], maskCt, variables, dtype=dtype)
+
+
+def find_voxel(store, z, row, col):
+    """Column of Ct of voxel (row, col) of slice z (0-based), or None if not in maskCt."""
+    sX, sY = store.shape[:2]
+    if not (0 <= z < store.shape[2] and 0 <= row < sX and 0 <= col < sY):
+        return None
+    voxels = store.slice_voxels(z)
+    flat = row + col * sX + z * sX * sY
+    k = voxels.start + int(np.searchsorted(store.index[voxels], flat))
+    return k if k < voxels.stop and store.index[k] == flat else None
+
+
+def voxel_curves(store, k):
+    """Curves of voxel k of an inspector store: t, Ct, Cp, Crr, etm, rrift and params.
+
+    ``params`` maps the names in PARAMS to the voxel's values. For a store
+    without parameters (e.g. from voxelstore.convert_preprocessed) only
+    the measured curves are returned.
+    """
+    v = store.variables
+    Cp = np.maximum(np.ravel(v['Cp']).astype(float), 0)
+    t = np.ravel(v['t']).astype(float)
+    out = dict(t=t, Cp=Cp, Crr=np.maximum(np.ravel(v['Crr']).astype(float), 0),
+               Ct=np.maximum(np.asarray(store.Ct[:, k], dtype=float), 0))
+    if 'params' in v:
+        p = dict(zip(v['paramNames'].tolist(), v['params'][k].tolist()))
+        out['etm'] = models.tofts_kety(Cp, [p['mapKt'], p['mapKep'], p['mapVp']], t)
+        out['rrift'] = models.tofts_kety(Cp, [p['mapKtR'], p['mapKepR'], p['mapVpR']], t)
+        out['params'] = p
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('c01_dir', help='directory of c01_preprocessed .mat files')
+    parser.add_argument('c02_dir', help='directory of c02_postprocessed .mat files')
+    parser.add_argument('out_dir')
+    parser.add_argument('--single', action='store_true',
+                        help='store Ct in single precision (half the size)')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    for c01File in list_studies(args.c01_dir):
+        study = study_name(c01File)
+        c02File = os.path.join(args.c02_dir, study + '.mat')
+        if not os.path.exists(c02File):
+            print('{}: no c02 results, skipped'.format(study))
+            continue
+        outPath = os.path.join(args.out_dir, study + EXTENSION)
+        build_index(c01File, c02File, outPath, np.float32 if args.single else None)
+        store = VoxelStore(outPath)
+        # Time the lookup of the voxel in the middle of the index
+        z, rest = divmod(int(store.index[store.nVox // 2]), store.shape[0] * store.shape[1])
+        col, row = divmod(rest, store.shape[0])
+        tic = time.time()
+        voxel_curves(store, find_voxel(store, z, row, col))
+        print('{}: {} voxels, lookup {:.2f} ms'.format(study, store.nVox,
+                                                       (time.time() - tic) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Main simulation over noise levels and temporal resolutions.
+
+Python version of ``b02_mainSimAnalysis.m`` and the summaries of
+``b03_mainSimFigures.m``. Each (replication, sigma, TRes) cell draws its
+noise and downsampling phases from its own counter-based stream (see
+``rriftpy.rng``), so the cells can be split over any number of worker
+processes and the results are bit-identical to a serial run. Unlike b02,
+every temporal resolution gets its own noise realisation. The tail-duration
+sweeps of b02 (``tailT_*``/``estKtRRS_*``) are not reproduced since b03 does
+not use them.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.mainsim --workers 8 --out RRIFT/data/simResults.mat
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.io import savemat
+
+from .simulation import DEFAULT_SIM_MAP, cached_sim_map, compute_cells, compute_cells_adaptive
+from .stats import percent_error, quantile
+
+TRES = (5, 10, 15, 30)  # temporal resolutions, in seconds
+LIST_SIGMA_C = (0, 0.01, 0.02, 0.03, 0.04, 0.05)  # noise levels, in mM
+
+
+def main_specs(TRes=TRES, listSigmaC=LIST_SIGMA_C, ktRR=0.07, kepRR=0.5):
+    """Cell specs of the main simulation, ordered noise level first."""
+    return [(ktRR, kepRR, sigmaC, tres) for sigmaC in listSigmaC for tres in TRes]
+
+
+def assemble_main(cells, simMap, TRes=TRES, listSigmaC=LIST_SIGMA_C, ktRR=0.07, kepRR=0.5):
+    """Arrange cells from ``main_specs`` into the variables of ``simResults.mat``.
+
+    params['ETM'] is [nVox x 3 x repF x nTRes x nSigma] and params['CERRM']
+    [nVox x 5 x repF x nTRes x nSigma]; estKtRR, estKtRRD and estKepRRS are
+    [repF x nTRes x nSigma]. nRep [nTRes x nSigma] is the number of
+    replications of each cell; cells of an adaptive run with fewer than repF
+    replications are padded with NaN.
+    """
+    nRes, nSig = len(TRes), len(listSigmaC)
+    nRep = np.array([c['estKtRR'].shape[0] for c in cells])
+    repF = int(nRep.max())
+
+    def grid(key):
+        # cells are ordered (sigma, TRes); stack to [..., repF, nTRes, nSigma]
+        x = np.stack([_pad(c[key], repF) for c in cells], axis=-1)
+        x = x.reshape(x.shape[:-1] + (nSig, nRes))
+        return np.swapaxes(x, -1, -2)
+
+    return dict(params={'ETM': grid('pkETM'), 'CERRM': grid('pkCERRM')},
+                estKtRR=grid('estKtRR'), estKtRRD=grid('estKtRRD'), estKepRRS=grid('estKepRRS'),
+                kepRR=kepRR, ktRR=ktRR, veRR=ktRR / kepRR,
+                listSigmaC=np.array(listSigmaC, dtype=float), TRes=np.array(TRes, dtype=float),
+                t=simMap.t, repF=repF, nRep=nRep.reshape(nSig, nRes).T)
+
+
+def _pad(x, repF):
+    # NaN-pad the replication (last) axis to repF
+    pad = [(0, 0)] * (x.ndim - 1) + [(0, repF - x.shape[-1])]
+    return np.pad(x, pad, mode='constant', constant_values=np.nan)
+
+
+def run_main_simulation(simMapPath=DEFAULT_SIM_MAP, TRes=TRES, listSigmaC=LIST_SIGMA_C,
+                        repF=1000, ktRR=0.07, kepRR=0.5, seed=12345, workers=None,
+                        blockSize=50, tol=None, minRep=100):
+    """Run the b02 simulation and return the variables of ``simResults.mat``.
+
+    With ``tol`` (percentage points) every cell adds blocks of replications
+    until the confidence intervals of its reported error medians and
+    quartiles are at most that wide, and repF becomes the cap (see
+    simulation.run_adaptive_cell).
+    """
+    specs = main_specs(TRes, listSigmaC, ktRR, kepRR)
+    if tol is None:
+        cells = compute_cells(specs, repF, seed, simMapPath, workers, blockSize)
+    else:
+        cells = compute_cells_adaptive(specs, tol, repF, seed, simMapPath, workers, blockSize,
+                                       minRep)
+    return assemble_main(cells, cached_sim_map(simMapPath), TRes, listSigmaC, ktRR, kepRR)
+
+
+def summarize_fig2_fig3(results, simMap):
+    """Build the ``fig2andfig3vars.mat`` variables, as b03 does.
+
+    curErr, curErr1, curErr2 are the percent errors of kepRR, KtransRR and
+    veRR [nTRes x nSigma x repF]; curErr3, curErr4, curErr5 those of the
+    tissue Ktrans, ve and vp from RRIFT [nTRes x nSigma x nVox*repF]. Each
+    comes with errMd* (median) and errQt* (quartiles, trailing axis of 2);
+    NaN padding from adaptive runs is ignored.
+    """
+    pkCE = results['params']['CERRM']
+    estKtRR = results['estKtRR']
+    estKepRRS = results['estKepRRS']
+    rrVe = estKtRR / estKepRRS
+    nVox, _, nRep, nRes, nSig = pkCE.shape
+
+    def per_voxel(est, truth):
+        # [nVox x repF x nTRes x nSigma] -> [nTRes x nSigma x nVox*repF]
+        err = percent_error(est, truth.reshape(-1, 1, 1, 1))
+        return np.moveaxis(err.reshape((nVox * nRep, nRes, nSig), order='F'), 0, -1)
+
+    def reference(est, truth):
+        return np.moveaxis(percent_error(est, truth), 0, -1)
+
+    errs = [reference(estKepRRS, results['kepRR']),
+            reference(estKtRR, results['ktRR']),
+            reference(rrVe, results['veRR']),
+            per_voxel(pkCE[:, 0] * estKtRR, simMap.trueKt),
+            per_voxel(pkCE[:, 1] * rrVe, simMap.trueVe),
+            per_voxel(pkCE[:, 3] * estKtRR, simMap.trueVp)]
+
+    out = {'listSigmaC': results['listSigmaC'], 'TRes': results['TRes']}
+    for k, err in enumerate(errs):
+        suffix = str(k) if k else ''
+        out['curErr' + suffix] = err
+        qt = quantile(err, [0.25, 0.5, 0.75], axis=-1)
+        out['errMd' + suffix] = qt[..., 1]
+        out['errQt' + suffix] = qt[..., ::2]
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sim-map', default=DEFAULT_SIM_MAP,
+                        help='simMap.mat from b00 (rebuilt if missing)')
+    parser.add_argument('--out', default='simResults.mat')
+    parser.add_argument('--fig-out', default=None,
+                        help='also write the Figure 2/3 summaries (fig2andfig3vars.mat)')
+    parser.add_argument('--rep', type=int, default=1000,
+                        help='replications per cell (the cap with --tol)')
+    parser.add_argument('--tol', type=float, default=None,
+                        help='adaptive mode: stop a cell once the 95%% CIs of its error '
+                             'medians and quartiles are this many percentage points wide')
+    parser.add_argument('--block', type=int, default=50, help='replications per block')
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    tic = time.time()
+    results = run_main_simulation(args.sim_map, repF=args.rep, seed=args.seed,
+                                  workers=args.workers, blockSize=args.block, tol=args.tol)
+    if args.tol is not None:
+        print('Replications per cell (TRes x sigma):')
+        print(results['nRep'])
+    savemat(args.out, results)
+    if args.fig_out:
+        savemat(args.fig_out, summarize_fig2_fig3(results, cached_sim_map(args.sim_map)))
+    print('Saved {} in {:.1f} s'.format(args.out, time.time() - tic))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Slice-indexed container for parametric maps.
+
+``c02_postprocessed`` files hold eight dense sX x sY x sZ maps in one
+compressed blob, so showing one slice of one map means decompressing all
+of them. A ``.maps`` file instead compresses every slice of every map as
+its own block and starts with an index of where the blocks are:
+
+* the magic ``RRMAPS1\\n`` and the length of the header (uint64, little
+  endian);
+* a JSON header with the volume shape, per map its dtype and the
+  (offset, length) of each slice block, and numeric attributes;
+* the zlib-compressed slices, each stored in column-major (MATLAB) order.
+
+Reading a slice is one seek and one small decompression.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.mapstore RRIFT/data/TCGA-GBM-Results/c02_postprocessed out_dir
+"""
+
+import argparse
+import glob
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+from scipy.io import loadmat
+
+from .sparsemap import SparseMap, dense_slice
+
+MAGIC = b'RRMAPS1\n'
+EXTENSION = '.maps'
+MAP_NAMES = ('mapKt', 'mapKep', 'mapVe', 'mapVp', 'mapKtR', 'mapKepR', 'mapVeR', 'mapVpR')
+
+
+def _attr_value(value):
+    # JSON value of a numeric attribute: a float, or nested lists for arrays
+    x = np.real(np.asarray(value, dtype=complex if np.iscomplexobj(value) else float))
+    return float(x.item()) if x.size == 1 else x.tolist()
+
+
+def write_maps(path, maps, attrs=None, level=6):
+    """Write 3-D arrays of one shape to a ``.maps`` file.
+
+    maps is a dict of name -> [sX x sY x sZ] array or SparseMap, which is
+    densified one slice at a time; attrs holds numbers to keep along with
+    them (e.g. estKtRR). Complex attributes are stored as their real part,
+    as c02 keeps it, and arrays as nested lists of their values.
+    """
+    maps = {name: x if isinstance(x, SparseMap) else np.asarray(x) for name, x in maps.items()}
+    shapes = {x.shape for x in maps.values()}
+    if len(shapes) != 1 or len(next(iter(shapes))) != 3:
+        raise ValueError('maps must be 3-D arrays of one shape, got {}'.format(sorted(shapes)))
+    shape = shapes.pop()
+
+    blocks, index, offset = [], {}, 0
+    for name, x in maps.items():
+        slices = []
+        for z in range(shape[2]):
+            block = zlib.compress(dense_slice(x, z).tobytes(order='F'), level)
+            blocks.append(block)
+            slices.append([offset, len(block)])
+            offset += len(block)
+        index[name] = dict(dtype=x.dtype.str, slices=slices)
+    attrs = {name: _attr_value(v) for name, v in (attrs or {}).items()}
+    header = json.dumps(dict(shape=list(shape), maps=index, attrs=attrs)).encode()
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fid:
+        fid.write(MAGIC)
+        fid.write(struct.pack('<Q', len(header)))
+        fid.write(header)
+        for block in blocks:
+            fid.write(block)
+    os.replace(tmp, path)
+
+
+class MapFile(object):
+    """Read access to a ``.maps`` file; only the index is read on opening.
+
+    ``attrs`` holds the attributes as written by write_maps: floats, or
+    nested lists that np.asarray turns back into arrays.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fid:
+            if fid.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a .maps file'.format(path))
+            size, = struct.unpack('<Q', fid.read(8))
+            header = json.loads(fid.read(size).decode())
+        self._dataStart = len(MAGIC) + 8 + size
+        self.shape = tuple(header['shape'])
+        self.attrs = header['attrs']
+        self._maps = header['maps']
+
+    @property
+    def names(self):
+        return list(self._maps)
+
+    def read_slice(self, name, z):
+        """Slice ``z`` (0-based) of map ``name`` as an [sX x sY] array."""
+        entry = self._maps[name]
+        offset, length = entry['slices'][z]
+        with open(self.path, 'rb') as fid:
+            fid.seek(self._dataStart + offset)
+            block = fid.read(length)
+        x = np.frombuffer(zlib.decompress(block), dtype=np.dtype(entry['dtype']))
+        return x.reshape(self.shape[:2], order='F')
+
+    def read(self, name, slices=None):
+        """Map ``name`` as [sX x sY x len(slices)], by default all slices."""
+        slices = range(self.shape[2]) if slices is None else slices
+        return np.stack([self.read_slice(name, z) for z in slices], axis=-1)
+
+
+def convert_postprocessed(inFile, outFile, level=6):
+    """Convert one c02_postprocessed ``.mat`` file to a ``.maps`` file.
+
+    The eight maps and maskCt are stored slice by slice; scalar variables
+    such as estKtRR go into the attributes.
+    """
+    f = loadmat(inFile)
+    maps = {name: f[name] for name in MAP_NAMES + ('maskCt',) if name in f}
+    attrs = {name: x for name, x in f.items()
+             if not name.startswith('__') and isinstance(x, np.ndarray) and x.size == 1
+             and np.issubdtype(x.dtype, np.number)}
+    write_maps(outFile, maps, attrs, level)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('in_dir', help='directory of c02_postprocessed .mat files')
+    parser.add_argument('out_dir')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    for inFile in sorted(glob.glob(os.path.join(args.in_dir, '*.mat'))):
+        name = os.path.splitext(os.path.basename(inFile))[0]
+        outFile = os.path.join(args.out_dir, name + EXTENSION)
+        convert_postprocessed(inFile, outFile)
+        print('{}: {:.1f} MB -> {:.1f} MB'.format(name, os.path.getsize(inFile) / 1e6,
+                                                  os.path.getsize(outFile) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
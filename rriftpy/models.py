@@ -0,0 +1,278 @@
+"""Pharmacokinetic models, ported from ``RRIFT/mfiles``.
+
+Concentration arrays follow the MATLAB layout: ``Ct`` is [time x voxels],
+while ``Cp``/``Crr`` are either a single curve [time] or one curve per voxel
+[time x voxels] (the latter is what downsampling with per-voxel phases
+produces). Every fit is solved for all voxels at once instead of looping.
+"""
+
+import numpy as np
+from scipy.special import gammaln
+
+from .stats import iqr_mean
+
+
+def cumtrapz(y, x=None, axis=0):
+    """Cumulative trapezoidal integral starting at zero, like MATLAB's cumtrapz.
+
+    If ``x`` is None, unit spacing is used (the MATLAB scripts multiply by
+    ``stepSize`` afterwards). ``x`` is either a vector along ``axis`` or has
+    the shape of ``y``.
+    """
+    y = np.moveaxis(np.asarray(y, dtype=float), axis, 0)
+    out = np.zeros_like(y)
+    if x is None:
+        out[1:] = np.cumsum((y[1:] + y[:-1]) / 2, axis=0)
+    else:
+        x = np.asarray(x, dtype=float)
+        if x.ndim > 1:
+            dx = np.diff(np.moveaxis(x, axis, 0), axis=0)
+        else:
+            dx = np.diff(x).reshape((-1,) + (1,) * (y.ndim - 1))
+        out[1:] = np.cumsum(dx * (y[1:] + y[:-1]) / 2, axis=0)
+    return np.moveaxis(out, 0, axis)
+
+
+def lstsq_batch(M, y):
+    """Solve ``M[n] @ p[n] = y[:, n]`` in the least-squares sense for every voxel.
+
+    M [N x T x K] - one design matrix per voxel
+    y [T x N] - one curve per voxel
+    Returns params [N x K] and the fitted curves [T x N]. Voxels with
+    non-finite inputs are returned as NaN.
+    """
+    nVox, sT, nK = M.shape
+    params = np.full((nVox, nK), np.nan)
+    good = np.isfinite(M).all(axis=(1, 2)) & np.isfinite(y).all(axis=0)
+    if good.any():
+        params[good] = np.einsum('nkt,tn->nk', np.linalg.pinv(M[good]), y[:, good])
+    fitted = np.einsum('ntk,nk->tn', M, params)
+    return params, fitted
+
+
+def _columns(x, nVox):
+    # Broadcast a [T] or [T x N] curve to [T x N]
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 1:
+        x = x[:, None]
+    return np.broadcast_to(x, (x.shape[0], nVox))
+
+
+def _design(*cols):
+    # Stack [T x N] columns into a [N x T x K] design matrix
+    return np.stack(cols, axis=-1).transpose(1, 0, 2)
+
+
+def exp_conv(A, B, t):
+    """Convolution of ``A`` with ``exp(-B*t)``, see expConv.m (Flouri et al. 2016).
+
+    A [T] or [T x N], B scalar or [N], t [T]. Returns [T] or [T x N].
+    """
+    A = np.asarray(A, dtype=float)
+    B = np.asarray(B, dtype=float)
+    t = np.asarray(t, dtype=float)
+    squeeze = A.ndim == 1 and B.ndim == 0
+    A = A.reshape(A.shape[0], -1)
+    B = B.reshape(1, -1)
+    dt = np.diff(t)[:, None]
+
+    x = B * dt
+    dA = (A[1:] - A[:-1]) / x
+    E = np.exp(-x)
+    E0 = 1 - E
+    E1 = x - E0
+    iterAdd = A[:-1] * E0 + dA * E1
+
+    f = np.zeros((len(t), max(A.shape[1], B.shape[1])))
+    for i in range(len(t) - 1):
+        f[i + 1] = E[i] * f[i] + iterAdd[i]
+    f = f / B
+    return f[:, 0] if squeeze else f
+
+
+def tofts_kety(Cp, pkParams, t):
+    """Tofts model curve(s), see ToftsKety.m.
+
+    pkParams is [Ktrans, kep] or [Ktrans, kep, vp]; each entry may also be a
+    vector with one value per voxel.
+    """
+    kTrans = np.asarray(pkParams[0], dtype=float)
+    kep = np.asarray(pkParams[1], dtype=float)
+    ct = kTrans * exp_conv(Cp, kep, t)
+    if len(pkParams) == 3:
+        Cp = np.asarray(Cp, dtype=float)
+        ct = ct + np.asarray(pkParams[2], dtype=float) * (Cp if ct.ndim == Cp.ndim else Cp[:, None])
+    return ct
+
+
+def georgiou_aif(t=None, t0=0):
+    """Population-averaged AIF from Georgiou et al., see GeorgiouAif.m.
+
+    Returns the plasma and whole-blood curves ``(C_p, C_b)``.
+    """
+    if t is None:
+        t = np.arange(500) / 60
+    t = np.asarray(t, dtype=float).ravel() - t0
+    t[t < 0] = 0
+
+    A = np.array([0.37, 0.33, 10.06])
+    m = np.array([0.11, 1.17, 16.02])
+    alpha = 5.26
+    beta = 0.032
+    tau = 0.129
+
+    C_b1 = (A * np.exp(-m * t[:, None])).sum(axis=1)
+    # Gamma variate part; it saturates after 7.5 min so it's fixed there
+    C_b2 = np.zeros_like(t)
+    N = np.floor(np.where(t > 7.5, 0, t) / tau).astype(int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j in range(N.max() + 1):
+            a = (j + 1) * alpha + j
+            tj = t - j * tau
+            # Done in log space; MATLAB gets NaN (0*Inf) for large a and drops them
+            logGamma = a * np.log(tj) - tj / beta - (a + 1) * np.log(beta) - gammaln(a + 1)
+            term = np.exp(logGamma)
+            term[~np.isfinite(term) | (tj < 0)] = 0
+            C_b2 += np.where(N >= j, term, 0)
+    C_b2[t > 7.5] = 3.035
+
+    C_b = C_b1 * C_b2
+    C_b[t <= 0] = 0
+    Hct = 0.35
+    C_p = C_b / (1 - Hct)
+    return C_p, C_b
+
+
+def tofts_llsq(Ct, Cp, t, modType=0):
+    """Linear fit of the (extended) Tofts model (Murase 2004), see Tofts_LLSQ.m.
+
+    Returns pkParams [N x 2] = [Ktrans, kep] (modType=0) or [N x 3] =
+    [Ktrans, kep, vp] (modType=1), and the residual norm [N].
+    """
+    Ct = np.asarray(Ct, dtype=float)
+    if Ct.ndim == 1:
+        Ct = Ct[:, None]
+    nVox = Ct.shape[1]
+    stepSize = t[1] - t[0]
+    Cp = _columns(Cp, nVox)
+
+    cols = [stepSize * cumtrapz(Cp), -stepSize * cumtrapz(Ct)]
+    if modType:
+        cols.append(Cp)
+    pkParams, fitted = lstsq_batch(_design(*cols), Ct)
+    resid = np.linalg.norm(Ct - fitted, axis=0)
+    if modType:
+        # Form of pkParams is [kTrans + kep*vp, kEp, vp]
+        pkParams[:, 0] = pkParams[:, 0] - pkParams[:, 1] * pkParams[:, 2]
+    return pkParams, resid
+
+
+def errm(Ct, Crr, t, doPure=False):
+    """Extended linear reference region model, see ERRM.m.
+
+    Returns pkParams [N x 5] = [kt/ktRR, ve/veRR, kep, vp/ktRR, kepRR] (or
+    the raw [N x 4] fit if doPure) and the fit to cumtrapz(Ct) [T x N].
+    As with the default ``doReal`` in MATLAB, the transformed parameters are
+    computed in complex arithmetic and reduced to their real part.
+    """
+    Ct = np.asarray(Ct, dtype=float)
+    if Ct.ndim == 1:
+        Ct = Ct[:, None]
+    nVox = Ct.shape[1]
+    stepSize = t[1] - t[0]
+    Crr = _columns(Crr, nVox)
+
+    M1 = stepSize * cumtrapz(Crr)
+    M2 = stepSize * stepSize * cumtrapz(cumtrapz(Crr))
+    curCt = stepSize * cumtrapz(Ct)
+    M3 = -stepSize * cumtrapz(curCt)
+    pkParams, fittedCt = lstsq_batch(_design(M1, M2, M3, Crr), curCt)
+    if doPure:
+        return pkParams, fittedCt
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        A = pkParams[:, 0] / pkParams[:, 3]
+        B = pkParams[:, 1] / pkParams[:, 3]
+        kepRR = (A - np.sqrt((A ** 2 - 4 * B).astype(complex))) / 2
+        ktvp = A - pkParams[:, 2] - kepRR
+        ktRel = pkParams[:, 3] * ktvp
+        veRel = ktRel * kepRR / pkParams[:, 2]
+    pkParams = np.real(np.column_stack([ktRel, veRel, pkParams[:, 2], pkParams[:, 3], kepRR]))
+    return pkParams, fittedCt
+
+
+def estimate_kep_rr(pkERRM):
+    """Pick a single kepRR from the per-voxel ERRM estimates, as CERRM.m does.
+
+    Closely grouped estimates (noiseless data) use the median, otherwise the
+    interquartile mean of voxels where all estimates are positive is used.
+    """
+    rawKepRR = pkERRM[:, 4]
+    if np.std(rawKepRR, ddof=1) < 1e-3:
+        return np.nanmedian(rawKepRR)
+    goodVals = (pkERRM > 0).all(axis=1)
+    return iqr_mean(rawKepRR[goodVals])
+
+
+def cerrm(Ct, Crr, t, kepRR=None, doPure=False):
+    """Constrained extended linear reference region model, see CERRM.m.
+
+    If kepRR is None it is estimated from ERRM first.
+    Returns ``(pkParams, fittedCt, kepRR, pkERRM, fittedCtERRM)`` where
+    pkParams is [N x 5] = [kt/ktRR, ve/veRR, kep, vp/ktRR, rawKepRR].
+    """
+    Ct = np.asarray(Ct, dtype=float)
+    if Ct.ndim == 1:
+        Ct = Ct[:, None]
+    nVox = Ct.shape[1]
+
+    if kepRR is None:
+        pkERRM, fittedCtERRM = errm(Ct, Crr, t)
+        rawKepRR = pkERRM[:, 4]
+        kepRR = estimate_kep_rr(pkERRM)
+    else:
+        pkERRM = np.nan
+        fittedCtERRM = np.nan
+        rawKepRR = np.full(nVox, np.nan)
+
+    stepSize = t[1] - t[0]
+    Crr = _columns(Crr, nVox)
+    CrrInt1 = stepSize * cumtrapz(Crr)
+    CrrInt2 = stepSize * cumtrapz(CrrInt1)
+    M1 = CrrInt1 + kepRR * CrrInt2
+    M2 = Crr + kepRR * CrrInt1
+    y = stepSize * cumtrapz(Ct)
+    M3 = -stepSize * cumtrapz(y)
+    pkParams, fittedCt = lstsq_batch(_design(M1, M2, M3), y)
+
+    if not doPure:
+        # pkParams = [kt/ktRR + vp*kep/ktRR, vp/ktRR, kep]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vpKtRR = pkParams[:, 1]
+            kep = pkParams[:, 2]
+            ktRel = pkParams[:, 0] - kep * vpKtRR
+            veRel = ktRel * kepRR / kep
+        pkParams = np.column_stack([ktRel, veRel, kep, vpKtRR])
+    pkParams = np.column_stack([pkParams, rawKepRR])
+    return pkParams, fittedCt, kepRR, pkERRM, fittedCtERRM
+
+
+def rrift(CpTail, CrrTail, tTail, kepRR):
+    """Reference region and input function tail estimate of KtransRR, see RRIFT.m.
+
+    Returns ``(estKtRR, num, denum)``.
+    """
+    CrrTail = np.asarray(CrrTail, dtype=float).ravel()
+    num = CrrTail - CrrTail[0] + kepRR * cumtrapz(CrrTail, tTail)
+    denum = cumtrapz(np.asarray(CpTail, dtype=float).ravel(), tTail)
+    estKtRR = np.dot(denum, num) / np.dot(denum, denum)
+    return estKtRR, num, denum
+
+
+def rrift_diff(CpTail, CrrTail, tTail, kepRR):
+    """Differential form of RRIFT, i.e. avoids extra integrals. See RRIFT_diff.m."""
+    CrrTail = np.asarray(CrrTail, dtype=float).ravel()
+    num = np.gradient(CrrTail, tTail[1] - tTail[0]) + kepRR * CrrTail
+    denum = np.asarray(CpTail, dtype=float).ravel()
+    estKtRR = np.dot(denum, num) / np.dot(denum, denum)
+    return estKtRR, num, denum
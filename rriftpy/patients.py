@@ -0,0 +1,147 @@
+"""Loading of the in-vivo studies written by ``c01_preprocessDCE.m``.
+
+The c0x scripts all start the same way: load a study, set negative
+concentrations to zero and drop tumour voxels that barely enhance. That
+shared part lives here so the Python analyses see the same voxels as c02.
+
+Whole-brain masks at full resolution are too large to hold as one matrix
+(MATLAB has to save them with ``-v7.3``). For those, ``read_preprocessed``
+leaves Ct on disk and ``voxel_chunks`` reads it a block of voxels at a time;
+reading ``-v7.3`` files needs h5py. Studies converted to voxel stores (see
+``rriftpy.voxelstore``) are read the same way, memory-mapped.
+"""
+
+import glob
+import os
+
+import numpy as np
+from scipy.io import loadmat
+
+from .voxelstore import EXTENSION, VoxelStore, is_store
+
+DEFAULT_PREPROCESSED_DIR = os.path.join('RRIFT', 'data', 'TCGA-GBM-Results', 'c01_preprocessed')
+ENHANCEMENT_THRESHOLD = 0.01  # mM, see c02_doRRIFT.m
+DEFAULT_CHUNK_SIZE = 10000  # voxels per block
+
+
+def list_studies(inDir=DEFAULT_PREPROCESSED_DIR):
+    """Paths of the ``.mat`` files (or voxel stores) in ``inDir``, sorted like MATLAB's dir."""
+    return sorted(glob.glob(os.path.join(inDir, '*.mat')) +
+                  glob.glob(os.path.join(inDir, '*' + EXTENSION)))
+
+
+def study_name(path):
+    """Study ID of a data file, e.g. 'TCGA-06-0185-1'."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class _HDF5Columns(object):
+    # Ct [T x N] of a -v7.3 file; HDF5 stores MATLAB arrays transposed
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.shape = dataset.shape[::-1]
+        self.dtype = dataset.dtype
+
+    def columns(self, start, stop):
+        return self.dataset[start:stop].T
+
+
+def _read_hdf5(path):
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError('h5py is required to read MATLAB -v7.3 files such as ' + path)
+    fid = h5py.File(path, 'r')
+    f = {}
+    for name, dataset in fid.items():
+        if name.startswith('#'):
+            continue
+        if name == 'Ct':
+            f[name] = _HDF5Columns(dataset)
+        else:
+            f[name] = np.array(dataset).T
+    return f
+
+
+def _read_store(path):
+    store = VoxelStore(path)
+    f = {name: x for name, x in store.variables.items() if not name.startswith('index_')}
+    f['Ct'] = store.Ct
+    for name in ['maskCt'] + store.maskNames:
+        f[name] = store.mask(name)
+    return f
+
+
+def read_preprocessed(path, clip=True):
+    """Read one c01 study without touching Ct.
+
+    Cp, Crr and t are returned as [T] vectors with negative concentrations
+    set to zero (unless clip is False, e.g. to copy the study as stored)
+    and the masks as boolean arrays. Ct is left as stored: a [T x N]
+    array, a memory-mapped view for voxel stores, or for ``-v7.3`` files a
+    handle that voxel_chunks reads from disk block by block.
+    """
+    if is_store(path):
+        f = _read_store(path)
+    else:
+        try:
+            f = {k: v for k, v in loadmat(path).items() if not k.startswith('__')}
+        except NotImplementedError:
+            # scipy only reads up to -v7; -v7.3 files are HDF5
+            f = _read_hdf5(path)
+    for name in ('Cp', 'Crr', 't'):
+        f[name] = np.asarray(f[name], dtype=float).ravel()
+    for name in ('Cp', 'Crr') if clip else ():
+        f[name][f[name] < 0] = 0
+    for name in ('maskCt', 'maskCp', 'maskCrr'):
+        if name in f:
+            f[name] = f[name].astype(bool)
+    return f
+
+
+def voxel_chunks(Ct, chunkSize=DEFAULT_CHUNK_SIZE):
+    """Iterate over Ct [T x N] in blocks of voxels.
+
+    Yields ``(start, stop, chunk)`` where chunk is a float copy of
+    ``Ct[:, start:stop]`` with negative concentrations set to zero.
+    """
+    nVox = Ct.shape[1]
+    for start in range(0, nVox, chunkSize):
+        stop = min(start + chunkSize, nVox)
+        if hasattr(Ct, 'columns'):
+            chunk = np.array(Ct.columns(start, stop), dtype=float)
+        else:
+            chunk = np.array(Ct[:, start:stop], dtype=float)
+        chunk[chunk < 0] = 0
+        yield start, stop, chunk
+
+
+def enhancing(chunk):
+    """Voxels of a Ct block whose enhancement is not negligible."""
+    return chunk.max(axis=0) > ENHANCEMENT_THRESHOLD
+
+
+def load_preprocessed(path):
+    """Load one c01 study and apply the basic pre-processing of c02/c05.
+
+    Returns a dict with Ct [T x nGoodVox], Cp [T], Crr [T], t [T] and maskCt
+    (tumour mask with the negligibly enhancing voxels removed), plus numVox
+    and numGoodVox. The remaining variables of the file are passed through.
+    """
+    f = read_preprocessed(path)
+    blocks, enhancementMask = [], []
+    for _, _, chunk in voxel_chunks(f['Ct']):
+        enhancementMask.append(enhancing(chunk))
+        blocks.append(chunk[:, enhancementMask[-1]])
+    enhancementMask = np.concatenate(enhancementMask)
+
+    # Voxels in maskCt are in MATLAB (column-major) order
+    maskCt = f['maskCt']
+    f['numVox'] = int(maskCt.sum())
+    f['numGoodVox'] = int(enhancementMask.sum())
+    flatMask = maskCt.ravel(order='F')
+    flatMask[flatMask] = enhancementMask
+    f['maskCt'] = flatMask.reshape(maskCt.shape, order='F')
+    f['Ct'] = np.concatenate(blocks, axis=1)
+    return f
@@ -0,0 +1,240 @@
+"""Batch version of ``c02_doRRIFT.m`` for large cohorts.
+
+Every study in ``c01_preprocessed`` goes through the c02 steps: enhancement
+masking, CERRM, RRIFT with the measured and the population AIF tail,
+RRIFT_diff, the ETM fits, the uncertainty estimates and the parametric
+maps. Studies are independent, so they are spread over a process pool.
+Each study is written to its own ``c02_postprocessed`` file as soon as it
+is done; a study that fails is reported and does not stop the others.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.postprocess --workers 8 --report c02_timing.csv
+"""
+
+import argparse
+import csv
+import os
+import time
+import traceback
+
+import numpy as np
+from scipy import stats
+from scipy.io import savemat
+from scipy.optimize import least_squares
+
+from . import models
+from .mapstore import MAP_NAMES
+from .patients import (DEFAULT_CHUNK_SIZE, DEFAULT_PREPROCESSED_DIR, enhancing, list_studies,
+                       read_preprocessed, study_name, voxel_chunks)
+from .sparsemap import SparseMap
+from .stats import iqr_stats
+from .taskpool import run_tasks
+
+DEFAULT_POSTPROCESSED_DIR = os.path.join('RRIFT', 'data', 'TCGA-GBM-Results', 'c02_postprocessed')
+TAIL_FRAME = 33  # 1-based first frame of the tail, ~3 minutes into the acquisition
+# Variables c01 computed that c02 passes through to its output
+PASS_THROUGH = ('cnr', 'snr', 'sigmaCt', 'T1Cp', 'T1Crr', 'T1Ct')
+
+
+def ci_width(resid, jac, level=0.95):
+    """Width of the confidence intervals of nlparci for a least-squares fit."""
+    n, k = jac.shape
+    mse = np.sum(resid ** 2) / (n - k)
+    se = np.sqrt(np.diag(np.linalg.pinv(jac.T @ jac)) * mse)
+    return 2 * stats.t.ppf(0.5 + level / 2, n - k) * se
+
+
+def kep_rr_ci(pkERRM):
+    """Width of the 95% CI of the mean interquartile kepRR, as in c02."""
+    rawKepRR = pkERRM[:, 4]
+    goodVals = (pkERRM > 0).all(axis=1)
+    return np.ptp(iqr_stats(rawKepRR[goodVals])[2])
+
+
+def fit_muscle_tofts(Crr, Cp, t):
+    """Non-linear Tofts fit of the reference region and its CI widths.
+
+    Returns ``(pkE, cis)`` with pkE = [Ktrans, kep, vp], starting from 0.1
+    for every parameter like the nlinfit call in c02.
+    """
+    fit = least_squares(lambda a: models.tofts_kety(Cp, a, t) - Crr, [0.1, 0.1, 0.1],
+                        method='lm')
+    return fit.x, ci_width(fit.fun, fit.jac)
+
+
+def rrift_study(f, fTail=TAIL_FRAME, chunkSize=DEFAULT_CHUNK_SIZE):
+    """Run the c02 analysis on one study read with read_preprocessed.
+
+    Tumour voxels are fitted ``chunkSize`` at a time, so only Ct itself
+    (unless it stays on disk, see patients.read_preprocessed) and a few
+    parameters per fitted voxel, the maps included, scale with the mask
+    size. Returns a dict with the variables c02 saves, except Rsq/RsqPop
+    which are scalars here (see process_study) and the maps, which are
+    SparseMaps of the fitted voxels.
+    """
+    Ct, Cp, Crr, t, maskCt = f['Ct'], f['Cp'], f['Crr'], f['t'], f['maskCt']
+
+    # First pass: enhancement masking and ERRM, which CERRM's kepRR is taken from
+    enhancementMask, pkERRM = [], []
+    for _, _, chunk in voxel_chunks(Ct, chunkSize):
+        enhancementMask.append(enhancing(chunk))
+        pkERRM.append(models.errm(chunk[:, enhancementMask[-1]], Crr, t)[0])
+    enhancementMask = np.concatenate(enhancementMask)
+    pkERRM = np.concatenate(pkERRM)
+    estKepRR = models.estimate_kep_rr(pkERRM)
+
+    # RRIFT with the measured and the population-based AIF tail
+    tail = slice(fTail - 1, None)
+    estKtRR, num, denum = models.rrift(Cp[tail], Crr[tail], t[tail], estKepRR)
+    CpPopAvg = models.georgiou_aif(t, t[6])[0]
+    estKtRRPop, numPop, denumPop = models.rrift(CpPopAvg[tail], Crr[tail], t[tail], estKepRR)
+    estKtRRdiff = models.rrift_diff(Cp[tail], Crr[tail], t[tail], estKepRR)[0]
+    estVeRR = estKtRR / estKepRR
+
+    # Second pass: CERRM and extended Tofts fits. Ct columns follow maskCt
+    # in MATLAB (column-major) order; the maps only keep the fitted voxels.
+    voxelIndex = np.flatnonzero(maskCt.ravel(order='F'))
+    maps = {name: [] for name in MAP_NAMES}
+    ETM = {'tumour': [], 'muscle': models.tofts_llsq(Crr, Cp, t, 1)[0]}
+    for start, stop, chunk in voxel_chunks(Ct, chunkSize):
+        chunk = chunk[:, enhancementMask[start:stop]]
+        pkCE = models.cerrm(chunk, Crr, t, estKepRR)[0]
+        pkETM = models.tofts_llsq(chunk, Cp, t, 1)[0]
+        ETM['tumour'].append(pkETM)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            maps['mapKt'].append(pkETM[:, 0])
+            maps['mapKep'].append(pkETM[:, 1])
+            maps['mapVe'].append(pkETM[:, 0] / pkETM[:, 1])
+            maps['mapVp'].append(pkETM[:, 2])
+            maps['mapKtR'].append(estKtRR * pkCE[:, 0])
+            maps['mapKepR'].append(pkCE[:, 2])
+            maps['mapVeR'].append(estVeRR * pkCE[:, 1])
+            maps['mapVpR'].append(estKtRR * pkCE[:, 3])
+    ETM['tumour'] = np.concatenate(ETM['tumour'])
+    goodIndex = voxelIndex[enhancementMask]
+    maps = {name: SparseMap(goodIndex, np.concatenate(x), maskCt.shape)
+            for name, x in maps.items()}
+    flatMask = np.zeros(maskCt.size, dtype=bool)
+    flatMask[goodIndex] = True
+
+    # Fitting uncertainty in muscle (for error-bars)
+    ciKepRR = kep_rr_ci(pkERRM)
+    ciKtRR = ci_width(num - estKtRR * denum, denum[:, None])[0]
+    ciVeRR = np.sqrt(estVeRR ** 2 * ((ciKtRR / estKtRR) ** 2 + (ciKepRR / estKepRR) ** 2)) / 2
+    pkE, cis = fit_muscle_tofts(Crr, Cp, t)
+    ciKtRRT, ciKepRRT = cis[0], cis[1]
+    estVeRRT = pkE[0] / pkE[1]
+    ciVeRRT = np.sqrt(estVeRRT ** 2 * ((ciKtRRT / pkE[0]) ** 2 + (ciKepRRT / pkE[1]) ** 2)) / 2
+
+    out = dict(maps, ETM=ETM, estKepRR=estKepRR, estKtRR=estKtRR, estVeRR=estVeRR,
+               estKtRRPop=estKtRRPop, estVeRRPop=estKtRRPop / estKepRR,
+               estKtRRdiff=estKtRRdiff, estVeRRdiff=estKtRRdiff / estKepRR,
+               Rsq=np.corrcoef(num, denum)[0, 1] ** 2,
+               RsqPop=np.corrcoef(numPop, denumPop)[0, 1] ** 2,
+               num=num, denum=denum, numVox=voxelIndex.size,
+               numGoodVox=int(enhancementMask.sum()),
+               ciKtRR=ciKtRR, ciKepRR=ciKepRR, ciVeRR=ciVeRR,
+               ciKtRRT=ciKtRRT, ciKepRRT=ciKepRRT, ciVeRRT=ciVeRRT,
+               Crr=Crr, Cp=Cp, t=t, maskCt=flatMask.reshape(maskCt.shape, order='F'),
+               maskCrr=f['maskCrr'])
+    out.update((name, f[name]) for name in PASS_THROUGH if name in f)
+    return out
+
+
+def process_study(inFile, outFile, index=0, nStudies=1, chunkSize=DEFAULT_CHUNK_SIZE):
+    """Analyse one study and save it; never raises.
+
+    c02 keeps Rsq/RsqPop for all studies processed so far; here only this
+    study's entry (``index`` of ``nStudies``) is filled. Returns a report
+    dict with the study name, status, run time and the error traceback.
+    """
+    tic = time.time()
+    report = dict(study=study_name(inFile), status='ok', seconds=0.0, error='')
+    try:
+        out = rrift_study(read_preprocessed(inFile), chunkSize=chunkSize)
+        out.update((name, out[name].dense()) for name in MAP_NAMES)
+        for name in ('Rsq', 'RsqPop'):
+            values = np.zeros((nStudies, 1))
+            values[index] = out[name]
+            out[name] = values
+        # Write then rename, so a failed study never leaves a partial file
+        tmp = outFile + '.tmp'
+        savemat(tmp, out, appendmat=False, do_compression=True, oned_as='column')
+        os.replace(tmp, outFile)
+    except Exception:
+        report['status'] = 'failed'
+        report['error'] = traceback.format_exc()
+    report['seconds'] = time.time() - tic
+    return report
+
+
+def run_pipeline(inDir=DEFAULT_PREPROCESSED_DIR, outDir=DEFAULT_POSTPROCESSED_DIR,
+                 workers=None, doOverwrite=True, chunkSize=DEFAULT_CHUNK_SIZE, verbose=True):
+    """Run c02 on every study of ``inDir`` over a process pool.
+
+    Returns one report per study (see process_study). A study that kills
+    its worker process (e.g. out of memory) is reported as failed, and the
+    studies that were lost with the pool are run again (see
+    taskpool.run_tasks); with ``doOverwrite=False`` a rerun only processes
+    the studies that have no output yet.
+    """
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    inFiles = list_studies(inDir)
+    tasks = [(inFile, os.path.join(outDir, study_name(inFile) + '.mat'), i, len(inFiles),
+              chunkSize) for i, inFile in enumerate(inFiles)]
+    reports = {}
+    for task in tasks:
+        if not doOverwrite and os.path.exists(task[1]):
+            reports[task[0]] = dict(study=study_name(task[0]), status='skipped', seconds=0.0,
+                                    error='')
+    todo = [task for task in tasks if task[0] not in reports]
+
+    def done(report):
+        if verbose:
+            print('{study}: {status} ({seconds:.1f} s)'.format(**report))
+            if report['error']:
+                print(report['error'])
+
+    if workers == 1:
+        for task in todo:
+            reports[task[0]] = process_study(*task)
+            done(reports[task[0]])
+    else:
+        for inFile, report, error in run_tasks(process_study, [(task[0], task) for task in todo],
+                                               workers):
+            reports[inFile] = report if error is None else \
+                dict(study=study_name(inFile), status='failed', seconds=0.0, error=error)
+            done(reports[inFile])
+    return [reports[task[0]] for task in tasks]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--in-dir', default=DEFAULT_PREPROCESSED_DIR)
+    parser.add_argument('--out-dir', default=DEFAULT_POSTPROCESSED_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--skip-existing', action='store_true',
+                        help='do not redo studies that already have an output file')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='voxels fitted at a time; peak memory per worker follows it')
+    parser.add_argument('--report', default=None, help='write per-study timings to this CSV')
+    args = parser.parse_args(argv)
+
+    tic = time.time()
+    reports = run_pipeline(args.in_dir, args.out_dir, args.workers, not args.skip_existing,
+                           args.chunk_size)
+    if args.report:
+        with open(args.report, 'w') as fid:
+            writer = csv.DictWriter(fid, ['study', 'status', 'seconds', 'error'])
+            writer.writeheader()
+            writer.writerows(reports)
+    failed = [r['study'] for r in reports if r['status'] == 'failed']
+    print('Processed {} studies in {:.1f} s, {} failed{}'.format(
+        len(reports), time.time() - tic, len(failed), ': ' + ', '.join(failed) if failed else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,321 @@
+"""Multi-resolution tiles of the c02 parametric maps and a viewer for them.
+
+Figures 6 and 9 embed every slice at full matrix size, which is fine for
+one slice per patient but not for whole volumes. Here each slice of a map
+is instead stored as a pyramid: the full-resolution image and copies
+downsampled by 2, 4 and 8, each cut into square tiles that are written as
+small JSON files (``<study>/<map>/<z>/<factor>/<row>_<col>.json``, rows of
+values with ``null`` outside the tumour). A block of the downsampled image
+is the mean of the pixels in it that lie inside ``maskCt`` and are finite,
+so the background does not dilute the tumour's edge; tiles with no such
+pixel are not written.
+
+The viewer page of a study embeds only the coarsest level of the slice it
+opens on, so it opens at once whatever the size of the maps. On zoom (and
+when the map or slice changes) it fetches the coarse tiles of the slice
+and those of the finest level it needs for the visible range, and draws
+the fine tiles over the coarse image. Tiles are fetched relative to the
+page, so it must be served over HTTP (e.g. ``python -m http.server`` in
+the output directory); opened as a file it shows the first slice only.
+With ``--data-url`` no tiles are written and the pages fetch them from
+``rriftpy.dataserver``, which makes them from the ``.maps`` files.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.pyramid RRIFT/data/TCGA-GBM-Results/c02_postprocessed figures/pyramid \
+        --plotlyjs cdn
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from scipy.io import loadmat
+
+from .figures import CONFIG, HOVER, write_html
+from .mapstore import EXTENSION as MAPS_EXTENSION, MapFile
+from .patients import study_name
+
+FACTORS = (1, 2, 4, 8)
+TILE_SIZE = 64  # pixels of a tile at every level
+MIN_SCREEN_PIXELS = 2  # the viewer refines until a data pixel spans at least this many
+DECIMALS = 5
+# Colour limits and colour bar title of the maps shown by the viewer (as Figure 9)
+MAPS = {
+    'mapKt': ((0, 0.15), 'ETM K<sup>trans</sup>[min<sup>-1</sup>]'),
+    'mapKtR': ((0, 0.15), 'RRIFT K<sup>trans</sup>[min<sup>-1</sup>]'),
+    'mapVe': ((0, 0.5), 'ETM v<sub>e</sub>'),
+    'mapVeR': ((0, 0.5), 'RRIFT v<sub>e</sub>'),
+    'mapVp': ((0, 0.15), 'ETM v<sub>p</sub>'),
+    'mapVpR': ((0, 0.15), 'RRIFT v<sub>p</sub>'),
+}
+
+
+def read_maps(path, names):
+    """The maps ``names`` and maskCt of a c02 ``.mat`` or ``.maps`` file, [sX x sY x sZ]."""
+    if path.endswith(MAPS_EXTENSION):
+        f = MapFile(path)
+        return {name: f.read(name) for name in tuple(names) + ('maskCt',)}
+    f = loadmat(path)
+    return {name: np.atleast_3d(f[name]) for name in tuple(names) + ('maskCt',)}
+
+
+def block_mean(image, factor, mask=None):
+    """Mean of every factor x factor block of the pixels inside mask.
+
+    Pixels outside mask (default: everywhere) or not finite are left out
+    of the mean; blocks without any pixel left are NaN. The image is
+    padded to a multiple of factor, so the result is ceil(shape / factor).
+    """
+    image = np.asarray(image, dtype=float)
+    valid = np.isfinite(image)
+    if mask is not None:
+        valid &= np.asarray(mask, dtype=bool)
+    if factor == 1:
+        return np.where(valid, image, np.nan)
+    rows, cols = (-(-n // factor) for n in image.shape)
+    values = np.zeros((rows * factor, cols * factor))
+    counts = np.zeros(values.shape)
+    values[:image.shape[0], :image.shape[1]] = np.where(valid, image, 0)
+    counts[:image.shape[0], :image.shape[1]] = valid
+    values = values.reshape(rows, factor, cols, factor).sum(axis=(1, 3))
+    counts = counts.reshape(rows, factor, cols, factor).sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return values / counts
+
+
+def json_image(image, decimals=DECIMALS):
+    """Rows of an image as lists, rounded, with None (JSON null) for NaN."""
+    image = np.round(np.asarray(image, dtype=float), decimals)
+    rows = image.astype(object)
+    rows[np.isnan(image)] = None
+    return rows.tolist()
+
+
+def tiles(image, tileSize=TILE_SIZE):
+    """(row, col, tile) of the tiles of an image that hold any finite value."""
+    for row in range(-(-image.shape[0] // tileSize)):
+        for col in range(-(-image.shape[1] // tileSize)):
+            tile = image[row * tileSize:(row + 1) * tileSize, col * tileSize:(col + 1) * tileSize]
+            if np.isfinite(tile).any():
+                yield row, col, tile
+
+
+def _write_json(path, x):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fid:
+        json.dump(x, fid, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def write_pyramid(outDir, maps, mask, factors=FACTORS, tileSize=TILE_SIZE):
+    """Write the tiles of every level of every slice of ``maps`` under outDir.
+
+    maps is a dict of name -> [sX x sY x sZ] array and mask the volume of
+    pixels to average (maskCt). Returns the index of the pyramid: for
+    every map, slice and factor the names (``<row>_<col>``) of the tiles
+    written, and the number of tumour voxels of every slice. With outDir
+    None only the index is made, for tiles served by ``rriftpy.dataserver``.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    index = {}
+    for name, volume in maps.items():
+        index[name] = []
+        for z in range(volume.shape[2]):
+            levels = {}
+            for factor in sorted(factors):
+                image = block_mean(volume[:, :, z], factor, mask[:, :, z])
+                tileDir = os.path.join(outDir or '', name, str(z), str(factor))
+                names = []
+                for row, col, tile in tiles(image, tileSize):
+                    names.append('{}_{}'.format(row, col))
+                    if outDir is None:
+                        continue
+                    if not os.path.isdir(tileDir):
+                        os.makedirs(tileDir)
+                    _write_json(os.path.join(tileDir, names[-1] + '.json'), json_image(tile))
+                levels[str(factor)] = names
+            index[name].append(levels)
+    return dict(factors=sorted(factors), tileSize=tileSize, shape=list(mask.shape[:2]),
+                tiles=index, voxels=mask.sum(axis=(0, 1)).tolist())
+
+
+def pyramid_figure(study, index, names, initial, z, url=None, panelSize=600):
+    """The viewer figure of a study: map dropdown, slice slider and the coarse level.
+
+    index is a result of write_pyramid, and initial the coarse tiles
+    (name -> JSON rows) of slice z of the first map, which are the only
+    ones embedded; the others are fetched from url (default: the study's
+    directory next to the page). The figure's payload holds what the
+    viewer script needs (see PYRAMID_SCRIPT).
+    """
+    zLims, colorbarTitle = MAPS[names[0]]
+    buttons = [dict(label=MAPS[name][1], method='skip', args=[]) for name in names]
+    steps = [dict(label=str(k + 1), method='skip', args=[])
+             for k in range(len(index['voxels']))]
+    sX, sY = index['shape']
+    layout = dict(title={'text': study}, width=panelSize + 150, height=panelSize + 100,
+                  plot_bgcolor='rgba(0,0,0,0)',
+                  xaxis=dict(range=[-0.5, sY - 0.5], showticklabels=False, constrain='domain'),
+                  yaxis=dict(range=[sX - 0.5, -0.5], showticklabels=False, scaleanchor='x'),
+                  coloraxis=dict(cmin=zLims[0], cmax=zLims[1], colorscale='Jet',
+                                 colorbar={'title': {'text': colorbarTitle}}),
+                  updatemenus=[dict(active=0, x=0, y=1.1, xanchor='left', yanchor='top',
+                                    direction='down', type='dropdown', buttons=buttons)],
+                  sliders=[dict(active=z, currentvalue={'prefix': 'Slice: '}, steps=steps)])
+    payload = dict(url=url or study, maps=list(names), zLims=[MAPS[name][0] for name in names],
+                   titles=[MAPS[name][1] for name in names], slice=z, initial=initial,
+                   tiles={name: index['tiles'][name] for name in names},
+                   factors=index['factors'], tileSize=index['tileSize'],
+                   minScreenPixels=MIN_SCREEN_PIXELS, hovertemplate=HOVER)
+    return dict(data=[], layout=layout, payload=payload)
+
+
+# Draws the coarse level of the chosen map and slice, and over it the tiles
+# of the finest level needed for the visible range; tiles are fetched once
+PYRAMID_SCRIPT = """\
+var state = {map: 0, z: payload.slice, key: null};
+var cache = {};
+Object.keys(payload.initial).forEach(function (name) {
+    var coarse = payload.factors[payload.factors.length - 1];
+    var url = [payload.url, payload.maps[0], payload.slice, coarse, name + ".json"].join("/");
+    cache[url] = Promise.resolve(payload.initial[name]);
+});
+function fetchTile(url) {
+    if (!(url in cache)) {
+        cache[url] = fetch(url).then(function (r) {
+            if (!r.ok) { throw new Error(url + ": " + r.status); }
+            return r.json();
+        });
+        cache[url].catch(function () { delete cache[url]; });
+    }
+    return cache[url];
+}
+function level(xRange) {
+    // The finest level whose pixels span at least minScreenPixels on screen
+    var length = gd._fullLayout.xaxis._length, width = Math.abs(xRange[1] - xRange[0]);
+    var factors = payload.factors;
+    for (var k = 0; k < factors.length; k++) {
+        if (length * factors[k] / width >= payload.minScreenPixels) { return factors[k]; }
+    }
+    return factors[factors.length - 1];
+}
+function loadTiles(map, z, f, names) {
+    // Heatmaps of tiles of level f, in pixel coordinates of the full image
+    var step = payload.tileSize * f;
+    return Promise.all(names.map(function (name) {
+        var rc = name.split("_").map(Number);
+        return fetchTile([payload.url, map, z, f, name + ".json"].join("/")).then(function (t) {
+            return {type: "heatmap", z: t, x0: rc[1] * step + (f - 1) / 2, dx: f,
+                    y0: rc[0] * step + (f - 1) / 2, dy: f, coloraxis: "coloraxis",
+                    hovertemplate: payload.hovertemplate};
+        });
+    }));
+}
+function byValue(a, b) { return a - b; }
+function refine() {
+    var map = payload.maps[state.map], z = state.z, tiles = payload.tiles[map][z];
+    var coarse = payload.factors[payload.factors.length - 1];
+    var xRange = gd._fullLayout.xaxis.range, yRange = gd._fullLayout.yaxis.range;
+    var f = level(xRange), step = payload.tileSize * f;
+    var key = [map, z, f, xRange, yRange].join();
+    if (key === state.key) { return; }
+    state.key = key;
+    var cols = xRange.map(function (x) { return Math.floor((x + 0.5) / step); }).sort(byValue);
+    var rows = yRange.map(function (y) { return Math.floor((y + 0.5) / step); }).sort(byValue);
+    var inView = f === coarse ? [] : tiles[f].filter(function (name) {
+        var rc = name.split("_").map(Number);
+        return rc[0] >= rows[0] && rc[0] <= rows[1] && rc[1] >= cols[0] && rc[1] <= cols[1];
+    });
+    var base = loadTiles(map, z, coarse, tiles[coarse]);
+    function draw(traces) {
+        if (state.key === key) { return Plotly.react(gd, traces, gd.layout, config); }
+    }
+    return base.then(function (baseTraces) {
+        draw(baseTraces);
+        if (inView.length) {
+            return loadTiles(map, z, f, inView).then(function (traces) {
+                return draw(baseTraces.concat(traces));
+            });
+        }
+    }).catch(function () {
+        state.key = null;  // not served over HTTP: what is drawn stays
+    });
+}
+Plotly.newPlot(gd, data, layout, config).then(function () {
+    refine();
+    gd.on("plotly_relayout", refine);
+    gd.on("plotly_buttonclicked", function (e) {
+        state.map = e.active;
+        Plotly.relayout(gd, {"coloraxis.cmin": payload.zLims[e.active][0],
+                             "coloraxis.cmax": payload.zLims[e.active][1],
+                             "coloraxis.colorbar.title.text": payload.titles[e.active]});
+    });
+    gd.on("plotly_sliderchange", function (e) {
+        state.z = e.slider.active;
+        refine();
+    });
+});"""
+
+
+def study_pyramid(inFile, outDir, names=tuple(MAPS), factors=FACTORS, tileSize=TILE_SIZE,
+                  include_plotlyjs=True, dataUrl=None):
+    """Write the tiles of a c02 study under outDir/<study> and its viewer page.
+
+    With dataUrl (e.g. ``http://localhost:8000/tiles``, see
+    rriftpy.dataserver) no tiles are written and the page fetches them
+    from ``<dataUrl>/<study>`` instead.
+    """
+    study = study_name(inFile)
+    volumes = read_maps(inFile, names)
+    mask = volumes.pop('maskCt')
+    tileDir = os.path.join(outDir, study) if dataUrl is None else None
+    index = write_pyramid(tileDir, volumes, mask, factors, tileSize)
+    z = int(np.argmax(index['voxels']))
+    image = block_mean(volumes[names[0]][:, :, z], max(factors), mask[:, :, z])
+    initial = {'{}_{}'.format(row, col): json_image(tile)
+               for row, col, tile in tiles(image, tileSize)}
+    url = None if dataUrl is None else '{}/{}'.format(dataUrl.rstrip('/'), study)
+    path = os.path.join(outDir, study + '.html')
+    write_html(pyramid_figure(study, index, list(names), initial, z, url), path, CONFIG,
+               include_plotlyjs, script=PYRAMID_SCRIPT)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('in_dir', help='directory of c02_postprocessed .mat (or .maps) files')
+    parser.add_argument('out_dir')
+    parser.add_argument('--maps', nargs='+', default=list(MAPS), choices=list(MAPS))
+    parser.add_argument('--factors', type=int, nargs='+', default=list(FACTORS[1:]),
+                        help='downsampling factors besides full resolution')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    parser.add_argument('--plotlyjs', default='embed', choices=['embed', 'cdn'],
+                        help='embed plotly.js in every page (needs plotly) or load it from the CDN')
+    parser.add_argument('--data-url', default=None,
+                        help='fetch the tiles from this rriftpy.dataserver URL instead of '
+                             'writing them, e.g. http://localhost:8000/tiles')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    include = True if args.plotlyjs == 'embed' else 'cdn'
+    inFiles = sorted(glob.glob(os.path.join(args.in_dir, '*.mat')) +
+                     glob.glob(os.path.join(args.in_dir, '*' + MAPS_EXTENSION)))
+    for inFile in inFiles:
+        tic = time.time()
+        path = study_pyramid(inFile, args.out_dir, args.maps, {1} | set(args.factors),
+                             args.tile_size, include, args.data_url)
+        tileDir = os.path.join(args.out_dir, study_name(inFile))
+        nTiles = sum(len(files) for _, _, files in os.walk(tileDir))
+        print('{}: {:.1f} kB page, {} ({:.2f} s)'.format(
+            path, os.path.getsize(path) / 1e3,
+            'tiles from ' + args.data_url if args.data_url else '{} tiles'.format(nTiles),
+            time.time() - tic))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""Counter-based random streams for the simulations.
+
+The MATLAB scripts seed once with ``rng(12345)`` and draw in loop order, so
+the numbers a replication sees depend on everything simulated before it.
+Here every simulation cell gets its own Philox stream: the seed is the key
+and the cell's indices (e.g. replication, noise level, temporal resolution)
+fill the upper words of the 256-bit counter. Draws only advance the lowest
+word, so streams of different cells never overlap and a cell's noise does
+not depend on which worker runs it or in what order.
+"""
+
+import numpy as np
+
+MAX_INDICES = 3
+
+
+def cell_generator(seed, *indices):
+    """Generator for the simulation cell identified by ``indices``.
+
+    Up to three non-negative integer indices are supported; the same seed
+    and indices always give the same stream.
+    """
+    if len(indices) > MAX_INDICES:
+        raise ValueError('at most {} cell indices are supported, got {}'.format(
+            MAX_INDICES, len(indices)))
+    if any(int(i) < 0 for i in indices):
+        raise ValueError('cell indices must be non-negative, got {}'.format(indices))
+    counter = np.zeros(4, dtype=np.uint64)
+    counter[1:1 + len(indices)] = [int(i) for i in indices]
+    return np.random.Generator(np.random.Philox(key=int(seed), counter=counter))
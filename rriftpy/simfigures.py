@@ -0,0 +1,262 @@
+"""Figures 2, 3 and 4 of the notebook: errors of the simulations.
+
+The "subfigures with sliders" show one error curve at a time: the median
+percent error with its interquartile range against the noise level, one
+slider step per temporal resolution (Figures 2 and 3), or against the
+reference tissue parameter, one step per method (Figure 4). The variables
+come from ``fig2andfig3vars.mat`` and ``fig4vars.mat`` or, with
+``--from-cache``, from ``rriftpy.cache.SimulationCache``.
+
+By default every step is its own trace, as in the notebook. With swap
+(``--swap``), a page holds a single trace and the slider replaces its
+data from the figure's payload (see ``figures.swap_payload``).
+
+The combined figures (``fig2.html``, ...) show the same curves as their
+three slider pages. With ``--consolidate`` each figure is one page whose
+views are the combined figure and the slider pages (``fig2.html#fig2-1``
+and so on): the arrays are embedded once and plotly.js loaded once, and
+the views are switched in the browser (see ``figures.write_views_html``).
+
+Usage (from the repository root)::
+
+    python -m rriftpy.simfigures --out figures --plotlyjs cdn --swap
+"""
+
+import argparse
+import os
+
+import numpy as np
+from scipy.io import loadmat
+
+from .figures import (CONFIG, swap_payload, timed, visibility_masks, write_html,
+                      write_views_html)
+from .mainsim import TRES
+
+PERCENT_ERROR = 'Percent Error'
+NOISE_TITLE = 'σ<sub>noise</sub>[Mm]'
+LINE_AXIS = dict(ticks='outside', showline=True, linewidth=2, linecolor='black')
+# Variable suffix, title, y range and y ticks of every slider page
+FIG2 = {
+    'Ktrans': ('3', 'K<sup>trans</sup>', (-35, 5), (-35, -30, -25, -20, -15, -10, -5, 0, 5)),
+    'Ve': ('4', 'v<sub>e</sub>', (-10, 10), (-10, -5, 0, 5, 10)),
+    'Vp': ('5', 'v<sub>p</sub>', (-170, 50), (-160, -130, -100, -70, -40, -10, 20, 50)),
+}
+FIG2_COLOURS = ('#253494', '#2C7fB8', '#41B6C4', '#A1DAB4')
+FIG3 = {
+    'kepRR': ('', 'k&#770;<sub>ep,RR</sub>', (-35, 5), (-35, -30, -25, -20, -15, -10, -5, 0, 5)),
+    'KtransRR': ('1', 'K<sub>RR</sub><sup>trans</sup>', (-25, 5), (-25, -20, -15, -10, -5, 0, 5)),
+    'veRR': ('2', 'v<sub>e,RR</sub>', (-10, 5), (-10, -5, 0, 5)),
+}
+FIG3_COLOURS = ('#006837', '#31A354', '#78C679', '#C2E699')
+# Variable name, reference values, title, x title, y range and y ticks
+FIG4 = {
+    'Ktrans': ('Ktrans', 'trueKtRR', 'K<sup>trans</sup>',
+               'Reference K<sup>trans</sup>[min<sup>-1</sup>]', (-40, 160),
+               (-40, -20, 0, 20, 40, 60, 80, 100, 120, 140, 160)),
+    'Ve': ('Ve', 'trueVeRR', 'v<sub>e</sub>', 'Reference v<sub>e</sub>', (-30, 50),
+           (-30, -20, -10, 0, 10, 20, 30, 40, 50)),
+    'Vp': ('Vp', 'trueKtRR', 'v<sub>p</sub>', 'Reference K<sup>trans</sup>[min<sup>-1</sup>]',
+           (-80, 240), (-80, -40, 0, 40, 80, 120, 160, 200, 240)),
+}
+# (variable number, name, colour) of the Figure 4 methods, in slider order
+FIG4_METHODS = (('3', 'ETM', '#bfbfbf'), ('2', 'RRIFT', '#292447'),
+                ('1', 'RRM w/ fixed RR params', '#e45947'))
+
+
+def error_trace(x, avg, lower, upper, name, colour):
+    """A line with asymmetric error bars from ``lower`` to ``upper``."""
+    avg = np.ravel(avg)
+    return dict(type='scatter', x=np.ravel(x), y=avg, name=name, line=dict(color=colour, width=4),
+                showlegend=False,
+                error_y=dict(type='data', array=np.ravel(upper) - avg,
+                             arrayminus=avg - np.ravel(lower), symmetric=False, visible=True,
+                             thickness=4))
+
+
+def slider_figure(traces, labels, title, yRange, yTicks, xTitle, prefix, swap=False):
+    """One panel showing one of ``traces`` at a time, chosen with a slider.
+
+    With swap, the figure holds only the first trace, and the slider
+    steps replace its data (x, y, error bars, colour and name).
+    """
+    if swap:
+        keys = ('x', 'y', 'error_y.array', 'error_y.arrayminus', 'line.color', 'name')
+        updates = [[{key: [_get(trace, key)] for key in keys}, {}] for trace in traces]
+        data = [dict(traces[0], visible=True)]
+        steps = [dict(method='skip', args=[], label=label, value=label) for label in labels]
+    else:
+        data = [dict(trace, visible=k == 0) for k, trace in enumerate(traces)]
+        steps = [dict(method='update', args=[{'visible': mask}], label=label, value=label)
+                 for label, mask in zip(labels, visibility_masks(len(traces), 1))]
+    layout = dict(title=dict(text=title, x=0.5, xanchor='center'),
+                  xaxis=dict(LINE_AXIS, title={'text': xTitle}),
+                  yaxis=dict(LINE_AXIS, title={'text': PERCENT_ERROR}, range=list(yRange),
+                             tickvals=list(yTicks)),
+                  plot_bgcolor='#ffffff',
+                  sliders=[dict(active=0, currentvalue={'prefix': prefix}, pad={'t': 70},
+                                steps=steps)])
+    fig = dict(data=data, layout=layout)
+    if swap:
+        fig['payload'] = swap_payload(updates, [0])
+    return fig
+
+
+def _get(trace, key):
+    # Nested attribute of a trace dict, e.g. 'error_y.array'
+    for name in key.split('.'):
+        trace = trace[name]
+    return trace
+
+
+def _tres_traces(f, suffix, colours):
+    # One error curve per temporal resolution (rows of errMd/errQt)
+    errMd, errQt = f['errMd' + suffix], f['errQt' + suffix]
+    return [error_trace(f['listSigmaC'], errMd[i], errQt[i, :, 0], errQt[i, :, 1], str(tres),
+                        colours[i % len(colours)])
+            for i, tres in enumerate(TRES[:errMd.shape[0]])]
+
+
+def fig2_slider(f, parameter, swap=False):
+    """Figure 2 slider page for 'Ktrans', 'Ve' or 'Vp' (f: fig2andfig3vars)."""
+    suffix, title, yRange, yTicks = FIG2[parameter]
+    traces = _tres_traces(f, suffix, FIG2_COLOURS)
+    return slider_figure(traces, [trace['name'] for trace in traces], title, yRange, yTicks,
+                         NOISE_TITLE, 'Temporal resolution [seconds]: ', swap)
+
+
+def fig3_slider(f, parameter, swap=False):
+    """Figure 3 slider page for 'kepRR', 'KtransRR' or 'veRR' (f: fig2andfig3vars)."""
+    suffix, title, yRange, yTicks = FIG3[parameter]
+    traces = _tres_traces(f, suffix, FIG3_COLOURS)
+    return slider_figure(traces, [trace['name'] for trace in traces], title, yRange, yTicks,
+                         NOISE_TITLE, 'Temporal resolution [seconds]: ', swap)
+
+
+def fig4_slider(f, parameter, swap=False):
+    """Figure 4 slider page for 'Ktrans', 'Ve' or 'Vp' (f: fig4vars)."""
+    name, reference, title, xTitle, yRange, yTicks = FIG4[parameter]
+    traces = [error_trace(f[reference], f[name + '_avg' + num], f[name + '_ci' + num][:, 0],
+                          f[name + '_ci' + num][:, 1], method, colour)
+              for num, method, colour in FIG4_METHODS]
+    return slider_figure(traces, [method for _, method, _ in FIG4_METHODS], title, yRange, yTicks,
+                         xTitle, 'Value: ', swap)
+
+
+def combined_figure(panels, titles, xTitles, yRange, yTicks, xRange=None, xTicks=None):
+    """A row of panels with all their curves, as make_subplots(rows=1, cols=len(panels)).
+
+    panels is a list of trace lists; the legend comes from the last panel.
+    """
+    cols = len(panels)
+    spacing = 0.2 / cols  # make_subplots' default
+    width = (1 - spacing * (cols - 1)) / cols
+    data, annotations = [], []
+    layout = dict(plot_bgcolor='#ffffff')
+    for k, (traces, title, xTitle) in enumerate(zip(panels, titles, xTitles)):
+        suffix = str(k + 1) if k else ''
+        x0 = k * (width + spacing)
+        for trace in traces:
+            data.append(dict(trace, xaxis='x' + suffix, yaxis='y' + suffix,
+                             legendgroup=trace['name'], showlegend=k == cols - 1))
+        xaxis = dict(LINE_AXIS, domain=[x0, x0 + width], anchor='y' + suffix,
+                     title={'text': xTitle})
+        if xRange is not None:
+            xaxis.update(range=list(xRange), tickvals=list(xTicks))
+        layout['xaxis' + suffix] = xaxis
+        layout['yaxis' + suffix] = dict(LINE_AXIS, domain=[0, 1], anchor='x' + suffix,
+                                        range=list(yRange), tickvals=list(yTicks))
+        annotations.append(dict(text=title, x=x0 + width / 2, y=1, xref='paper', yref='paper',
+                                xanchor='center', yanchor='bottom', showarrow=False,
+                                font=dict(size=16)))
+    layout['yaxis']['title'] = {'text': PERCENT_ERROR}
+    layout['annotations'] = annotations
+    return dict(data=data, layout=layout)
+
+
+def fig2_combined(f):
+    """Figure 2: Ktrans, ve and vp errors for every temporal resolution."""
+    return combined_figure([_tres_traces(f, FIG2[p][0], FIG2_COLOURS) for p in FIG2],
+                           [FIG2[p][1] for p in FIG2], [NOISE_TITLE] * len(FIG2), (-50, 50),
+                           range(-50, 51, 10))
+
+
+def fig3_combined(f):
+    """Figure 3: kepRR, KtransRR and veRR errors for every temporal resolution."""
+    return combined_figure([_tres_traces(f, FIG3[p][0], FIG3_COLOURS) for p in FIG3],
+                           [FIG3[p][1] for p in FIG3], [NOISE_TITLE] * len(FIG3), (-35, 5),
+                           range(-35, 6, 5), (0, 0.05), (0, 0.01, 0.02, 0.03, 0.04, 0.05))
+
+
+def fig4_combined(f):
+    """Figure 4: Ktrans, ve and vp errors of every method against the reference values."""
+    panels = [fig4_slider(f, p)['data'] for p in FIG4]
+    return combined_figure(panels, [FIG4[p][2] for p in FIG4], [FIG4[p][3] for p in FIG4],
+                           (-100, 100), range(-100, 101, 20))
+
+
+def figure_views(figName, f, swap=False):
+    """(name, label, figure) of the combined figure and of its slider pages."""
+    combined, build, parameters = {'fig2': (fig2_combined, fig2_slider, FIG2),
+                                   'fig3': (fig3_combined, fig3_slider, FIG3),
+                                   'fig4': (fig4_combined, fig4_slider, FIG4)}[figName]
+    views = [(figName, 'All', combined(f))]
+    for k, parameter in enumerate(parameters, start=1):
+        fig = build(f, parameter, swap)
+        views.append(('{}-{}'.format(figName, k), fig['layout']['title']['text'], fig))
+    return views
+
+
+def load_vars(path):
+    """Variables of a ``.mat`` file, without the MATLAB header entries."""
+    return {k: v for k, v in loadmat(path).items() if not k.startswith('__')}
+
+
+def _report(path, timings):
+    print('{}: {:.1f} kB ({})'.format(path, os.path.getsize(path) / 1e3, ', '.join(
+        '{} {:.3f} s'.format(stage, t) for stage, t in timings.items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--data-dir', default=os.curdir,
+                        help='where fig2andfig3vars.mat and fig4vars.mat are')
+    parser.add_argument('--from-cache', action='store_true',
+                        help='take the variables from the simulation cache instead')
+    parser.add_argument('--out', default='figures')
+    parser.add_argument('--swap', action='store_true',
+                        help='one trace per slider page, whose data the slider swaps')
+    parser.add_argument('--consolidate', action='store_true',
+                        help='one page per figure, with the slider pages as views of it')
+    parser.add_argument('--plotlyjs', default='embed', choices=['embed', 'cdn'],
+                        help='embed plotly.js in every page (needs plotly) or load it from the CDN')
+    args = parser.parse_args(argv)
+
+    if args.from_cache:
+        from .cache import SimulationCache
+        cache = SimulationCache()
+        fig23, fig4 = cache.fig2and3vars(), cache.fig4vars()
+    else:
+        fig23 = load_vars(os.path.join(args.data_dir, 'fig2andfig3vars.mat'))
+        fig4 = load_vars(os.path.join(args.data_dir, 'fig4vars.mat'))
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    include = True if args.plotlyjs == 'embed' else 'cdn'
+    for figName, f in (('fig2', fig23), ('fig3', fig23), ('fig4', fig4)):
+        timings = {}
+        with timed(timings, 'build'):
+            views = figure_views(figName, f, args.swap)
+        if args.consolidate:
+            path = os.path.join(args.out, figName + '.html')
+            with timed(timings, 'write'):
+                write_views_html(views, path, CONFIG, include)
+            _report(path, timings)
+            continue
+        for name, _, fig in views:
+            path = os.path.join(args.out, name + '.html')
+            with timed(timings, 'write'):
+                write_html(fig, path, CONFIG, include)
+            _report(path, timings)
+
+
+if __name__ == '__main__':
+    main()
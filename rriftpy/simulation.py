@@ -0,0 +1,289 @@
+"""Simulation engine shared by the b0x-style analyses.
+
+Ports the virtual phantom of ``b00_makeSimMap.m`` and the per-replication
+body of ``b02_mainSimAnalysis.m``/``b04_secondarySimAnalysis.m``: add noise,
+downsample every voxel with its own random phase, fit the ETM and ERRM,
+pick kepRR, fit CERRM and apply RRIFT on the tail.
+"""
+
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from scipy.io import loadmat
+
+from . import models
+from .rng import cell_generator
+from .stats import percent_error, quantile_ci
+
+SimMap = namedtuple('SimMap', ['t', 'Cp', 'Ct', 'trueKt', 'trueVe', 'trueVp', 'initTRes'])
+SimMap.__doc__ = """Virtual phantom with 100 parameter combinations.
+
+Ct is [time x voxels] with voxels in MATLAB (column-major) order of the
+20x5 map, so they line up with ``trueKt``/``trueVe``/``trueVp`` [voxels].
+Time is in minutes and ``initTRes`` in seconds.
+"""
+
+DEFAULT_SIM_MAP = os.path.join('RRIFT', 'data', 'simMap.mat')
+
+
+def make_sim_map():
+    """Build the virtual phantom, see b00_makeSimMap.m."""
+    nX = 20  # for vp and ve
+    nY = 5  # for Ktrans
+    valKt = np.array([0.05, 0.10, 0.15, 0.20, 0.25])
+    valVe = np.tile([0.15, 0.25, 0.35, 0.45, 0.55], 4)
+    valVp = np.repeat([0.005, 0.01, 0.05, 0.1], 5)
+
+    trueKt = np.tile(valKt, (nX, 1))
+    trueVe = np.tile(valVe[:, None], (1, nY))
+    trueVp = np.tile(valVp[:, None], (1, nY))
+    trueKt, trueVe, trueVp = (x.ravel(order='F') for x in (trueKt, trueVe, trueVp))
+
+    initTRes = 0.1
+    t = np.arange(1, 6001) * initTRes / 60
+    Cp, _ = models.georgiou_aif(t, t[int(round(60 / initTRes)) - 1])
+    Ct = models.tofts_kety(Cp, [trueKt, trueKt / trueVe, trueVp], t)
+    return SimMap(t, Cp, Ct, trueKt, trueVe, trueVp, initTRes)
+
+
+def load_sim_map(path=DEFAULT_SIM_MAP):
+    """Load ``simMap.mat`` if it exists, otherwise build the phantom."""
+    if path is None or not os.path.exists(path):
+        return make_sim_map()
+    f = loadmat(path)
+    simCt = f['simCt']
+    sT = simCt.shape[0]
+    return SimMap(t=f['t'].ravel(),
+                  Cp=f['Cp'].ravel(),
+                  Ct=simCt.reshape(sT, -1, order='F'),
+                  trueKt=f['trueKt'].ravel(order='F'),
+                  trueVe=f['trueVe'].ravel(order='F'),
+                  trueVp=f['trueVp'].ravel(order='F'),
+                  initTRes=float(f['initTRes']))
+
+
+def downsample(x, dFactor, phase):
+    """MATLAB's ``downsample(x, dFactor, phase)`` with one phase per voxel.
+
+    x is [T] or [T x N] and phase is [N]. Returns [L x N], where L is the
+    shortest downsampled length among the phases.
+    """
+    x = np.asarray(x)
+    phase = np.asarray(phase, dtype=int)
+    L = (x.shape[0] - phase.max() - 1) // dFactor + 1
+    idx = phase[None, :] + dFactor * np.arange(L)[:, None]
+    if x.ndim == 1:
+        return x[idx]
+    return np.take_along_axis(x, idx, axis=0)
+
+
+def fit_replication(Ct, Cp, Crr, t, dFactor, phaseValues, tailStart=3):
+    """Fit one noisy replication, the loop body of b02/b04.
+
+    Ct [T x N], Cp [T], Crr [T] are at the initial temporal resolution;
+    dFactor is the downsampling factor and phaseValues [N] the per-voxel
+    phase. See fit_downsampled for the returned values.
+    """
+    return fit_downsampled(downsample(t, dFactor, phaseValues),
+                           downsample(Ct, dFactor, phaseValues),
+                           downsample(Cp, dFactor, phaseValues),
+                           downsample(Crr, dFactor, phaseValues), tailStart)
+
+
+def fit_downsampled(curT, curCt, curCp, curCrr, tailStart=3):
+    """Fit voxels that were already downsampled with per-voxel phases.
+
+    All inputs are [L x N]. Returns a dict with pkETM [N x 3], pkCERRM
+    [N x 5], estKtRR, estKtRRD, estKepRR and the time of the first voxel;
+    RRIFT uses the first voxel's curves, as in b02/b04.
+    """
+    # The voxel fits only use the step size, which is the same for every phase
+    curT0 = curT[:, 0]
+
+    pkETM, _ = models.tofts_llsq(curCt, curCp, curT0, 1)
+    pkERRM, _ = models.errm(curCt, curCrr, curT0)
+    estKepRR = models.estimate_kep_rr(pkERRM)
+    pkCERRM = models.cerrm(curCt, curCrr, curT0, estKepRR)[0]
+
+    fTail = np.argmax(curT0 > tailStart)
+    tail = slice(fTail, None)
+    estKtRR = models.rrift(curCp[tail, 0], curCrr[tail, 0], curT0[tail], estKepRR)[0]
+    estKtRRD = models.rrift_diff(curCp[tail, 0], curCrr[tail, 0], curT0[tail], estKepRR)[0]
+    return dict(pkETM=pkETM, pkCERRM=pkCERRM, estKtRR=estKtRR, estKtRRD=estKtRRD,
+                estKepRR=estKepRR, t=curT0)
+
+
+def simulate_replication(simMap, CrrClean, sigmaC, TRes, rng):
+    """Add noise to the phantom and fit it at temporal resolution TRes (s).
+
+    ``rng`` should be the cell's own stream (see rng.cell_generator). The
+    phases are drawn first, then the AIF and reference noise, then the tissue
+    noise, which is only drawn at the frames each voxel keeps; that is
+    distributed exactly like downsampling a fully noisy curve. The reference
+    region gets a tenth of the tissue noise, as in b02/b04.
+    """
+    nVox = simMap.Ct.shape[1]
+    dFactor = int(round(TRes / simMap.initTRes))
+    phaseValues = rng.integers(0, dFactor, nVox)
+    Cp = simMap.Cp + sigmaC * rng.standard_normal(simMap.Cp.shape)
+    Crr = CrrClean + 0.1 * sigmaC * rng.standard_normal(CrrClean.shape)
+    curCt = downsample(simMap.Ct, dFactor, phaseValues)
+    curCt = curCt + sigmaC * rng.standard_normal(curCt.shape)
+    return fit_downsampled(downsample(simMap.t, dFactor, phaseValues), curCt,
+                           downsample(Cp, dFactor, phaseValues),
+                           downsample(Crr, dFactor, phaseValues))
+
+
+# Workers load the phantom once instead of receiving it with every task
+cached_sim_map = lru_cache(maxsize=2)(load_sim_map)
+
+
+def cell_indices(ktRR, kepRR, sigmaC, TRes):
+    """Stream indices that identify a simulation cell by its parameter values.
+
+    The reference parameters and noise level are taken in micro-units and
+    TRes in milliseconds, so the same physical cell always gets the same
+    stream no matter which list or grid it is part of.
+    """
+    ref = (int(round(ktRR * 1e6)) << 32) | int(round(kepRR * 1e6))
+    acq = (int(round(sigmaC * 1e6)) << 32) | int(round(TRes * 1e3))
+    return ref, acq
+
+
+def run_cell(simMap, ktRR, kepRR, sigmaC, TRes, replications, seed):
+    """Simulate the given replications of one (reference, sigma, TRes) cell.
+
+    Replication p draws from ``cell_generator(seed, p, *cell_indices(...))``.
+    Returns pkETM [N x 3 x R], pkCERRM [N x 5 x R] and estKtRR, estKtRRD,
+    estKepRRS [R] for the R replications.
+    """
+    replications = list(replications)
+    CrrClean = models.tofts_kety(simMap.Cp, [ktRR, kepRR], simMap.t)
+    indices = cell_indices(ktRR, kepRR, sigmaC, TRes)
+    nVox, nRep = simMap.Ct.shape[1], len(replications)
+    cell = dict(pkETM=np.zeros((nVox, 3, nRep)), pkCERRM=np.zeros((nVox, 5, nRep)),
+                estKtRR=np.zeros(nRep), estKtRRD=np.zeros(nRep), estKepRRS=np.zeros(nRep))
+    for k, p in enumerate(replications):
+        rng = cell_generator(seed, p, *indices)
+        res = simulate_replication(simMap, CrrClean, sigmaC, TRes, rng)
+        cell['pkETM'][:, :, k] = res['pkETM']
+        cell['pkCERRM'][:, :, k] = res['pkCERRM']
+        cell['estKtRR'][k] = res['estKtRR']
+        cell['estKtRRD'][k] = res['estKtRRD']
+        cell['estKepRRS'][k] = res['estKepRR']
+    return cell
+
+
+def _cell_task(args):
+    simMapPath, spec, replications, seed = args
+    return run_cell(cached_sim_map(simMapPath), *spec, replications=replications, seed=seed)
+
+
+def compute_cells(specs, repF, seed=12345, simMapPath=DEFAULT_SIM_MAP, workers=None,
+                  blockSize=50):
+    """Run ``repF`` replications of every cell in ``specs`` over a process pool.
+
+    specs is a list of (ktRR, kepRR, sigmaC, TRes) tuples. Replications are
+    handed out in blocks of ``blockSize``; the result is a list of cells
+    (see run_cell) in the order of ``specs`` and does not depend on
+    ``workers`` or ``blockSize``. Repeated specs are only simulated once.
+    """
+    specs = [tuple(float(v) for v in spec) for spec in specs]
+    unique = list(OrderedDict.fromkeys(specs))
+    starts = range(0, repF, blockSize)
+    blocks = [(simMapPath, spec, range(start, min(start + blockSize, repF)), seed)
+              for spec in unique for start in starts]
+    if workers == 1:
+        parts = list(map(_cell_task, blocks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_cell_task, blocks))
+
+    cells = {}
+    for k, spec in enumerate(unique):
+        chunk = parts[k * len(starts):(k + 1) * len(starts)]
+        cells[spec] = _concatenate(chunk)
+    return [cells[spec] for spec in specs]
+
+
+def _concatenate(parts):
+    # Join replication blocks of one cell along the replication axis
+    return {key: np.concatenate([c[key] for c in parts], axis=-1) for key in parts[0]}
+
+
+def reported_errors(cell, simMap, ktRR, kepRR):
+    """Percent errors that the Figure 2/3 summaries report for one cell.
+
+    Returns a list of 1-D arrays: the kepRR, KtransRR and veRR errors [R] and
+    the tissue Ktrans, ve and vp errors from RRIFT [nVox*R].
+    """
+    pkCE = cell['pkCERRM']
+    estKtRR = cell['estKtRR']
+    rrVe = estKtRR / cell['estKepRRS']
+    return [percent_error(cell['estKepRRS'], kepRR),
+            percent_error(estKtRR, ktRR),
+            percent_error(rrVe, ktRR / kepRR),
+            percent_error(pkCE[:, 0] * estKtRR, simMap.trueKt).ravel(),
+            percent_error(pkCE[:, 1] * rrVe, simMap.trueVe).ravel(),
+            percent_error(pkCE[:, 3] * estKtRR, simMap.trueVp).ravel()]
+
+
+def error_ci_width(cell, simMap, ktRR, kepRR, p=(0.25, 0.5, 0.75), level=0.95):
+    """Widest confidence interval, in percentage points, of the reported quantiles."""
+    width = 0.0
+    for err in reported_errors(cell, simMap, ktRR, kepRR):
+        for q in p:
+            lower, upper = quantile_ci(err, q, level=level)
+            width = max(width, float(upper - lower))
+    return width
+
+
+def run_adaptive_cell(simMap, ktRR, kepRR, sigmaC, TRes, seed, tol=1.0, blockSize=50,
+                      minRep=100, maxRep=1000):
+    """Simulate one cell in blocks until its error quantiles have converged.
+
+    Blocks of ``blockSize`` replications are added until the 95% confidence
+    interval of every median and quartile in reported_errors is at most
+    ``tol`` percentage points wide, or ``maxRep`` replications were run.
+    Replications keep their indices, so the result is a prefix of the fixed
+    ``run_cell`` output. The cell also holds nRep and ciWidth.
+    """
+    cell, nRep = None, 0
+    while nRep < maxRep:
+        stop = min(nRep + blockSize, maxRep)
+        block = run_cell(simMap, ktRR, kepRR, sigmaC, TRes, range(nRep, stop), seed)
+        cell = block if cell is None else _concatenate([cell, block])
+        nRep = stop
+        if nRep >= minRep and error_ci_width(cell, simMap, ktRR, kepRR) <= tol:
+            break
+    cell['nRep'] = nRep
+    cell['ciWidth'] = error_ci_width(cell, simMap, ktRR, kepRR)
+    return cell
+
+
+def _adaptive_task(args):
+    simMapPath, spec, seed, options = args
+    return run_adaptive_cell(cached_sim_map(simMapPath), *spec, seed=seed, **options)
+
+
+def compute_cells_adaptive(specs, tol=1.0, maxRep=1000, seed=12345, simMapPath=DEFAULT_SIM_MAP,
+                           workers=None, blockSize=50, minRep=100):
+    """Like compute_cells, but every cell stops once it converged.
+
+    See run_adaptive_cell. Cells run in parallel and each returned cell
+    records how many replications it used in ``nRep``.
+    """
+    specs = [tuple(float(v) for v in spec) for spec in specs]
+    unique = list(OrderedDict.fromkeys(specs))
+    options = dict(tol=tol, blockSize=blockSize, minRep=minRep, maxRep=maxRep)
+    tasks = [(simMapPath, spec, seed, options) for spec in unique]
+    if workers == 1:
+        parts = list(map(_adaptive_task, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_adaptive_task, tasks))
+    cells = dict(zip(unique, parts))
+    return [cells[spec] for spec in specs]
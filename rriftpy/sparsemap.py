@@ -0,0 +1,109 @@
+"""Parametric maps stored as the values inside a mask.
+
+c02 allocates every map with ``zeros(sX,sY,sZ)`` although only the voxels
+in maskCt are ever set, and the figures copy these volumes around to show
+one slice (or the small region around the tumour) at a time. A SparseMap
+keeps just the flat column-major (MATLAB) indices of the set voxels, their
+values and the volume shape, and densifies on request only the slice or
+bounding box that is being shown.
+"""
+
+import numpy as np
+
+from .voxelstore import mask_index, slice_starts
+
+
+class SparseMap(object):
+    """Values at sorted flat column-major indices of a volume of ``shape``.
+
+    ``dense`` gives back the full array, ``slice`` one [sX x sY] slice and
+    ``crop`` only the part inside a bounding box (see ``bbox``). Voxels
+    that are not stored read as ``fill``, 0 by default as in c02.
+    """
+
+    def __init__(self, index, values, shape):
+        index = np.asarray(index)
+        self.index = index if np.issubdtype(index.dtype, np.integer) else index.astype(np.int64)
+        self.values = np.asarray(values)
+        self.shape = tuple(int(n) for n in shape)
+        if self.index.shape != self.values.shape[:1]:
+            raise ValueError('{} indices but {} values'.format(self.index.size,
+                                                               self.values.shape[0]))
+        if self.index.size and np.any(np.diff(self.index) <= 0):
+            raise ValueError('indices must be sorted and unique')
+        self._sliceStart = None
+
+    @classmethod
+    def from_dense(cls, x, mask=None):
+        """The voxels of ``x`` inside ``mask``, by default the non-zero ones (NaN included)."""
+        x = np.asarray(x)
+        index = mask_index(x != 0 if mask is None else mask)
+        return cls(index, x.ravel(order='F')[index], x.shape)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + self.values.nbytes
+
+    @property
+    def sliceStart(self):
+        if self._sliceStart is None:
+            self._sliceStart = slice_starts(self.index, self.shape)
+        return self._sliceStart
+
+    def _empty(self, shape, fill):
+        return np.full(shape, fill, dtype=np.result_type(self.values, type(fill)), order='F')
+
+    def dense(self, fill=0):
+        """The whole volume as a dense array."""
+        out = self._empty(self.shape, fill)
+        out.reshape(-1, order='F')[self.index] = self.values
+        return out
+
+    def slice(self, z, fill=0):
+        """Slice ``z`` (0-based) as a dense [sX x sY] array."""
+        sliceSize = self.shape[0] * self.shape[1]
+        run = slice(int(self.sliceStart[z]), int(self.sliceStart[z + 1]))
+        out = self._empty(sliceSize, fill)
+        out[self.index[run] - z * sliceSize] = self.values[run]
+        return out.reshape(self.shape[:2], order='F')
+
+    def coordinates(self):
+        """Subscripts of the stored voxels, one array per dimension (0-based)."""
+        return np.unravel_index(self.index, self.shape, order='F')
+
+    def bbox(self, pad=0):
+        """Bounding box of the stored voxels as a tuple of slices, one per dimension.
+
+        The box is grown by ``pad`` voxels on every side (clipped to the
+        volume); an empty map gives an empty box.
+        """
+        if not self.index.size:
+            return tuple(slice(0, 0) for _ in self.shape)
+        return tuple(slice(max(int(c.min()) - pad, 0), min(int(c.max()) + 1 + pad, n))
+                     for c, n in zip(self.coordinates(), self.shape))
+
+    def crop(self, box=None, fill=0):
+        """Dense array of the voxels inside ``box`` (default: the bounding box)."""
+        box = self.bbox() if box is None else box
+        box = tuple(slice(*b.indices(n)[:2]) for b, n in zip(box, self.shape))
+        coords = self.coordinates()
+        inside = np.ones(self.index.size, dtype=bool)
+        for c, b in zip(coords, box):
+            inside &= (c >= b.start) & (c < b.stop)
+        out = self._empty(tuple(b.stop - b.start for b in box), fill)
+        out[tuple(c[inside] - b.start for c, b in zip(coords, box))] = self.values[inside]
+        return out
+
+
+def dense_slice(x, z=None, fill=0):
+    """Slice ``z`` of a dense array or SparseMap (2-D maps are returned whole)."""
+    if isinstance(x, SparseMap):
+        if len(x.shape) == 2:
+            return x.dense(fill)
+        return x.slice(z, fill)
+    x = np.asarray(x)
+    return x if x.ndim == 2 else x[:, :, z]
@@ -0,0 +1,196 @@
+"""Precompressed, content-hashed copies of the figure pages and assets.
+
+The pages in ``figures/`` have fixed names, so a browser has to check
+them for changes on every visit, and are several MB of uncompressed
+JSON. ``build_static`` copies every page and asset to an output directory
+under a name holding a hash of its content (``figures/fig2.html`` ->
+``figures/fig2.<hash>.html``), which changes whenever the content does
+and can therefore be cached forever, next to gzip (``.gz``) and, if the
+``brotli`` module is installed, brotli (``.br``) variants for servers
+that send precompressed files (nginx's gzip_static, or
+``rriftpy.dataserver``). Variants that would not be smaller, e.g. of PNG
+images, are not written.
+
+``manifest.json`` in the output directory maps every original path to
+its hashed name and sizes; a run adds its files to the manifest and
+keeps the entries of the others. ``asset_path`` reads it, but the page
+cells of the book do not call it yet: until they link the figures
+through it, the book serves the unhashed pages and gets none of the
+caching. Files whose hash is already in the output directory are not
+written again, only their missing variants (incompressible files, which
+have none, are therefore compressed again on every run), and earlier
+versions are left in place so that pages cached by browsers keep
+working; delete the directory to drop them. The output directory is
+copied into the book by ``html_extra_path`` (see ``_config.yml``).
+
+Usage (from the repository root)::
+
+    python -m rriftpy.static figures images --out static
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+from functools import lru_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_OUT_DIR = 'static'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12  # hex digits of the content hash in the file names
+# Suffixes of the precompressed variants, by content coding
+SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(path, data):
+    """``path`` with the content hash of data before its extension."""
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, content_hash(data), ext)
+
+
+def gzip_compress(data, level=9):
+    # mtime=0 so that the same page always compresses to the same bytes
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=level, mtime=0) as fid:
+        fid.write(data)
+    return out.getvalue()
+
+
+def codings():
+    """The content codings build_static can write: brotli only if installed."""
+    return [coding for coding, _ in SUFFIXES if coding != 'br' or brotli is not None]
+
+
+def compress(data, only=None):
+    """Precompressed variants of data: a dict of content coding -> bytes.
+
+    ``only`` restricts the codings (default: every one of codings()); a
+    variant that is not smaller than data is left out.
+    """
+    out = {}
+    for coding in codings() if only is None else only:
+        out[coding] = gzip_compress(data) if coding == 'gzip' else \
+            brotli.compress(data, quality=11)
+    return {coding: x for coding, x in out.items() if len(x) < len(data)}
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fid:
+        fid.write(data)
+    os.replace(tmp, path)
+
+
+def list_files(paths):
+    """The files of paths (files, or directories searched recursively), sorted."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                files += [os.path.join(directory, name) for name in names]
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def build_static(paths, outDir=DEFAULT_OUT_DIR, root=os.curdir):
+    """Write the hashed and precompressed copies of paths and the manifest.
+
+    Files are named by their path relative to root, with '/' separators.
+    The entries of files not in paths are kept from the manifest already
+    in outDir. Returns the manifest: a dict of name -> dict(file=hashed
+    name, size=bytes, and the bytes of every precompressed variant by
+    coding).
+    """
+    suffixes = dict(SUFFIXES)
+    manifestPath = os.path.join(outDir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifestPath):
+        # Not through load_manifest: its cache must not hide a write of the same second
+        with open(manifestPath) as fid:
+            manifest = json.load(fid)
+    for path in list_files(paths):
+        name = os.path.relpath(path, root).replace(os.sep, '/')
+        if name.startswith('../'):
+            raise ValueError('{} is not under {}'.format(path, root))
+        with open(path, 'rb') as fid:
+            data = fid.read()
+        fileName = hashed_name(name, data)
+        target = os.path.join(outDir, *fileName.split('/'))
+        entry = dict(file=fileName, size=len(data))
+        exists = os.path.exists(target)
+        # Same content: only the variants missing (e.g. brotli installed since) are made
+        missing = [coding for coding in codings()
+                   if not (exists and os.path.exists(target + suffixes[coding]))]
+        for coding, x in compress(data, missing).items():
+            _write(target + suffixes[coding], x)
+        for coding, suffix in SUFFIXES:
+            if os.path.exists(target + suffix):
+                entry[coding] = os.path.getsize(target + suffix)
+        # The file itself last, so that its presence means the variants are there
+        if not exists:
+            _write(target, data)
+        manifest[name] = entry
+    _write(manifestPath, json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return manifest
+
+
+@lru_cache(maxsize=4)
+def _manifest(path, mtime):
+    with open(path) as fid:
+        return json.load(fid)
+
+
+def load_manifest(path=os.path.join(DEFAULT_OUT_DIR, MANIFEST)):
+    """The manifest written by build_static (reread only when it changes), or {}."""
+    if not os.path.exists(path):
+        return {}
+    return _manifest(os.path.abspath(path), os.path.getmtime(path))
+
+
+def asset_path(name, manifest=os.path.join(DEFAULT_OUT_DIR, MANIFEST)):
+    """Hashed name of a page or asset, e.g. 'figures/fig2.html'.
+
+    Falls back to name itself if it is not in the manifest, so that the
+    page still works before build_static has been run.
+    """
+    entry = load_manifest(manifest).get(name)
+    return entry['file'] if entry else name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='*', default=['figures', 'images'],
+                        help='pages and assets, or directories of them (default: figures images)')
+    parser.add_argument('--out', default=DEFAULT_OUT_DIR)
+    parser.add_argument('--root', default=os.curdir,
+                        help='directory the names in the manifest are relative to')
+    args = parser.parse_args(argv)
+
+    manifest = build_static(args.paths, args.out, args.root)
+    total = {coding: 0 for coding in ('size',) + tuple(dict(SUFFIXES))}
+    for entry in manifest.values():
+        for key in total:
+            total[key] += entry.get(key, entry['size'])
+    print('{} files, {:.1f} kB; gzip {:.1f} kB{}'.format(
+        len(manifest), total['size'] / 1e3, total['gzip'] / 1e3,
+        '; brotli {:.1f} kB'.format(total['br'] / 1e3) if brotli is not None else
+        ' (brotli not installed)'))
+    print('manifest: ' + os.path.join(args.out, MANIFEST))
+
+
+if __name__ == '__main__':
+    main()
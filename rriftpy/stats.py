@@ -0,0 +1,243 @@
+"""Summary statistics used by the simulations, ported from ``RRIFT/mfiles``.
+
+All reductions follow MATLAB's conventions (``quantile`` interpolation,
+``std`` with N-1 normalisation) so that the Python summaries match the
+``.mat`` files used by the notebook.
+"""
+
+import numpy as np
+from scipy import stats
+
+
+# Above this many distinct NaN counts among the slices, quantile sorts fully
+MAX_PARTITION_GROUPS = 8
+
+
+def quantile(x, p, axis=None):
+    """NaN-ignoring quantiles with MATLAB's ``quantile`` definition.
+
+    The sorted values are placed at cumulative probabilities (i-0.5)/n and
+    linearly interpolated; probabilities outside that range clamp to the
+    minimum/maximum. The quantile axis is appended last when ``p`` is a
+    sequence.
+
+    Only the order statistics that are needed are found, with a partial
+    sort (np.partition) per group of slices with the same number of NaNs.
+    """
+    x = np.asarray(x, dtype=float)
+    if axis is None:
+        x = x.ravel()
+        axis = 0
+    x = np.moveaxis(x, axis, -1)
+    scalar = np.ndim(p) == 0
+    p = np.atleast_1d(np.asarray(p, dtype=float))
+    n = (~np.isnan(x)).sum(axis=-1)
+    counts = np.unique(n)
+    if counts.size > MAX_PARTITION_GROUPS:
+        q = _quantile_sorted(np.sort(x, axis=-1), p)  # NaNs are sorted last
+    else:
+        q = np.empty(x.shape[:-1] + p.shape)
+        for m in counts:
+            rows = Ellipsis if counts.size == 1 else n == m
+            q[rows] = _quantile_partitioned(x[rows], int(m), p)
+    return q[..., 0] if scalar else q
+
+
+def _positions(n, p):
+    # Indices of the order statistics around MATLAB's quantile p of n
+    # values, and the interpolation weight of the upper one
+    last = np.maximum(n - 1, 0)
+    pos = np.clip(n * p - 0.5, 0, last)
+    lo = np.floor(pos).astype(int)
+    return lo, np.minimum(lo + 1, last), pos - lo
+
+
+def _quantile_partitioned(x, n, p):
+    # Quantiles p [K] along the last axis of x, every slice with n non-NaN values
+    if n == 0:
+        return np.full(x.shape[:-1] + p.shape, np.nan)
+    lo, hi, frac = _positions(n, p)
+    # Partition at each position in turn, every time only the part to the
+    # right of the previous one (NaNs go last)
+    kth = np.unique(lo)
+    x = np.array(x)
+    start = 0
+    for k in kth:
+        x[..., start:].partition(k - start, axis=-1)
+        start = k + 1
+    # The order statistic after a partition point is the smallest value of
+    # the (unsorted) run up to the next one; the last run also holds the NaNs
+    stops = dict(zip(kth, list(kth[1:] + 1) + [None]))
+    xlo = x[..., lo]
+    xhi = np.stack([np.fmin.reduce(x[..., l + 1:stops[l]], axis=-1) if h > l else x[..., l]
+                    for l, h in zip(lo, hi)], axis=-1)
+    return np.where(frac > 0, xlo + frac * (xhi - xlo), xlo)
+
+
+def _quantile_sorted(x, p, perSlice=False):
+    # MATLAB-style quantiles of data sorted along the last axis (NaNs last).
+    # p is [K], or with perSlice one probability per slice [x.shape[:-1]].
+    n = (~np.isnan(x)).sum(axis=-1)
+    p = np.asarray(p, dtype=float)
+    p = p[..., None] if perSlice else p
+    lo, hi, frac = _positions(n[..., None], p)
+    xlo = np.take_along_axis(x, np.broadcast_to(lo, x.shape[:-1] + lo.shape[-1:]), axis=-1)
+    xhi = np.take_along_axis(x, np.broadcast_to(hi, x.shape[:-1] + hi.shape[-1:]), axis=-1)
+    with np.errstate(invalid='ignore'):
+        q = np.where(frac > 0, xlo + frac * (xhi - xlo), xlo)
+    q[n == 0] = np.nan
+    return q[..., 0] if perSlice else q
+
+
+def quantile_filter(x, qtRange=(0.25, 0.75), axis=None):
+    """Set the values outside the ``qtRange`` quantiles to NaN, see QuantileFilter.m.
+
+    The quantiles are taken over the whole array (as QuantileFilter.m) or,
+    with ``axis``, separately for every slice along it. Returns a copy.
+    """
+    x = np.array(x, dtype=float)
+    qt = quantile(x, qtRange, axis=axis)
+    if axis is not None:
+        qt = [np.expand_dims(qt[..., k], axis) for k in range(2)]
+    with np.errstate(invalid='ignore'):
+        x[(x > qt[1]) | (x < qt[0])] = np.nan
+    return x
+
+
+def percent_error(estVals, trueVals):
+    """Percent error of estimates against true values, see PercentError.m.
+
+    trueVals is broadcast against estVals the way PercentError.m repmats it:
+    along rows if its length matches the number of rows, otherwise along
+    columns.
+    """
+    estVals = np.asarray(estVals, dtype=float)
+    trueVals = np.asarray(trueVals, dtype=float)
+    if trueVals.shape != estVals.shape and trueVals.ndim == 1 and estVals.ndim > 1:
+        if estVals.shape[0] == trueVals.size:
+            trueVals = trueVals.reshape((-1,) + (1,) * (estVals.ndim - 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 * (estVals - trueVals) / trueVals
+
+
+def conf_interval(x, interval=(0.025, 0.975), axis=-1):
+    """Student-t confidence interval of the mean along an axis, see ConfInterval.m.
+
+    Returns ``(CI, AVG)``: CI has the reduced axis replaced by a trailing axis
+    of length ``len(interval)``. As in MATLAB, NaNs are skipped for the mean
+    and standard deviation but still count towards the sample size.
+    """
+    x = np.moveaxis(np.asarray(x, dtype=float), axis, -1)
+    n = x.shape[-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = np.nanmean(x, axis=-1) if n else np.full(x.shape[:-1], np.nan)
+        sem = np.nanstd(x, axis=-1, ddof=1) / np.sqrt(n)
+    ts = stats.t.ppf(np.asarray(interval, dtype=float), n - 1)
+    CI = avg[..., None] + ts * sem[..., None]
+    return CI, avg
+
+
+def _iqr_values(x, axis):
+    # x with the reduction axis last, which of its values lie strictly
+    # inside the interquartile range, and the quartiles
+    x = np.asarray(x, dtype=float)
+    if axis is None:
+        x = x.ravel()
+        axis = 0
+    x = np.moveaxis(x, axis, -1)
+    qtRange = quantile(x, [0.25, 0.75], axis=-1)
+    with np.errstate(invalid='ignore'):
+        inside = (x > qtRange[..., :1]) & (x < qtRange[..., 1:])
+    return x, inside, qtRange
+
+
+def iqr_mean(x, axis=None):
+    """Mean of the values strictly inside the interquartile range, see iqrMean.m.
+
+    Over the whole array, or for every slice along ``axis``; NaN where a
+    slice has no value inside its interquartile range.
+    """
+    x, inside, _ = _iqr_values(x, axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(inside, x, 0).sum(axis=-1) / inside.sum(axis=-1)
+
+
+def iqr_stats(x, axis=0, interval=(0.025, 0.975)):
+    """All outputs of iqrMean.m along an axis (by default per column, as there).
+
+    Returns ``(iqrM, iqrStd, iqrConfInterval, qtRange)``: the mean and
+    standard deviation of the values inside the interquartile range, the
+    Student-t confidence interval of that mean (trailing axis of length
+    ``len(interval)``) and the quartiles (trailing axis of length 2).
+    """
+    x, inside, qtRange = _iqr_values(x, axis)
+    n = inside.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        iqrM = np.where(inside, x, 0).sum(axis=-1) / n
+        iqrStd = np.sqrt((np.where(inside, x - iqrM[..., None], 0) ** 2).sum(axis=-1) / (n - 1))
+        ts = stats.t.ppf(np.asarray(interval, dtype=float), n[..., None] - 1)
+    return iqrM, iqrStd, iqrM[..., None] + ts * (iqrStd / np.sqrt(n))[..., None], qtRange
+
+
+def quantile_ci(x, p, axis=None, level=0.95):
+    """Distribution-free confidence interval of the ``p``-quantile.
+
+    Uses the normal approximation to the binomial distribution of the order
+    statistics: the bounds are the quantiles at ``p -/+ z*sqrt(p(1-p)/n)``,
+    with n the number of non-NaN values. Returns ``(lower, upper)``.
+    """
+    x = np.asarray(x, dtype=float)
+    if axis is None:
+        x = x.ravel()
+        axis = 0
+    n = np.maximum((~np.isnan(x)).sum(axis=axis), 1)
+    z = stats.norm.ppf(0.5 + level / 2)
+    half = z * np.sqrt(p * (1 - p) / n)
+    x = np.sort(np.moveaxis(x, axis, -1), axis=-1)
+    lower = _quantile_sorted(x, np.clip(p - half, 0, 1), perSlice=True)
+    upper = _quantile_sorted(x, np.clip(p + half, 0, 1), perSlice=True)
+    return lower, upper
+
+
+def pair_terms(x, y):
+    """Per-pair terms [6 x ...] whose sums are returned by pair_sums.
+
+    For every (x, y) pair: 1 and x, y, x^2, y^2, x*y if both are finite,
+    zeros otherwise. Weighted sums of the terms (e.g. by bootstrap counts)
+    give the pair sums of a resampled set of voxels.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = np.where(valid, x, 0), np.where(valid, y, 0)
+    return np.stack([valid.astype(float), x, y, x * x, y * y, x * y])
+
+
+def pair_sums(x, y, axis=-1):
+    """Sums over ``axis`` of the pairs where both x and y are finite.
+
+    Returns [6 x ...]: the number of pairs and the sums of x, y, x^2, y^2
+    and x*y. Sums of separate groups of voxels add up to the sums of the
+    pooled voxels, which is how ccc_from_sums pools patients.
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    return pair_terms(np.moveaxis(x, axis, -1), np.moveaxis(y, axis, -1)).sum(axis=-1)
+
+
+def ccc_from_sums(sums):
+    """Concordance correlation coefficient and Pearson's r from pair_sums.
+
+    Returns ``(ccc, pearson, n)`` like CCC.m; the variances are normalised
+    by n, as there.
+    """
+    n, sx, sy, sxx, syy, sxy = sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mx, my = sx / n, sy / n
+        vx, vy, cxy = sxx / n - mx * mx, syy / n - my * my, sxy / n - mx * my
+        cccoeff = 2 * cxy / (vx + vy + (mx - my) ** 2)
+        pearson = cxy / np.sqrt(vx * vy)
+    return cccoeff, pearson, n.astype(int)
+
+
+def ccc(x, y, axis=-1):
+    """CCC.m along an axis: ``(ccc, pearson, numGoodVox)`` of the finite pairs."""
+    return ccc_from_sums(pair_sums(x, y, axis))
@@ -0,0 +1,169 @@
+"""Reference-region parameter sweep behind Figure 4.
+
+Python version of ``b04_secondarySimAnalysis.m`` and the summary part of
+``b05_secondarySimFigures.m``. KtransRR is swept with veRR held at its
+nominal value and vice versa; the grid points are independent simulation
+cells, so they are spread over a process pool. The output is a ``fig4vars.mat``
+with the same variables the notebook reads.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.sweep --workers 8 --n-grid 17 --out fig4vars.mat
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from scipy.io import savemat
+
+from .simulation import DEFAULT_SIM_MAP, cached_sim_map, compute_cells
+from .stats import conf_interval, percent_error, quantile
+
+EXPERIMENTS = ('varKtRR', 'varVeRR')
+
+
+def reference_grid(nGrid=9, ktRange=(0.03, 0.11), veRange=(0.10, 0.18)):
+    """KtransRR and veRR grids; the defaults are the 9 values of b04."""
+    return (np.round(np.linspace(ktRange[0], ktRange[1], nGrid), 6),
+            np.round(np.linspace(veRange[0], veRange[1], nGrid), 6))
+
+
+def sweep_specs(ktRR, veRR, ktRRNominal=0.07, veRRNominal=0.14, sigmaC=0.02, TRes=15):
+    """Cell specs of both sweeps, keyed by experiment."""
+    return {'varKtRR': [(kt, kt / veRRNominal, sigmaC, TRes) for kt in ktRR],
+            'varVeRR': [(ktRRNominal, ktRRNominal / ve, sigmaC, TRes) for ve in veRR]}
+
+
+def assemble_sweep(cells, ktRR, veRR, ktRRNominal=0.07, veRRNominal=0.14):
+    """Arrange the cells of each experiment into the b04 output layout.
+
+    ``cells`` maps each experiment to its cells in ``sweep_specs`` order.
+    Each experiment holds pkETM [nGrid x nVox x 3 x repF], pkCERRM
+    [nGrid x nVox x 5 x repF], estKtRR/estKtRRD/estKepRRS [nGrid x repF]
+    and trueKtRR/trueVeRR [nGrid].
+    """
+    truth = {'varKtRR': (np.asarray(ktRR, dtype=float), np.full(len(ktRR), veRRNominal)),
+             'varVeRR': (np.full(len(veRR), ktRRNominal), np.asarray(veRR, dtype=float))}
+    results = {}
+    for experiment in EXPERIMENTS:
+        result = {key: np.stack([c[key] for c in cells[experiment]])
+                  for key in ('pkETM', 'pkCERRM', 'estKtRR', 'estKtRRD', 'estKepRRS')}
+        result['trueKtRR'], result['trueVeRR'] = truth[experiment]
+        results[experiment] = result
+    return results
+
+
+def run_sweep(simMapPath=DEFAULT_SIM_MAP, ktRR=None, veRR=None, ktRRNominal=0.07,
+              veRRNominal=0.14, sigmaC=0.02, TRes=15, repF=1000, seed=12345, workers=None,
+              blockSize=50):
+    """Run both reference-parameter sweeps of b04.
+
+    Returns a dict keyed by experiment ('varKtRR', 'varVeRR'), see
+    assemble_sweep. Every replication draws from its own counter-based
+    stream, so results do not depend on ``workers``.
+    """
+    if ktRR is None or veRR is None:
+        defaultKt, defaultVe = reference_grid()
+        ktRR = defaultKt if ktRR is None else ktRR
+        veRR = defaultVe if veRR is None else veRR
+    specs = sweep_specs(ktRR, veRR, ktRRNominal, veRRNominal, sigmaC, TRes)
+    cells = compute_cells(specs['varKtRR'] + specs['varVeRR'], repF, seed, simMapPath,
+                          workers, blockSize)
+    n = len(specs['varKtRR'])
+    return assemble_sweep({'varKtRR': cells[:n], 'varVeRR': cells[n:]}, ktRR, veRR,
+                          ktRRNominal, veRRNominal)
+
+
+def save_sim_results(path, result, sigmaC=0.02, TRes=15):
+    """Save one experiment in the layout of ``simResultsTRes15-var*.mat``."""
+    savemat(path, dict(
+        pkETM=result['pkETM'], pkCERRM=result['pkCERRM'],
+        estKtRR=result['estKtRR'], estKtRRD=result['estKtRRD'], estKepRRS=result['estKepRRS'],
+        trueKtRR=result['trueKtRR'][:, None], trueVeRR=result['trueVeRR'][:, None],
+        trueKepRR=(result['trueKtRR'] / result['trueVeRR'])[:, None],
+        listSigmaC=sigmaC, TRes=TRes, repF=result['estKtRR'].shape[1]))
+
+
+def _percent_errors(result, simMap, ktRRNominal, veRRNominal):
+    # Percent errors [nGrid x 3 params x nVox*repF] for RRM, RRIFT and ETM, as in b05
+    pkCERRM = result['pkCERRM']
+    pkETM = result['pkETM']
+    estKtRR = result['estKtRR'][:, None, :]
+    estVeRR = estKtRR / result['estKepRRS'][:, None, :]
+    truth = [simMap.trueKt, simMap.trueVe, simMap.trueVp]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        est = {
+            'RRM': [pkCERRM[:, :, 0] * ktRRNominal, pkCERRM[:, :, 1] * veRRNominal,
+                    pkCERRM[:, :, 3] * ktRRNominal],
+            'RRIFT': [pkCERRM[:, :, 0] * estKtRR, pkCERRM[:, :, 1] * estVeRR,
+                      pkCERRM[:, :, 3] * estKtRR],
+            'ETM': [pkETM[:, :, 0], pkETM[:, :, 0] / pkETM[:, :, 1], pkETM[:, :, 2]],
+        }
+    nGrid = pkCERRM.shape[0]
+    return {method: np.stack([percent_error(e, truth[k][None, :, None]).reshape(nGrid, -1)
+                              for k, e in enumerate(vals)], axis=1)
+            for method, vals in est.items()}
+
+
+def summarize_fig4(results, simMap, ktRRNominal=0.07, veRRNominal=0.14, summary='quartile'):
+    """Build the ``fig4vars.mat`` variables from the sweep results.
+
+    Method 1 is the RRM with fixed reference parameters, 2 is RRIFT and 3 is
+    the ETM. Ktrans and vp come from the KtransRR sweep, ve from the veRR
+    sweep. ``summary='quartile'`` reproduces b05 (median and interquartile
+    range); ``summary='mean'`` reports the mean and its 95% confidence
+    interval from ConfInterval.
+    """
+    errKt = _percent_errors(results['varKtRR'], simMap, ktRRNominal, veRRNominal)
+    errVe = _percent_errors(results['varVeRR'], simMap, ktRRNominal, veRRNominal)
+
+    out = {'trueKtRR': results['varKtRR']['trueKtRR'][:, None],
+           'trueVeRR': results['varVeRR']['trueVeRR'][:, None]}
+    for num, method in enumerate(('RRM', 'RRIFT', 'ETM'), start=1):
+        for name, err in (('Ktrans', errKt[method][:, 0]), ('Ve', errVe[method][:, 1]),
+                          ('Vp', errKt[method][:, 2])):
+            if summary == 'mean':
+                ci, avg = conf_interval(err, axis=-1)
+            else:
+                qt = quantile(err, [0.25, 0.5, 0.75], axis=-1)
+                avg, ci = qt[..., 1], qt[..., ::2]
+            out['{}_avg{}'.format(name, num)] = avg[:, None]
+            out['{}_ci{}'.format(name, num)] = ci
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sim-map', default=DEFAULT_SIM_MAP,
+                        help='simMap.mat from b00 (rebuilt if missing)')
+    parser.add_argument('--out', default='fig4vars.mat')
+    parser.add_argument('--raw-dir', default=None,
+                        help='also save simResultsTRes<TRes>-var*.mat files here')
+    parser.add_argument('--n-grid', type=int, default=9, help='grid points per sweep')
+    parser.add_argument('--rep', type=int, default=1000, help='replications per grid point')
+    parser.add_argument('--sigma', type=float, default=0.02, help='noise level in mM')
+    parser.add_argument('--tres', type=float, default=15, help='temporal resolution in s')
+    parser.add_argument('--seed', type=int, default=12345)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--summary', choices=('quartile', 'mean'), default='quartile')
+    args = parser.parse_args(argv)
+
+    ktRR, veRR = reference_grid(args.n_grid)
+    tic = time.time()
+    results = run_sweep(args.sim_map, ktRR, veRR, sigmaC=args.sigma, TRes=args.tres,
+                        repF=args.rep, seed=args.seed, workers=args.workers)
+    if args.raw_dir:
+        for experiment in EXPERIMENTS:
+            name = 'simResultsTRes{:g}-{}.mat'.format(args.tres, experiment)
+            save_sim_results(os.path.join(args.raw_dir, name), results[experiment],
+                             args.sigma, args.tres)
+    savemat(args.out, summarize_fig4(results, cached_sim_map(args.sim_map),
+                                     summary=args.summary))
+    print('Saved {} in {:.1f} s'.format(args.out, time.time() - tic))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Sensitivity of RRIFT to the start of the tail, across the cohort.
+
+Python version of ``c05_doRRIFT_smallerTails.m``. CERRM is fitted once per
+patient; the KtransRR estimates for every (patient, tail start) pair are
+then computed in a single vectorized pass, because the integrals of a tail
+starting at frame f are the full cumulative integrals minus their value at
+f. Changing the reference frame or the tolerance only re-runs the cheap
+summary.
+
+Frame numbers are 1-based, as in the MATLAB scripts (``refFrame = 33`` is
+the tail used by c02).
+
+Usage (from the repository root)::
+
+    python -m rriftpy.tails --ref-frame 33 --tol 20
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.io import savemat
+
+from . import models
+from .patients import (DEFAULT_PREPROCESSED_DIR, list_studies, load_preprocessed,
+                       read_preprocessed, study_name)
+from .stats import percent_error
+
+
+def rrift_tails(Cp, Crr, t, kepRR, tailList):
+    """RRIFT estimate of KtransRR for every curve and every tail start.
+
+    Cp, Crr and t are [T] or [T x P] (one column per patient), kepRR is a
+    scalar or [P] and tailList holds 1-based start frames. Returns estKtRR
+    [P x nTails]; ``rrift_tails(...)[p, k]`` equals
+    ``models.rrift(Cp[f:, p], Crr[f:, p], t[f:, p], kepRR[p])[0]`` with
+    ``f = tailList[k] - 1``.
+    """
+    Cp, Crr, t = (np.asarray(x, dtype=float) for x in (Cp, Crr, t))
+    Cp, Crr, t = (x[:, None] if x.ndim == 1 else x for x in (Cp, Crr, t))
+    Cp, Crr, t = np.broadcast_arrays(Cp, Crr, t)
+    kepRR = np.asarray(kepRR, dtype=float)
+    start = np.asarray(tailList, dtype=int) - 1
+
+    intCp = models.cumtrapz(Cp, t)
+    intCrr = models.cumtrapz(Crr, t)
+    # [nTails x T x P]: frames before the tail start are masked out
+    inTail = (np.arange(t.shape[0])[None, :] >= start[:, None])[:, :, None]
+    denum = intCp[None] - intCp[start][:, None]
+    num = Crr[None] - Crr[start][:, None] + kepRR * (intCrr[None] - intCrr[start][:, None])
+    denum = np.where(inTail, denum, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        estKtRR = (denum * num).sum(axis=1) / (denum * denum).sum(axis=1)
+    return estKtRR.T
+
+
+def tail_sensitivity(inDir=DEFAULT_PREPROCESSED_DIR, tailList=None, verbose=False):
+    """Run c05: fit CERRM per patient and RRIFT for every tail start.
+
+    tailList defaults to every frame but the last. Returns a dict with the
+    study names, estKtRR [nPatients x nTails], estKepRR [nPatients], t
+    [T x nPatients] and tailList. With verbose, every study is printed
+    as it is fitted.
+    """
+    paths = list_studies(inDir)
+    Cp, Crr, t, estKepRR = [], [], [], []
+    for path in paths:
+        if verbose:
+            print(study_name(path))
+        f = load_preprocessed(path)
+        estKepRR.append(models.cerrm(f['Ct'], f['Crr'], f['t'])[2])
+        Cp.append(f['Cp'])
+        Crr.append(f['Crr'])
+        t.append(f['t'])
+    t = np.stack(t, axis=-1)
+    if tailList is None:
+        tailList = np.arange(1, t.shape[0])
+    estKepRR = np.array(estKepRR)
+    estKtRR = rrift_tails(np.stack(Cp, axis=-1), np.stack(Crr, axis=-1), t, estKepRR, tailList)
+    return dict(studies=[study_name(p) for p in paths], estKtRR=estKtRR, estKepRR=estKepRR,
+                t=t, tailList=np.asarray(tailList))
+
+
+def threshold_summary(result, refFrame=33, tol=20):
+    """Percent change of KtransRR relative to the tail starting at ``refFrame``.
+
+    Returns percentChange [nPatients x nTails], tailDuration [nPatients x
+    nTails] (t(end) - t(start), in minutes), exceeds (|percent change| >
+    tol) and, as printed by c05, firstFrame - the first tail start at which
+    any patient exceeds the tolerance - and its tail duration (NaN when no
+    tail does). Raises ValueError if refFrame is not one of the tail starts.
+    """
+    tailList = list(result['tailList'])
+    if refFrame not in tailList:
+        raise ValueError('refFrame {} is not a tail start of the grid, which has frames {} '
+                         'to {}'.format(refFrame, min(tailList), max(tailList)))
+    t = result['t']
+    estKtRR = result['estKtRR']
+    percentChange = percent_error(estKtRR, estKtRR[:, tailList.index(refFrame)])
+    tailDuration = (t[-1] - t[np.asarray(tailList) - 1]).T
+    exceeds = np.abs(percentChange) > tol
+    anyExceeds = exceeds.any(axis=0)
+    if anyExceeds.any():
+        k = int(np.argmax(anyExceeds))
+        firstFrame, duration = tailList[k], tailDuration[:, k]
+    else:
+        firstFrame, duration = np.nan, np.full(t.shape[1], np.nan)
+    return dict(percentChange=percentChange, tailDuration=tailDuration, exceeds=exceeds,
+                firstFrame=firstFrame, firstDuration=duration, refFrame=refFrame, tol=tol)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--in-dir', default=DEFAULT_PREPROCESSED_DIR)
+    parser.add_argument('--ref-frame', type=int, default=33,
+                        help='1-based start frame of the reference tail')
+    parser.add_argument('--tol', type=float, default=20, help='threshold in percent')
+    parser.add_argument('--out', default=None, help='also save the grid to this .mat file')
+    args = parser.parse_args(argv)
+
+    # Check the reference frame against the default grid before the fits
+    paths = list_studies(args.in_dir)
+    if not paths:
+        parser.error('no studies in ' + args.in_dir)
+    nFrames = read_preprocessed(paths[0])['t'].size
+    if not 1 <= args.ref_frame <= nFrames - 1:
+        parser.error('--ref-frame {} is not a tail start of the grid, which has frames 1 to '
+                     '{}'.format(args.ref_frame, nFrames - 1))
+
+    tic = time.time()
+    result = tail_sensitivity(args.in_dir, verbose=True)
+    summary = threshold_summary(result, args.ref_frame, args.tol)
+    print('Done in {:.1f} s'.format(time.time() - tic))
+    print('The percent change exceeds {:g}% when the tail duration is below '
+          '(in minutes):'.format(args.tol))
+    print(summary['firstDuration'])
+    if args.out:
+        savemat(args.out, dict(estKtRR=result['estKtRR'], estKepRRS=result['estKepRR'],
+                               tailList=result['tailList'], t=result['t'],
+                               studies=np.array(result['studies'], dtype=object),
+                               **{k: v for k, v in summary.items()}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Process pools that outlive the death of a worker.
+
+A worker killed by the system (e.g. out of memory) breaks a
+ProcessPoolExecutor: every task not finished yet then fails with
+BrokenProcessPool, and so does every later submit, so one bad study
+would fail a whole cohort. ``run_tasks`` instead reruns the lost tasks
+in a new pool. The tasks that had started when the pool broke are rerun
+first, one at a time in a pool of their own, which tells the task that
+killed its worker apart from those that only ran next to it; only that
+one is reported as failed. Each task is rerun at most once alone, so
+every break finishes at least one task and the run always ends.
+"""
+
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import Manager
+
+WORKER_DIED = 'worker process died\n'
+
+
+def _start(started, key, func, args):
+    # Runs in the worker: tell the parent which task it is on before running it
+    started.put(key)
+    return func(*args)
+
+
+def _run_pool(func, tasks, workers, started):
+    """Run tasks in one pool, yielding (key, result, error) as they finish.
+
+    Returns the tasks the pool lost when it broke, as (not started,
+    started) lists.
+    """
+    finished = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        try:
+            for key, args in tasks:
+                futures[pool.submit(_start, started, key, func, args)] = key
+        except BrokenProcessPool:
+            pass  # the tasks not submitted are lost with the others
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                continue
+            except Exception:
+                yield key, None, traceback.format_exc()
+            else:
+                yield key, result, None
+            finished.add(key)
+    startedKeys = set()
+    while not started.empty():
+        startedKeys.add(started.get())
+    lost = [task for task in tasks if task[0] not in finished]
+    return ([task for task in lost if task[0] not in startedKeys],
+            [task for task in lost if task[0] in startedKeys])
+
+
+def run_tasks(func, tasks, workers=None):
+    """Run func(*args) for every (key, args) of tasks over a process pool.
+
+    Yields (key, result, error) as tasks finish, in any order: error is
+    None, the traceback of an exception func raised, or WORKER_DIED for a
+    task whose worker process died even when it ran alone. Keys must be
+    unique and picklable. Raises BrokenProcessPool if a pool breaks before
+    any of its tasks started, e.g. when workers cannot be created.
+    """
+    todo = list(tasks)
+    with Manager() as manager:
+        started = manager.Queue()
+        while todo:
+            todo, suspects = yield from _run_pool(func, todo, workers, started)
+            if todo and not suspects:
+                raise BrokenProcessPool('the process pool broke before any task started')
+            for task in suspects:
+                lost, crashed = yield from _run_pool(func, [task], 1, started)
+                if lost or crashed:
+                    yield task[0], None, WORKER_DIED
@@ -0,0 +1,220 @@
+"""Compact on-disk format for masked voxel data.
+
+c01 saves Ct for the tumour voxels together with full-volume masks, and
+every consumer scatters results back into dense sX x sY x sZ arrays. A
+voxel store instead keeps, in a ``<study>.vox`` directory:
+
+* ``index.npy`` - flat column-major (MATLAB) indices of the masked voxels,
+  sorted, so the voxels of each slice form one contiguous run;
+* ``sliceStart.npy`` - where each slice's run starts (sZ + 1 offsets);
+* ``Ct.npy`` - the time series, one contiguous row per voxel [nVox x T];
+* ``vars.npz`` - the small variables (Cp, Crr, t, scalars, other masks as
+  index arrays) and ``meta.json`` with the volume shape.
+
+The ``.npy`` files are memory-mapped, so opening a store reads nothing but
+the index, and size and load time follow the number of masked voxels
+rather than the field of view.
+
+Usage (from the repository root)::
+
+    python -m rriftpy.voxelstore RRIFT/data/TCGA-GBM-Results/c01_preprocessed out_dir
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+
+FORMAT_VERSION = 1
+EXTENSION = '.vox'
+COPY_CHUNK_SIZE = 10000  # voxels written at a time
+
+
+def mask_index(mask):
+    """Sorted flat column-major indices of a boolean volume."""
+    mask = np.asarray(mask, dtype=bool)
+    dtype = np.int32 if mask.size <= np.iinfo(np.int32).max else np.int64
+    return np.flatnonzero(mask.ravel(order='F')).astype(dtype)
+
+
+def slice_starts(index, shape):
+    """Offsets into ``index`` where each slice of a volume of ``shape`` starts."""
+    sliceSize = int(np.prod(shape[:2]))
+    nSlices = int(np.prod(shape[2:]))
+    return np.searchsorted(index, np.arange(nSlices + 1) * sliceSize)
+
+
+def save_store(path, Ct, maskCt, variables=None, masks=None, dtype=None):
+    """Write a voxel store.
+
+    Ct is [T x nVox] with voxels in the column-major order of maskCt, as in
+    the c01 files, or the on-disk Ct of a ``-v7.3`` file that
+    patients.read_preprocessed returns, which is copied a block of voxels
+    at a time; it is stored as ``dtype`` (default: unchanged).
+    ``variables`` are saved as they are and ``masks`` (other boolean volumes
+    of the same shape) as index arrays.
+    """
+    maskCt = np.asarray(maskCt, dtype=bool)
+    index = mask_index(maskCt)
+    if Ct.shape[1] != index.size:
+        raise ValueError('Ct has {} voxels but maskCt {}'.format(Ct.shape[1], index.size))
+    small = dict(variables or {})
+    for name, mask in (masks or {}).items():
+        if np.shape(mask) != maskCt.shape:
+            raise ValueError('{} does not have the shape of maskCt'.format(name))
+        small['index_' + name] = mask_index(mask)
+
+    # Build next to the target, then move it into place
+    tmp = path + '.tmp'
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'index.npy'), index)
+    np.save(os.path.join(tmp, 'sliceStart.npy'), slice_starts(index, maskCt.shape))
+    _save_Ct(os.path.join(tmp, 'Ct.npy'), Ct, dtype)
+    np.savez(os.path.join(tmp, 'vars.npz'), **small)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as fid:
+        json.dump(dict(version=FORMAT_VERSION, shape=list(maskCt.shape),
+                       masks=sorted(masks or {})), fid)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+
+
+def _save_Ct(path, Ct, dtype):
+    # Ct [T x nVox] as [nVox x T], without holding more than a block in memory
+    nFrames, nVox = Ct.shape
+    out = np.lib.format.open_memmap(path, mode='w+', shape=(nVox, nFrames),
+                                    dtype=dtype or Ct.dtype)
+    for start in range(0, nVox, COPY_CHUNK_SIZE):
+        stop = min(start + COPY_CHUNK_SIZE, nVox)
+        if hasattr(Ct, 'columns'):
+            out[start:stop] = Ct.columns(start, stop).T
+        else:
+            out[start:stop] = np.asarray(Ct[:, start:stop]).T
+    out.flush()
+    del out
+
+
+class VoxelStore(object):
+    """Read access to a voxel store written by save_store.
+
+    ``Ct`` is a [T x nVox] view of the memory-mapped file (the layout of
+    the c01 files, without copying), and ``densify`` scatters per-voxel
+    values into the requested slices only.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as fid:
+            meta = json.load(fid)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError('unsupported voxel store version {}'.format(meta['version']))
+        self.shape = tuple(meta['shape'])
+        self.maskNames = meta['masks']
+        mode = 'r' if mmap else None
+        self.index = np.load(os.path.join(path, 'index.npy'), mmap_mode=mode)
+        self.sliceStart = np.load(os.path.join(path, 'sliceStart.npy'))
+        self._Ct = np.load(os.path.join(path, 'Ct.npy'), mmap_mode=mode)
+        self._vars = None
+
+    @property
+    def nVox(self):
+        return self.index.size
+
+    @property
+    def Ct(self):
+        """Time series [T x nVox], voxels in column-major order."""
+        return self._Ct.T
+
+    @property
+    def variables(self):
+        """The small variables saved with the store."""
+        if self._vars is None:
+            with np.load(os.path.join(self.path, 'vars.npz')) as f:
+                self._vars = {name: f[name] for name in f.files}
+        return self._vars
+
+    def slice_voxels(self, z):
+        """Range of voxels (columns of Ct) that lie in slice ``z`` (0-based)."""
+        return slice(int(self.sliceStart[z]), int(self.sliceStart[z + 1]))
+
+    def slice_Ct(self, z):
+        """Time series [T x nVoxInSlice] of one slice, without copying."""
+        return self._Ct[self.slice_voxels(z)].T
+
+    def densify(self, values, slices=None, fill=0):
+        """Scatter per-voxel values into dense [sX x sY x len(slices) (x K)] slices.
+
+        values is [nVox] or [nVox x K] in store order; slices defaults to
+        the whole volume. This is ``map(maskCt) = values`` restricted to the
+        requested slices.
+        """
+        values = np.asarray(values)
+        sX, sY = self.shape[:2]
+        slices = range(int(np.prod(self.shape[2:]))) if slices is None else list(slices)
+        out = np.full((sX * sY, len(slices)) + values.shape[1:], fill,
+                      dtype=np.result_type(values, type(fill)))
+        for k, z in enumerate(slices):
+            voxels = self.slice_voxels(z)
+            out[self.index[voxels] - z * sX * sY, k] = values[voxels]
+        return out.reshape((sX, sY, len(slices)) + values.shape[1:], order='F')
+
+    def mask(self, name='maskCt', slices=None):
+        """A saved mask as a dense boolean volume (or just some slices of it)."""
+        if name == 'maskCt':
+            return self.densify(np.ones(self.nVox, dtype=bool), slices, fill=False)
+        index = self.variables['index_' + name]
+        mask = np.zeros(int(np.prod(self.shape)), dtype=bool)
+        mask[index] = True
+        mask = mask.reshape(self.shape, order='F')
+        return mask if slices is None else mask[:, :, list(slices)]
+
+
+def is_store(path):
+    """Whether ``path`` is a voxel store directory."""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.json'))
+
+
+def convert_preprocessed(inFile, outPath, dtype=None):
+    """Convert one c01_preprocessed ``.mat`` file into a voxel store.
+
+    The file is read with patients.read_preprocessed, so ``-v7.3`` files
+    work too (with h5py) and their Ct is never loaded whole. Cp and Crr are
+    stored as in the file, negative values included, and set to zero when
+    the store is read, like Ct.
+    """
+    # patients imports this module
+    from .patients import read_preprocessed
+    f = read_preprocessed(inFile, clip=False)
+    masks = {name: f.pop(name) for name in ('maskCp', 'maskCrr') if name in f}
+    maskCt = f.pop('maskCt')
+    Ct = f.pop('Ct')
+    variables = {name: np.squeeze(x) for name, x in f.items()}
+    save_store(outPath, Ct, maskCt, variables, masks, dtype)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('in_dir', help='directory of c01_preprocessed .mat files')
+    parser.add_argument('out_dir')
+    parser.add_argument('--single', action='store_true',
+                        help='store Ct in single precision (half the size)')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    for inFile in sorted(glob.glob(os.path.join(args.in_dir, '*.mat'))):
+        name = os.path.splitext(os.path.basename(inFile))[0]
+        outPath = os.path.join(args.out_dir, name + EXTENSION)
+        convert_preprocessed(inFile, outPath, np.float32 if args.single else None)
+        print('{}: {:.1f} MB -> {:.1f} MB'.format(
+            name, os.path.getsize(inFile) / 1e6,
+            sum(os.path.getsize(os.path.join(outPath, n)) for n in os.listdir(outPath)) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import savemat
+
+from rriftpy.models import georgiou_aif, tofts_kety
+from rriftpy.postprocess import run_pipeline
+
+SHAPE = (8, 6, 3)
+STUDIES = ('TCGA-00-0001-1', 'TCGA-00-0002-1')
+
+
+def synthetic_study(seed, shape=SHAPE, nFrames=70, tRes=5.4):
+    """Variables of a small c01_preprocessed file.
+
+    The tumour is a block of voxels with random ETM parameters, plus a few
+    voxels that do not enhance (which load_preprocessed drops).
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(nFrames) * tRes / 60
+    Cp = georgiou_aif(t, t[5])[0]
+    Crr = tofts_kety(Cp, [0.07, 0.5], t)
+    maskCt = np.zeros(shape, dtype=bool)
+    maskCt[2:6, 1:5, :2] = True
+    nVox = int(maskCt.sum())
+    params = [rng.uniform(0.05, 0.2, nVox), rng.uniform(0.2, 0.8, nVox),
+              rng.uniform(0.01, 0.05, nVox)]
+    Ct = tofts_kety(Cp, params, t) + 0.005 * rng.randn(nFrames, nVox)
+    Ct[:, :3] = 0  # not enhancing
+    maskCp = np.zeros(shape, dtype=bool)
+    maskCp[0, 0, 0] = True
+    maskCrr = np.zeros(shape, dtype=bool)
+    maskCrr[7, 5, 2] = True
+    return dict(Ct=Ct, Cp=Cp[:, None], Crr=Crr[:, None], t=t[:, None], maskCt=maskCt,
+                maskCp=maskCp, maskCrr=maskCrr, sigmaCt=0.005, snr=20.0, cnr=10.0)
+
+
+@pytest.fixture
+def c01_dir(tmp_path):
+    """Directory of two synthetic c01_preprocessed studies."""
+    path = tmp_path / 'c01_preprocessed'
+    path.mkdir()
+    for k, study in enumerate(STUDIES):
+        savemat(os.path.join(str(path), study + '.mat'), synthetic_study(k))
+    return str(path)
+
+
+@pytest.fixture
+def c02_dir(c01_dir, tmp_path):
+    """c02_postprocessed of the studies of c01_dir."""
+    path = str(tmp_path / 'c02_postprocessed')
+    run_pipeline(c01_dir, path, workers=1, verbose=False)
+    return path
@@ -0,0 +1,45 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from rriftpy.agreement import LIMITS, annotation, cohort_agreement, tumour_values
+from rriftpy.stats import ccc, pair_sums
+
+
+def test_ccc_matches_hand_computed_values():
+    # means 2.5 and 3.5, variances 1.25 (normalised by n), covariance 1
+    x = [1, 2, 3, 4, np.nan, 5]
+    y = [2, 3, 5, 4, 1, np.inf]
+    cccoeff, pearson, n = ccc(x, y)
+    assert n == 4
+    assert cccoeff == pytest.approx(2 / 3.5)
+    assert pearson == pytest.approx(0.8)
+    # Sums of groups add up to the sums of the pooled pairs
+    np.testing.assert_allclose(pair_sums(x[:2], y[:2]) + pair_sums(x[2:], y[2:]),
+                               pair_sums(x, y))
+
+
+def test_tumour_values_leave_out_values_above_the_limits(c02_dir):
+    x, y = tumour_values(sorted(glob.glob(os.path.join(c02_dir, '*.mat')))[0])
+    assert x.shape[0] == 3 and y.shape[:2] == (3, 3) and y.shape[2] == x.shape[1]
+    for k, limit in enumerate(LIMITS):
+        assert not np.any(x[k] > limit) and not np.any(y[k] > limit)
+        assert not np.any(x[k] < 0)
+
+
+def test_pooled_coefficients_and_workers(c02_dir):
+    serial = cohort_agreement(c02_dir, nBoot=30, workers=1, blockSize=7, verbose=False)
+    assert serial['studies'][-1] == 'All'
+    values = [tumour_values(path) for path in sorted(glob.glob(os.path.join(c02_dir, '*.mat')))]
+    x = np.concatenate([v[0] for v in values], axis=-1)
+    y = np.concatenate([v[1] for v in values], axis=-1)
+    pooled = ccc(x[:, None], y)
+    np.testing.assert_allclose(serial['ccc'][-1], pooled[0])
+    np.testing.assert_array_equal(serial['n'][-1], serial['n'][:-1].sum(axis=0))
+    assert serial['cccCI'].shape == (3, 3, 3, 2)
+    parallel = cohort_agreement(c02_dir, nBoot=30, workers=2, blockSize=7, verbose=False)
+    for name in ('ccc', 'cccCI', 'pearsonCI'):
+        np.testing.assert_array_equal(serial[name], parallel[name])
+    assert annotation(serial, 'RRIFT').startswith('CCC: {:.3f} ['.format(serial['ccc'][-1, 0, 2]))
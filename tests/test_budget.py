@@ -0,0 +1,92 @@
+import json
+
+import numpy as np
+import pytest
+
+from rriftpy.budget import main, option_size, page_report, parse_size, size_limit
+from rriftpy.figures import write_html, write_views_html
+
+TRACE = dict(type='scatter', name='big', x=list(range(1000)), y=[0] * 1000,
+             error_y=dict(array=[1] * 10))
+LAYOUT = dict(title={'text': 'a figure'})
+
+
+def test_parse_size_and_limits():
+    assert parse_size('500k') == 500000
+    assert parse_size('5M') == 5000000
+    assert parse_size('1.5 MB') == 1500000
+    assert parse_size('1200') == 1200
+    with pytest.raises(ValueError):
+        parse_size('5 parsecs')
+    patterns = [('fig5-*.html', 8), ('fig5-voxels-*.html', 9)]
+    assert size_limit('figures/fig5-voxels-1.html', 5, patterns) == 9
+    assert size_limit('figures/fig5-1.html', 5, patterns) == 8
+    assert size_limit('figures/fig2.html', 5, patterns) == 5
+
+
+def test_plotly_offline_page(tmp_path):
+    # The layout of the pages plotly.offline.plot writes for the notebook
+    path = tmp_path / 'page.html'
+    path.write_text('<html><script type="text/javascript">var plotlyLib = 1;</script>'
+                    '<script src="https://cdn.plot.ly/plotly.js"></script>'
+                    '<script>Plotly.newPlot("id", [{}, {}], {}, {{}})</script></html>'.format(
+                        json.dumps(TRACE), json.dumps(dict(TRACE, name='small', x=[1], y=[2])),
+                        json.dumps(LAYOUT)))
+    report = page_report(str(path))
+    assert report['external'] == ['https://cdn.plot.ly/plotly.js']
+    assert report['sizes']['library'] == len('var plotlyLib = 1;')
+    assert report['sizes']['layout'] == len(json.dumps(LAYOUT))
+    assert [t['name'] for t in report['traces']] == ['big', 'small']
+    big = report['traces'][0]
+    assert big['size'] == len(json.dumps(TRACE))
+    assert big['arrays'][0][0] == 'x' and big['arrays'][-1][0] == 'error_y.array'
+    assert sum(report['sizes'].values()) == report['total']
+
+
+def test_pages_of_rriftpy_figures(tmp_path):
+    fig = dict(data=[dict(TRACE, x=np.arange(1000))], layout=LAYOUT,
+               payload=dict(traces=[0], keys=['y'], options=[None, [{'y': [[1] * 500]}, {}]]))
+    write_html(fig, str(tmp_path / 'swap.html'), include_plotlyjs=False)
+    report = page_report(str(tmp_path / 'swap.html'))
+    assert len(report['traces']) == 1 and report['sizes']['payload'] > 1000
+    assert report['options'][0] < report['options'][1]
+
+    views = [('a', 'A', dict(data=[dict(TRACE, x=np.arange(1000.0))], layout=LAYOUT)),
+             ('b', 'B', dict(data=[dict(TRACE, x=np.arange(1000.0))], layout=LAYOUT))]
+    write_views_html(views, str(tmp_path / 'views.html'), include_plotlyjs=False)
+    report = page_report(str(tmp_path / 'views.html'))
+    assert [t['view'] for t in report['traces']] == ['a', 'b']
+    # The shared x array is counted once in the page, and in each trace
+    assert report['sizes']['store'] < 2 * report['traces'][0]['size']
+    assert ('x (shared)', report['traces'][0]['arrays'][0][1]) in report['traces'][0]['arrays']
+
+
+def test_exit_status_follows_the_limits(tmp_path, capsys):
+    fig = dict(data=[TRACE], layout=LAYOUT)
+    write_html(fig, str(tmp_path / 'fig5-voxels-1.html'), include_plotlyjs=False)
+    write_html(dict(data=[], layout=LAYOUT), str(tmp_path / 'fig2.html'), include_plotlyjs=False)
+    assert main([str(tmp_path), '--max-size', '5M']) == 0
+    assert main([str(tmp_path), '--max-size', '3k']) == 1
+    assert main([str(tmp_path), '--max-size', '3k', '--max-size-for', 'fig5-*.html=1M']) == 0
+    main([str(tmp_path), '--max-trace', '1k'])
+    assert "! trace 0 (scatter 'big')" in capsys.readouterr().out
+
+
+def test_swap_options_of_views_are_measured_and_flagged(tmp_path, capsys):
+    big = np.arange(2000.0)
+    payload = dict(traces=[0], keys=['y'], options=[None, [{'y': [big]}], [{'y': [[1, 2]]}]])
+    views = [('a', 'A', dict(data=[dict(TRACE, x=big)], layout=LAYOUT)),
+             ('b', 'B', dict(data=[dict(TRACE)], layout=LAYOUT, payload=payload))]
+    path = str(tmp_path / 'views.html')
+    write_views_html(views, path, include_plotlyjs=False)
+    report = page_report(path)
+    assert report['options'] == [] and list(report['viewOptions']) == ['b']
+    options = report['viewOptions']['b']
+    # The big array is in the shared store, and counted in the option that draws it
+    assert options[1] > len(json.dumps(big.tolist(), separators=(',', ':')))
+    assert options[0] < options[2] < 100
+    assert option_size({'y': [{'@ref': '0'}]}, {'0': 5000}) == len('{"y":[]}') + 5000
+
+    main([path, '--max-trace', '5k'])
+    out = capsys.readouterr().out
+    assert '! swap option 1 in view b' in out and 'swap option 2' not in out
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from rriftpy import cache as cachemodule
+from rriftpy.cache import SimulationCache
+
+SPECS = [(0.07, 0.5, 0.02, 15), (0.07, 0.5, 0.04, 15)]
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    # Record the specs every simulation call is asked for
+    calls = []
+    for name in ('compute_cells', 'compute_cells_adaptive'):
+        def spy(specs, *args, original=getattr(cachemodule, name), **kwargs):
+            calls.append(list(specs))
+            return original(specs, *args, **kwargs)
+        monkeypatch.setattr(cachemodule, name, spy)
+    return calls
+
+
+def make_cache(root, **kwargs):
+    return SimulationCache(str(root), simMapPath=None, workers=1, verbose=False, **kwargs)
+
+
+def test_only_missing_cells_are_simulated(tmp_path, calls):
+    cache = make_cache(tmp_path)
+    first = cache.cells(SPECS[:1], 3)
+    assert calls == [SPECS[:1]]
+    both = cache.cells(SPECS, 3)
+    assert calls == [SPECS[:1], SPECS[1:]]
+    again = make_cache(tmp_path).cells(SPECS, 3)
+    assert len(calls) == 2
+    for key in first[0]:
+        np.testing.assert_array_equal(first[0][key], both[0][key])
+        np.testing.assert_array_equal(both[1][key], again[1][key])
+
+
+def test_key_follows_the_stream_quantisation(tmp_path):
+    cache = make_cache(tmp_path)
+    key = cache.cell_key(SPECS[0], 3)
+    assert cache.cell_key((0.07 + 1e-7, 0.5, 0.02, 15), 3) == key
+    assert cache.cell_key((0.07 + 1e-5, 0.5, 0.02, 15), 3) != key
+    assert cache.cell_key(SPECS[0], 4) != key
+    assert cache.cell_key(SPECS[0], 3, tol=1.0) != key
+    assert cache.cell_key(SPECS[0], 3, tol=1.0) != cache.cell_key(SPECS[0], 3, tol=2.0)
+
+
+def test_key_changes_with_the_code(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path)
+    key = cache.cell_key(SPECS[0], 3)
+    monkeypatch.setattr(cachemodule, 'code_digest', lambda: 'changed')
+    assert cache.cell_key(SPECS[0], 3) != key
+
+
+def test_adaptive_cells_are_cached(tmp_path, calls):
+    cache = make_cache(tmp_path, blockSize=2, minRep=2)
+    cells = cache.cells(SPECS, 4, tol=1e6)
+    assert [int(c['nRep']) for c in cells] == [2, 2]
+    cache.cells(SPECS, 4, tol=1e6)
+    assert calls == [SPECS]
+    # A fixed run of the same cells is a different entry
+    fixed = cache.cells(SPECS, 4)
+    assert len(calls) == 2
+    np.testing.assert_array_equal(fixed[0]['estKtRR'][:2], cells[0]['estKtRR'])
@@ -0,0 +1,157 @@
+import gzip
+import http.client
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from rriftpy.dataserver import DataServer, accepted_encodings, byte_range
+from rriftpy.inspector import build_index, find_voxel, voxel_curves
+from rriftpy.mapstore import MapFile, convert_postprocessed
+from rriftpy.pyramid import block_mean
+from rriftpy.voxelstore import EXTENSION, VoxelStore
+
+from conftest import STUDIES
+
+STUDY = STUDIES[0]
+
+
+@pytest.fixture
+def server(c01_dir, c02_dir, tmp_path):
+    mapsDir = tmp_path / 'maps'
+    mapsDir.mkdir()
+    for study in STUDIES:
+        convert_postprocessed(os.path.join(c02_dir, study + '.mat'),
+                              str(mapsDir / (study + '.maps')))
+    (mapsDir / 'TCGA-00-0009-1.maps').write_bytes(b'not a maps file')
+    voxDir = tmp_path / 'vox'
+    voxDir.mkdir()
+    build_index(os.path.join(c01_dir, STUDY + '.mat'), os.path.join(c02_dir, STUDY + '.mat'),
+                str(voxDir / (STUDY + EXTENSION)))
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / 'page.html').write_text('<html>' + 'x' * 1000 + '</html>')
+    (root / 'page.html.gz').write_bytes(gzip.compress((root / 'page.html').read_bytes()))
+    (tmp_path / 'secret.txt').write_text('secret')
+    server = DataServer(('127.0.0.1', 0), str(root), str(mapsDir), str(voxDir), tileSize=4)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def get(server, path, method='GET', **headers):
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.request(method, path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response, body
+
+
+def test_range_and_encoding_headers():
+    assert byte_range(None, 10) is None
+    assert byte_range('bytes=2-4', 10) == (2, 5)
+    assert byte_range('bytes=-3', 10) == (7, 10)
+    assert byte_range('bytes=5-', 10) == (5, 10)
+    assert byte_range('bytes=0-1,4-5', 10) is None
+    with pytest.raises(ValueError):
+        byte_range('bytes=10-', 10)
+    assert accepted_encodings('gzip, br;q=0, deflate;q=0.5') == {'gzip', 'deflate'}
+
+
+def test_map_slices_and_revalidation(server):
+    response, body = get(server, '/maps/{}/mapKt/0.json'.format(STUDY))
+    assert response.status == 200
+    assert response.getheader('Access-Control-Allow-Origin') == '*'
+    f = MapFile(os.path.join(server.mapsDir, STUDY + '.maps'))
+    expected = f.read_slice('mapKt', 0)
+    np.testing.assert_allclose(np.array(json.loads(body.decode()), dtype=float), expected,
+                               rtol=1e-4, atol=1e-5)
+    response, raw = get(server, '/maps/{}/mapKt/0.bin'.format(STUDY))
+    np.testing.assert_array_equal(np.frombuffer(raw, '<f8').reshape(expected.shape), expected)
+
+    etag = response.getheader('ETag')
+    response, body = get(server, '/maps/{}/mapKt/0.bin'.format(STUDY), **{'If-None-Match': etag})
+    assert response.status == 304 and body == b''
+    lastModified = response.getheader('Last-Modified')
+    response, _ = get(server, '/maps/{}/mapKt/0.bin'.format(STUDY),
+                      **{'If-Modified-Since': lastModified})
+    assert response.status == 304
+
+    response, body = get(server, '/maps/{}/mapKt/0.bin'.format(STUDY), Range='bytes=8-15')
+    assert response.status == 206 and body == raw[8:16]
+    assert response.getheader('Content-Range') == 'bytes 8-15/{}'.format(len(raw))
+    response, _ = get(server, '/maps/{}/mapKt/0.bin'.format(STUDY),
+                      Range='bytes={}-'.format(len(raw)))
+    assert response.status == 416
+    assert response.getheader('Content-Range') == 'bytes */{}'.format(len(raw))
+    assert response.getheader('Access-Control-Allow-Origin') == '*'
+    assert response.getheader('ETag') == etag
+
+
+def test_tiles_only_of_the_pyramid_factors(server):
+    response, body = get(server, '/tiles/{}/mapKt/0/2/0_0.json'.format(STUDY))
+    assert response.status == 200
+    f = MapFile(os.path.join(server.mapsDir, STUDY + '.maps'))
+    level = block_mean(f.read_slice('mapKt', 0), 2, f.read_slice('maskCt', 0))
+    tile = np.array(json.loads(body.decode()), dtype=float)
+    np.testing.assert_allclose(tile, level[:4, :4], rtol=1e-4, atol=1e-5)
+    for factor in ('3', '16', '1000000'):
+        response, body = get(server, '/tiles/{}/mapKt/0/{}/0_0.json'.format(STUDY, factor))
+        assert response.status == 404
+        assert 'error' in json.loads(body.decode())
+    response, _ = get(server, '/tiles/{}/mapKt/0/2/9_9.json'.format(STUDY))
+    assert response.status == 404
+
+
+def test_curves_of_a_voxel(server):
+    response, body = get(server, '/curves/{}/1/4/3.json'.format(STUDY))
+    assert response.status == 200
+    out = json.loads(body.decode())
+    store = VoxelStore(os.path.join(server.voxDir, STUDY + EXTENSION))
+    expected = voxel_curves(store, find_voxel(store, 1, 4, 3))
+    assert sorted(out) == sorted(expected)
+    for name in ('t', 'Ct', 'Cp', 'etm', 'rrift'):
+        np.testing.assert_allclose(out[name], expected[name], rtol=1e-4, atol=1e-5)
+    assert sorted(out['params']) == sorted(expected['params'])
+    response, _ = get(server, '/curves/{}/1/4/3.json'.format(STUDIES[1]))
+    assert response.status == 404
+
+
+def test_studies_summary_and_errors(server):
+    response, body = get(server, '/summary/' + STUDY)
+    summary = json.loads(body.decode())
+    assert summary['voxels'] > 0 and set(summary['quartiles']) >= {'mapKt', 'mapKtR'}
+    for path in ('/summary/TCGA-99-9999-1', '/maps/{}/mapXY/0.json'.format(STUDY),
+                 '/maps/{}/mapKt/99.json'.format(STUDY), '/curves/{}/0/0/0.json'.format(STUDY),
+                 '/../secret.txt', '/%2e%2e/secret.txt'):
+        response, body = get(server, path)
+        assert response.status == 404, path
+        assert 'error' in json.loads(body.decode())
+    # A broken store is a server error, answered in JSON like the others
+    response, body = get(server, '/summary/TCGA-00-0009-1')
+    assert response.status == 500
+    assert json.loads(body.decode()) == {'error': 'server error: /summary/TCGA-00-0009-1'}
+    # ... but does not hide the other studies
+    response, body = get(server, '/studies')
+    assert response.status == 200
+    studies = json.loads(body.decode())
+    assert sorted(studies) == sorted(STUDIES + ('TCGA-00-0009-1',))
+    assert studies['TCGA-00-0009-1'] == {'error': 'cannot read TCGA-00-0009-1.maps'}
+    assert 'mapKt' in studies[STUDY]['maps']
+
+
+def test_static_files_and_precompressed_variants(server):
+    response, body = get(server, '/page.html')
+    assert response.status == 200 and response.getheader('Content-Type') == 'text/html'
+    assert response.getheader('Cache-Control') == 'no-cache'
+    response, zipped = get(server, '/page.html', **{'Accept-Encoding': 'gzip'})
+    assert response.getheader('Content-Encoding') == 'gzip'
+    assert gzip.decompress(zipped) == body
+    response, head = get(server, '/page.html', method='HEAD')
+    assert head == b'' and int(response.getheader('Content-Length')) == len(body)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from rriftpy.agreement import METHODS
+from rriftpy.density import cohort_density, histogram2, log_density
+
+
+def test_histogram2_edge_bins():
+    x = np.array([0, 0.5, 1, 1.0001, -0.1, np.nan, 0.25])
+    y = np.array([0, 0, 1, 0, 0, 0, np.nan])
+    counts = histogram2(x, y, 2, ((0, 1), (0, 1)))
+    # Bins are closed on the left; the last one also holds the upper edge
+    np.testing.assert_array_equal(counts, [[1, 0], [1, 1]])
+
+
+@pytest.mark.parametrize('hi, bins', [(0.2, 100), (0.5, 100), (0.05, 100), (0.15, 150)])
+def test_histogram2_puts_every_edge_in_the_bin_it_opens(hi, bins):
+    edges = np.linspace(0, hi, bins + 1)
+    counts = histogram2(edges, np.zeros(edges.size), bins, ((0, hi), (0, hi)))
+    np.testing.assert_array_equal(counts[:, 0], [1] * (bins - 1) + [2])
+
+
+def test_histogram2_keeps_leading_axes():
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(0, 1, (3, 50)), rng.uniform(0, 1, (3, 50))
+    counts = histogram2(x, y, 4)
+    assert counts.shape == (3, 4, 4)
+    for k in range(3):
+        np.testing.assert_array_equal(counts[k], histogram2(x[k], y[k], 4))
+        expected = np.histogram2d(x[k], y[k], 4, ((0, 1), (0, 1)))[0]
+        np.testing.assert_array_equal(counts[k], expected)
+
+
+def test_log_density_transposes_and_smooths():
+    counts = np.zeros((5, 5))
+    counts[1, 3] = 9
+    image = log_density(counts, sigma=0)
+    assert image[3, 1] == 1 and image.sum() == 1
+    smoothed = log_density(counts)
+    assert smoothed[3, 1] < 1 and smoothed[2, 1] > 0 and smoothed[0, 4] == 0
+
+
+def test_cohort_density_is_cached_and_read_only(c02_dir):
+    images, edges = cohort_density(c02_dir, 'Kt', bins=20)
+    assert images.shape == (len(METHODS), 20, 20)
+    np.testing.assert_allclose(edges, np.linspace(0, 0.2, 21))
+    assert cohort_density(c02_dir, 'Kt', bins=20)[0] is images
+    assert not images.flags.writeable
+    assert cohort_density(c02_dir, 'Kt', bins=10)[0].shape == (len(METHODS), 10, 10)
+    with pytest.raises(ValueError):
+        cohort_density(c02_dir, studies=['TCGA-99-9999-1'])
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from rriftpy.dicom import acquisition_times, decode_series, sort_series
+
+
+def headers(instances, **fields):
+    out = []
+    for k, n in enumerate(instances):
+        h = dict(SeriesInstanceUID='1.2.3', InstanceNumber=n, Rows=4, Columns=3,
+                 TriggerTime=1000.0 * k, AcquisitionTime=None, FlipAngle=None,
+                 path='{}.dcm'.format(k))
+        h.update(fields)
+        out.append(h)
+    return out
+
+
+def test_sort_series_orders_by_instance_number():
+    series = sort_series(headers([3, 1, 2]))
+    assert [h['InstanceNumber'] for h in series] == [1, 2, 3]
+    assert [h['path'] for h in series] == ['1.dcm', '2.dcm', '0.dcm']
+
+
+@pytest.mark.parametrize('instances', [[1, 3], [1, 1, 2], [0, 1, 2]])
+def test_sort_series_rejects_gaps_and_duplicates(instances):
+    with pytest.raises(ValueError, match='InstanceNumber'):
+        sort_series(headers(instances))
+
+
+def test_sort_series_rejects_a_missing_instance_number():
+    with pytest.raises(ValueError, match='InstanceNumber missing in 1 of 3 files'):
+        sort_series(headers([1, None, 2]))
+
+
+def test_sort_series_rejects_mixed_series_and_sizes():
+    with pytest.raises(ValueError, match='different series'):
+        sort_series(headers([1]) + headers([2], SeriesInstanceUID='4.5.6'))
+    with pytest.raises(ValueError, match='image sizes'):
+        sort_series(headers([1]) + headers([2], Rows=8))
+    with pytest.raises(ValueError):
+        sort_series([])
+
+
+def test_acquisition_times_fall_back_to_acquisition_time():
+    np.testing.assert_array_equal(acquisition_times(headers([1, 2])), [0, 1000])
+    series = headers([1, 2], TriggerTime=None, AcquisitionTime='120000.5')
+    np.testing.assert_array_equal(acquisition_times(series), [120000.5, 120000.5])
+
+
+def test_decode_series_uses_the_matlab_layout(tmp_path):
+    pydicom = pytest.importorskip('pydicom')
+    from pydicom.dataset import FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian
+    series = []
+    for k in range(6):
+        ds = pydicom.Dataset()
+        ds.file_meta = FileMetaDataset()
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds.Rows, ds.Columns = 4, 3
+        ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, 'MONOCHROME2'
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 0
+        ds.PixelData = np.full((4, 3), k, dtype=np.uint16).tobytes()
+        path = str(tmp_path / '{}.dcm'.format(k))
+        ds.save_as(path, enforce_file_format=True)
+        series.append(dict(Rows=4, Columns=3, path=path))
+    imgData = decode_series(series, (4, 3, 2, 3), workers=2)
+    # Frame k is slice k % sZ of time point k // sZ
+    np.testing.assert_array_equal(imgData[0, 0], [[0, 2, 4], [1, 3, 5]])
+    with pytest.raises(ValueError):
+        decode_series(series, (4, 3, 4, 2))
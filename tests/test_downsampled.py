@@ -0,0 +1,84 @@
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+from scipy.io import loadmat, savemat
+
+from rriftpy import downsampled
+from rriftpy.downsampled import fit_dfactor, run_downsampled
+from rriftpy.patients import load_preprocessed
+from rriftpy.rng import cell_generator
+from rriftpy.taskpool import WORKER_DIED
+
+from conftest import STUDIES, synthetic_study
+
+CRASHING_STUDY = 'TCGA-00-0003-1'
+task = downsampled._task
+
+
+def crashing_task(inFile, dFactor, *args):
+    # Like a worker killed for running out of memory, while others are busy
+    if CRASHING_STUDY in inFile and dFactor == 2:
+        time.sleep(0.1)
+        os._exit(1)
+    time.sleep(0.2)
+    return task(inFile, dFactor, *args)
+
+
+def study_fields(variables):
+    # The fields fit_dfactor uses, without the enhancement filter
+    return dict(Ct=variables['Ct'][:, 3:], Cp=variables['Cp'].ravel(),
+                Crr=variables['Crr'].ravel(), t=variables['t'].ravel())
+
+
+def test_fit_dfactor_layout(c01_dir):
+    f = load_preprocessed(os.path.join(c01_dir, STUDIES[0] + '.mat'))
+    result = fit_dfactor(f, 2, cell_generator(1, 0, 2))
+    nVox = f['Ct'].shape[1]
+    assert result['pkETM'].shape == (nVox, 3)
+    assert result['pkCE'].shape == (nVox, 5)
+    assert result['TRes'] == pytest.approx(10.8)
+    assert 0 < result['estKtRR'] < 1
+
+
+def test_fit_dfactor_needs_frames_after_the_tail_start():
+    f = study_fields(synthetic_study(0, nFrames=30))
+    with pytest.raises(ValueError, match='no frame after 3 min'):
+        fit_dfactor(f, 1, cell_generator(1, 0, 1))
+
+
+def test_short_study_fails_alone_and_workers_do_not_matter(c01_dir, tmp_path):
+    savemat(os.path.join(c01_dir, 'TCGA-00-0003-1.mat'), synthetic_study(2, nFrames=30))
+    serial = run_downsampled(c01_dir, str(tmp_path / 'serial'), (1, 2), workers=1,
+                             verbose=False)
+    assert [r['status'] for r in serial] == ['ok', 'ok', 'failed']
+    assert 'no frame after' in serial[2]['error']
+    run_downsampled(c01_dir, str(tmp_path / 'parallel'), (1, 2), workers=2, verbose=False)
+    assert sorted(os.listdir(str(tmp_path / 'parallel'))) == [s + '.mat' for s in STUDIES]
+    for study in STUDIES:
+        a = loadmat(str(tmp_path / 'serial' / (study + '.mat')))
+        b = loadmat(str(tmp_path / 'parallel' / (study + '.mat')))
+        assert a['pkCE'].shape == (29, 5, 2)
+        np.testing.assert_array_equal(a['dFactors'], [[1, 2]])
+        for name in ('pkETM', 'pkCE', 'estKtRRs', 'estKepRRs', 'maskCt', 'Cp', 't'):
+            np.testing.assert_array_equal(a[name], b[name], err_msg=name)
+        f = load_preprocessed(os.path.join(c01_dir, study + '.mat'))
+        np.testing.assert_array_equal(a['maskCt'], f['maskCt'])
+        np.testing.assert_array_equal(a['Crr'][:, 0], f['Crr'])
+
+
+def test_a_worker_crash_fails_only_its_study(c01_dir, tmp_path, monkeypatch):
+    names = ['TCGA-00-000{}-1'.format(k) for k in range(3, 6)]
+    for name in names:
+        shutil.copy(os.path.join(c01_dir, STUDIES[0] + '.mat'),
+                    os.path.join(c01_dir, name + '.mat'))
+    monkeypatch.setattr(downsampled, '_task', crashing_task)
+    outDir = str(tmp_path / 'c06')
+    reports = run_downsampled(c01_dir, outDir, (1, 2), workers=2, verbose=False)
+    assert [r['study'] for r in reports] == list(STUDIES) + names
+    failed = [r for r in reports if r['status'] != 'ok']
+    assert [r['study'] for r in failed] == [CRASHING_STUDY]
+    assert failed[0]['error'] == WORKER_DIED
+    assert sorted(os.listdir(outDir)) == sorted(s + '.mat' for s in STUDIES + tuple(names[1:]))
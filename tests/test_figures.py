@@ -0,0 +1,168 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import savemat
+
+from rriftpy import figures
+from rriftpy.agreement import METHODS
+from rriftpy.figures import (fig5_voxels, map_dropdown, patient_bbox, read_images, swap_payload,
+                             timed, union_bbox, visibility_masks, write_html)
+
+from conftest import STUDIES
+
+
+def image(shape, rows, cols):
+    x = np.zeros(shape)
+    x[rows, cols] = 1
+    return x
+
+
+def test_union_bbox_covers_all_images():
+    images = [image((10, 12), slice(2, 4), slice(5, 6)), image((10, 12), 7, 1),
+              np.zeros((10, 12))]
+    assert union_bbox(images) == (slice(2, 8), slice(1, 6))
+    assert union_bbox(images, pad=3) == (slice(0, 10), slice(0, 9))
+    assert union_bbox([np.zeros((4, 5))]) == (slice(0, 4), slice(0, 5))
+
+
+def test_read_images_takes_the_slice_and_zeroes_nan(tmp_path):
+    path = str(tmp_path / 'fig9patient1.mat')
+    volume = np.zeros((5, 6, 3))
+    volume[1, 2, 1] = np.nan
+    volume[3, 4, 1] = 0.5
+    savemat(path, dict(mapKtE1=volume, mapVeE1=np.ones((5, 6, 3)), myS=2))
+    images = read_images(path)
+    assert sorted(images) == ['mapKtE1', 'mapVeE1']
+    expected = np.zeros((5, 6))
+    expected[3, 4] = 0.5
+    np.testing.assert_array_equal(images['mapKtE1'], expected)
+    assert list(read_images(path, ['mapVeE1'])) == ['mapVeE1']
+
+
+def test_patient_bbox_is_cached_per_file_version(tmp_path, monkeypatch):
+    path = str(tmp_path / 'fig6pat3.mat')
+    savemat(path, dict(Ktrans_image_12=image((9, 9), 4, 4)))
+    calls, original = [], figures.read_images
+    monkeypatch.setattr(figures, 'read_images', lambda p: calls.append(p) or original(p))
+    figures._bboxes.clear()
+    assert patient_bbox(path) == (slice(3, 6), slice(3, 6))
+    assert patient_bbox(path) == (slice(3, 6), slice(3, 6))
+    assert len(calls) == 1
+    os.utime(path, (0, 0))
+    patient_bbox(path)
+    assert len(calls) == 2
+
+
+def test_patient_options_read_each_file_once(tmp_path, monkeypatch):
+    files = []
+    for patient in (3, 4):
+        path = str(tmp_path / 'fig6pat{}.mat'.format(patient))
+        savemat(path, dict(Ktrans_image_12=image((9, 9), 4, 4), Ve_image_12=image((9, 9), 6, 1)))
+        files.append((patient, path))
+    calls, original = [], figures.read_images
+    monkeypatch.setattr(figures, 'read_images', lambda *args: calls.append(args) or original(*args))
+    figures._bboxes.clear()
+    options = figures.patient_options(files, ['Ktrans_image_12'])
+    assert len(calls) == 2
+    # The box covers every map of the file, not only those of the panels
+    assert options[0][2] == (slice(3, 8), slice(0, 6))
+    assert len(options[0][1]) == 1 and options[0][1][0].shape == (9, 9)
+    assert figures.patient_options(files, ['Ve_image_12'])[1][2] == options[1][2]
+
+
+def test_fig5_voxels_has_a_trace_per_study_and_method(c02_dir):
+    fig = fig5_voxels(c02_dir, 'Kt')
+    assert len(fig['data']) == len(METHODS) * len(STUDIES)
+    assert [t['name'] for t in fig['data'][:len(STUDIES)]] == list(STUDIES)
+    assert all(t['type'] == 'scattergl' for t in fig['data'])
+    assert [t['visible'] for t in fig['data']] == \
+        fig['layout']['updatemenus'][0]['buttons'][0]['args'][0]['visible']
+    nPoints = sum(t['x'].size for t in fig['data'][:len(STUDIES)])
+    # Over maxPoints, a method's voxels are binned into one image
+    binned = fig5_voxels(c02_dir, 'Kt', maxPoints=nPoints - 1, bins=20)
+    assert [t['type'] for t in binned['data']] == ['heatmap'] * len(METHODS)
+    assert binned['data'][0]['z'].shape == (20, 20)
+    counts = 10 ** binned['data'][0]['z'] - 1
+    assert counts.sum() == pytest.approx(nPoints, rel=0.01)
+
+
+def dropdown_options():
+    first = [image((6, 8), 1, 2), image((6, 8), 3, 4)]
+    second = [image((6, 8), 5, 7), np.zeros((6, 8))]
+    return [('Patient 1', first, (slice(1, 4), slice(2, 5))), ('Patient 2', second, None)]
+
+
+def test_map_dropdown_layout():
+    timings = {}
+    fig = map_dropdown(dropdown_options(), ('ETM', 'RRIFT'), (0, 1), 'K', timings=timings)
+    assert sorted(timings) == ['layout', 'traces']
+    data = fig['data']
+    assert len(data) == 4
+    # Cropped images keep the pixel coordinates of the full ones
+    assert data[0]['z'].shape == (3, 3) and (data[0]['y0'], data[0]['x0']) == (1, 2)
+    assert data[2]['z'].shape == (6, 8) and (data[2]['y0'], data[2]['x0']) == (0, 0)
+    assert [t['xaxis'] for t in data] == ['x', 'x2', 'x', 'x2']
+    assert {t['coloraxis'] for t in data} == {'coloraxis'}
+    assert fig['layout']['coloraxis']['cmax'] == 1
+    buttons = fig['layout']['updatemenus'][0]['buttons']
+    assert [b['label'] for b in buttons] == ['Patient 1', 'Patient 2']
+    assert [b['args'][0]['visible'] for b in buttons] == visibility_masks(2, 2)
+    assert [t['visible'] for t in data] == visibility_masks(2, 2)[0]
+    with pytest.raises(ValueError):
+        map_dropdown(dropdown_options(), ('ETM',), (0, 1), 'K')
+
+
+def test_visibility_masks_and_timed():
+    assert visibility_masks(2, 3) == [[True] * 3 + [False] * 3, [False] * 3 + [True] * 3]
+    timings = {}
+    for _ in range(2):
+        with timed(timings, 'read'):
+            pass
+    assert list(timings) == ['read'] and timings['read'] >= 0
+    with timed(None, 'read'):
+        pass
+
+
+def test_swap_payload_leaves_out_the_first_option():
+    first, second = {'z': [1], 'error_y.array': [2]}, {'z': [3], 'error_y.array': [4]}
+    updates = [[first, {'title': 'a'}], [second, {'title': 'b'}]]
+    payload = swap_payload(updates, [0])
+    assert payload == dict(traces=[0], keys=['z', 'error_y.array'],
+                           options=[[None, {'title': 'a'}], [second, {'title': 'b'}]])
+    # The caller's updates are not modified
+    assert updates[0][0] is first
+
+
+def test_swap_dropdown_holds_one_trace_per_panel(tmp_path):
+    options = dropdown_options()
+    fig = map_dropdown(options, ('ETM', 'RRIFT'), (0, 1), 'K', swap=True)
+    assert len(fig['data']) == 2 and all(t['visible'] for t in fig['data'])
+    payload = fig['payload']
+    assert payload['traces'] == [0, 1] and payload['keys'] == ['z', 'y0', 'x0']
+    assert payload['options'][0][0] is None
+    np.testing.assert_array_equal(payload['options'][1][0]['z'][0], options[1][1][0])
+    buttons = fig['layout']['updatemenus'][0]['buttons']
+    assert {b['method'] for b in buttons} == {'skip'}
+
+    path = str(tmp_path / 'fig.html')
+    write_html(fig, path, include_plotlyjs=False)
+    with open(path) as fid:
+        html = fid.read()
+    assert 'var payload = {"traces":[0,1]' in html and 'swapOption' in html
+    assert '<script src=' not in html
+
+
+def test_fig9_inspect_maps_the_crop_back_to_the_study(c02_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(figures, 'FIG9_PATIENTS', (1, 2))
+    for patient in (1, 2):
+        savemat(figures.fig9_file(patient, str(tmp_path)), dict(mapKtE1=np.ones((4, 4)), myS=2))
+    inspect = figures.fig9_inspect('http://localhost:8000/', c02_dir, str(tmp_path))
+    assert inspect['url'] == 'http://localhost:8000'
+    assert [p['study'] for p in inspect['patients']] == list(STUDIES)
+    p = inspect['patients'][0]
+    assert p['z'] == 1 and list(p['rows']) == [2, 3, 4, 5] and list(p['cols']) == [1, 2, 3, 4]
+
+    savemat(figures.fig9_file(2, str(tmp_path)), dict(mapKtE1=np.ones((5, 4)), myS=2))
+    with pytest.raises(ValueError, match='patient 2'):
+        figures.fig9_inspect('http://localhost:8000', c02_dir, str(tmp_path))
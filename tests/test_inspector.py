@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import loadmat, savemat
+
+from rriftpy.inspector import PARAMS, build_index, find_voxel, voxel_curves
+from rriftpy.models import tofts_kety
+from rriftpy.patients import load_preprocessed
+from rriftpy.voxelstore import EXTENSION, VoxelStore, save_store
+
+from conftest import SHAPE, STUDIES
+
+STUDY = STUDIES[0]
+
+
+@pytest.fixture
+def store(c01_dir, c02_dir, tmp_path):
+    outPath = str(tmp_path / (STUDY + EXTENSION))
+    build_index(os.path.join(c01_dir, STUDY + '.mat'), os.path.join(c02_dir, STUDY + '.mat'),
+                outPath)
+    return VoxelStore(outPath)
+
+
+def test_find_voxel_follows_the_column_major_index(store):
+    # The first three voxels of the block do not enhance, so c02 dropped them
+    assert find_voxel(store, 0, 2, 1) is None
+    assert find_voxel(store, 0, 5, 1) == 0
+    assert find_voxel(store, 0, 2, 2) == 1
+    assert find_voxel(store, 1, 2, 1) == 13
+    for z, row, col in ((2, 3, 3), (0, 0, 0), (3, 3, 3), (0, SHAPE[0], 1), (-1, 3, 3)):
+        assert find_voxel(store, z, row, col) is None
+
+
+def test_voxel_curves_are_the_fits_of_c02(c01_dir, c02_dir, store):
+    f = load_preprocessed(os.path.join(c01_dir, STUDY + '.mat'))
+    g = loadmat(os.path.join(c02_dir, STUDY + '.mat'))
+    k = find_voxel(store, 1, 4, 3)
+    out = voxel_curves(store, k)
+    np.testing.assert_allclose(out['Ct'], np.maximum(f['Ct'][:, k], 0))
+    np.testing.assert_allclose(out['t'], np.ravel(f['t']))
+    assert sorted(out['params']) == sorted(PARAMS)
+    assert out['params']['mapKtR'] == g['mapKtR'][4, 3, 1]
+    Cp = np.maximum(np.ravel(f['Cp']), 0)
+    etm = tofts_kety(Cp, [g['mapKt'][4, 3, 1], g['mapKep'][4, 3, 1], g['mapVp'][4, 3, 1]],
+                     out['t'])
+    np.testing.assert_allclose(out['etm'], etm)
+    assert store.variables['estKtRR'] == float(np.squeeze(g['estKtRR']))
+
+
+def test_voxel_curves_of_a_store_without_parameters(tmp_path):
+    Ct = np.arange(12.0).reshape(3, 4) - 2
+    maskCt = np.zeros((2, 2, 1), dtype=bool)
+    maskCt.flat[:] = True
+    save_store(str(tmp_path / 'plain'), Ct, maskCt, dict(Cp=[1, -1, 2], Crr=[0, 1, 2],
+                                                        t=[0, 0.1, 0.2]))
+    out = voxel_curves(VoxelStore(str(tmp_path / 'plain')), 0)
+    assert sorted(out) == ['Cp', 'Crr', 'Ct', 't']
+    np.testing.assert_array_equal(out['Ct'], [0, 2, 6])
+    np.testing.assert_array_equal(out['Cp'], [1, 0, 2])
+
+
+def test_build_index_checks_the_tumour_voxels(c01_dir, c02_dir, tmp_path):
+    g = loadmat(os.path.join(c02_dir, STUDY + '.mat'))
+    g['maskCt'][2, 1, 0] = True
+    c02File = str(tmp_path / 'other.mat')
+    savemat(c02File, {k: v for k, v in g.items() if not k.startswith('__')})
+    with pytest.raises(ValueError):
+        build_index(os.path.join(c01_dir, STUDY + '.mat'), c02File, str(tmp_path / 'x'))
@@ -0,0 +1,70 @@
+import json
+
+import numpy as np
+import pytest
+from scipy.io import savemat
+
+from rriftpy.mapstore import MapFile, convert_postprocessed, write_maps
+from rriftpy.sparsemap import SparseMap
+
+from conftest import SHAPE
+
+
+def random_map(seed, fraction=0.3):
+    rng = np.random.RandomState(seed)
+    x = rng.uniform(0, 1, SHAPE)
+    x[rng.uniform(0, 1, SHAPE) > fraction] = 0
+    return x
+
+
+def test_maps_round_trip(tmp_path):
+    path = str(tmp_path / 'study.maps')
+    dense, sparse = random_map(0), random_map(1)
+    mask = dense > 0
+    write_maps(path, dict(mapKt=dense, mapVe=SparseMap.from_dense(sparse), maskCt=mask))
+    f = MapFile(path)
+    assert f.shape == SHAPE and f.names == ['mapKt', 'mapVe', 'maskCt']
+    np.testing.assert_array_equal(f.read('mapKt'), dense)
+    np.testing.assert_array_equal(f.read('mapVe'), sparse)
+    np.testing.assert_array_equal(f.read('maskCt'), mask)
+    assert f.read('maskCt').dtype == bool
+    np.testing.assert_array_equal(f.read_slice('mapKt', 1), dense[:, :, 1])
+    np.testing.assert_array_equal(f.read('mapKt', [2, 0]), dense[:, :, [2, 0]])
+
+
+def test_attrs_keep_real_parts_and_arrays(tmp_path):
+    path = str(tmp_path / 'study.maps')
+    attrs = dict(estKtRR=np.array([[0.07]]), estKepRR=np.float32(0.5), numVox=np.int64(32),
+                 estVeRR=np.array([[0.14 + 0.01j]]), ciKtRR=np.array([[0.06, 0.08]]))
+    write_maps(path, dict(mapKt=np.zeros(SHAPE)), attrs)
+    f = MapFile(path)
+    assert f.attrs['estKtRR'] == 0.07
+    assert f.attrs['estKepRR'] == pytest.approx(0.5)
+    assert f.attrs['numVox'] == 32
+    assert f.attrs['estVeRR'] == 0.14
+    np.testing.assert_array_equal(np.asarray(f.attrs['ciKtRR']), [[0.06, 0.08]])
+    json.dumps(f.attrs)
+
+
+def test_write_maps_rejects_mixed_shapes(tmp_path):
+    with pytest.raises(ValueError):
+        write_maps(str(tmp_path / 'x.maps'), dict(a=np.zeros(SHAPE), b=np.zeros((8, 6, 2))))
+    with pytest.raises(ValueError):
+        write_maps(str(tmp_path / 'x.maps'), dict(a=np.zeros((8, 6))))
+    bad = tmp_path / 'bad.maps'
+    bad.write_bytes(b'not a maps file')
+    with pytest.raises(ValueError):
+        MapFile(str(bad))
+
+
+def test_convert_postprocessed(tmp_path):
+    matFile = str(tmp_path / 'study.mat')
+    mapKt, maskCt = random_map(2), random_map(3) > 0
+    savemat(matFile, dict(mapKt=mapKt, mapVeR=random_map(4), maskCt=maskCt, estKtRR=0.07,
+                          estVeRR=0.14 + 0.01j, Rsq=np.ones((5, 3)), note='text'))
+    convert_postprocessed(matFile, str(tmp_path / 'study.maps'))
+    f = MapFile(str(tmp_path / 'study.maps'))
+    assert sorted(f.names) == ['mapKt', 'mapVeR', 'maskCt']
+    assert f.attrs == dict(estKtRR=0.07, estVeRR=0.14)
+    np.testing.assert_array_equal(f.read('mapKt'), mapKt)
+    np.testing.assert_array_equal(f.read('maskCt'), maskCt)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from rriftpy.models import errm, georgiou_aif, tofts_kety
+
+
+def matlab_errm_transform(pure):
+    # The doPure=false and doReal branches of ERRM.m, in complex arithmetic
+    p = pure.astype(complex)
+    A = p[:, 0] / p[:, 3]
+    B = p[:, 1] / p[:, 3]
+    kepRR = (A - np.sqrt(A ** 2 - 4 * B)) / 2
+    ktvp = A - p[:, 2] - kepRR
+    ktRel = p[:, 3] * ktvp
+    veRel = ktRel * kepRR / p[:, 2]
+    return np.real(np.column_stack([ktRel, veRel, p[:, 2], p[:, 3], kepRR]))
+
+
+def complex_case():
+    # Noisy low-Ktrans voxels, for many of which A^2 - 4B < 0
+    t = np.arange(70) * 5.4 / 60
+    Cp = georgiou_aif(t)[0]
+    Crr = tofts_kety(Cp, [0.07, 0.07 / 0.14], t)
+    rng = np.random.RandomState(0)
+    Ct = tofts_kety(Cp, [0.05, 0.1, 0.01], t)[:, None] + 0.05 * rng.randn(len(t), 100)
+    return Ct, Crr, t
+
+
+def test_errm_matches_matlab_when_kep_rr_is_complex():
+    Ct, Crr, t = complex_case()
+    pure, _ = errm(Ct, Crr, t, doPure=True)
+    A = pure[:, 0] / pure[:, 3]
+    B = pure[:, 1] / pure[:, 3]
+    isComplex = A ** 2 - 4 * B < 0
+    assert isComplex.sum() > 10
+
+    pkParams, _ = errm(Ct, Crr, t)
+    expected = matlab_errm_transform(pure)
+    np.testing.assert_allclose(pkParams[:, 1], expected[:, 1], rtol=1e-10)
+    np.testing.assert_allclose(pkParams, expected, rtol=1e-10)
+
+    # Taking the real part of kepRR first gives another ve/veRR for these voxels
+    kepRR = np.real(pkParams[:, 4])
+    realFirst = pkParams[:, 0] * kepRR / pkParams[:, 2]
+    assert not np.allclose(realFirst[isComplex], expected[isComplex, 1])
+    np.testing.assert_allclose(realFirst[~isComplex], expected[~isComplex, 1], rtol=1e-10)
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+
+from rriftpy.patients import list_studies, load_preprocessed, study_name, voxel_chunks
+
+from conftest import STUDIES
+
+
+def test_voxel_chunks_cover_every_voxel_and_clip_negatives():
+    Ct = np.arange(-6, 24, dtype=float).reshape(3, 10)
+    chunks = list(voxel_chunks(Ct, chunkSize=4))
+    assert [(start, stop) for start, stop, _ in chunks] == [(0, 4), (4, 8), (8, 10)]
+    np.testing.assert_array_equal(np.concatenate([c for _, _, c in chunks], axis=1),
+                                  np.maximum(Ct, 0))
+    assert Ct.min() == -6  # the input is not modified
+
+
+def test_load_preprocessed_drops_voxels_that_do_not_enhance(c01_dir):
+    paths = list_studies(c01_dir)
+    assert [study_name(p) for p in paths] == list(STUDIES)
+    f = load_preprocessed(os.path.join(c01_dir, STUDIES[0] + '.mat'))
+    assert f['numVox'] == f['numGoodVox'] + 3
+    assert f['Ct'].shape == (70, f['numGoodVox'])
+    assert f['maskCt'].sum() == f['numGoodVox']
+    # The first three voxels in MATLAB order are those that do not enhance
+    assert not f['maskCt'][2:5, 1, 0].any() and f['maskCt'][5, 1, 0]
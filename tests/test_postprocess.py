@@ -0,0 +1,103 @@
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+from scipy.io import loadmat
+
+from rriftpy.mapstore import MAP_NAMES
+from rriftpy.patients import read_preprocessed
+from rriftpy import postprocess
+from rriftpy.postprocess import rrift_study, run_pipeline
+from rriftpy.taskpool import WORKER_DIED
+
+from conftest import STUDIES
+
+DATA = os.path.join('RRIFT', 'data', 'TCGA-GBM-Results')
+STUDY = 'TCGA-06-0185-2'
+CRASHING_STUDY = 'TCGA-00-0003-1'
+process_study = postprocess.process_study
+
+
+def crashing_process_study(inFile, *args):
+    # Like a worker killed for running out of memory, while others are busy
+    if CRASHING_STUDY in inFile:
+        time.sleep(0.1)
+        os._exit(1)
+    time.sleep(0.3)
+    return process_study(inFile, *args)
+
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(DATA, 'c01_preprocessed', STUDY + '.mat')),
+                    reason='needs the TCGA-GBM results')
+def test_rrift_study_matches_c02():
+    out = rrift_study(read_preprocessed(os.path.join(DATA, 'c01_preprocessed', STUDY + '.mat')))
+    c02 = loadmat(os.path.join(DATA, 'c02_postprocessed', STUDY + '.mat'))
+    # c02 saved some of its estimates in single precision
+    for name in ('estKepRR', 'estKtRR', 'estVeRR', 'estKtRRPop', 'estKtRRdiff', 'ciKepRR'):
+        np.testing.assert_allclose(out[name], np.squeeze(c02[name]), rtol=1e-6, err_msg=name)
+    for name in ('ciKtRR', 'ciVeRR', 'ciKtRRT'):
+        np.testing.assert_allclose(out[name], np.squeeze(c02[name]), rtol=1e-2, err_msg=name)
+    assert out['numGoodVox'] == c02['numGoodVox'].item()
+    for name in ('mapKt', 'mapVeR'):
+        np.testing.assert_allclose(np.nan_to_num(out[name].dense()), np.nan_to_num(c02[name]),
+                                   atol=1e-5, err_msg=name)
+
+
+def test_pipeline_reports_a_failed_study_and_goes_on(c01_dir, tmp_path):
+    with open(os.path.join(c01_dir, 'TCGA-00-0000-1.mat'), 'wb') as fid:
+        fid.write(b'not a mat file')
+    outDir = str(tmp_path / 'c02')
+    reports = run_pipeline(c01_dir, outDir, workers=1, verbose=False)
+    assert [r['study'] for r in reports] == ['TCGA-00-0000-1'] + list(STUDIES)
+    assert [r['status'] for r in reports] == ['failed', 'ok', 'ok']
+    assert 'Traceback' in reports[0]['error']
+    assert sorted(os.listdir(outDir)) == [s + '.mat' for s in STUDIES]
+
+    f = loadmat(os.path.join(outDir, STUDIES[1] + '.mat'))
+    np.testing.assert_array_equal(f['Rsq'][[0, 1], 0], [0, 0])
+    assert 0 < f['Rsq'][2, 0] <= 1
+    for name in MAP_NAMES:
+        assert f[name].shape == f['maskCt'].shape
+    # Voxels that do not enhance are not in the output mask
+    assert f['maskCt'].sum() == f['numGoodVox'].item() == f['numVox'].item() - 3
+
+    reports = run_pipeline(c01_dir, outDir, workers=1, doOverwrite=False, verbose=False)
+    assert [r['status'] for r in reports] == ['failed', 'skipped', 'skipped']
+
+
+def test_pipeline_survives_a_worker_crash(c01_dir, tmp_path, monkeypatch):
+    names = ['TCGA-00-000{}-1'.format(k) for k in range(3, 7)]
+    for name in names:
+        shutil.copy(os.path.join(c01_dir, STUDIES[0] + '.mat'),
+                    os.path.join(c01_dir, name + '.mat'))
+    monkeypatch.setattr(postprocess, 'process_study', crashing_process_study)
+    outDir = str(tmp_path / 'c02')
+    reports = run_pipeline(c01_dir, outDir, workers=2, verbose=False)
+    assert [r['study'] for r in reports] == list(STUDIES) + names
+    failed = [r for r in reports if r['status'] != 'ok']
+    assert [r['study'] for r in failed] == [CRASHING_STUDY]
+    assert failed[0]['error'] == WORKER_DIED
+    assert len(os.listdir(outDir)) == len(reports) - 1
+
+
+def test_pipeline_does_not_depend_on_workers(c01_dir, tmp_path):
+    run_pipeline(c01_dir, str(tmp_path / 'serial'), workers=1, verbose=False)
+    run_pipeline(c01_dir, str(tmp_path / 'parallel'), workers=2, verbose=False)
+    for study in STUDIES:
+        a = loadmat(str(tmp_path / 'serial' / (study + '.mat')))
+        b = loadmat(str(tmp_path / 'parallel' / (study + '.mat')))
+        for name in ('estKepRR', 'estKtRR', 'mapKt', 'mapVpR', 'maskCt'):
+            np.testing.assert_array_equal(a[name], b[name])
+
+
+def test_chunked_fit_matches_a_single_chunk(c01_dir):
+    f = read_preprocessed(os.path.join(c01_dir, STUDIES[0] + '.mat'))
+    whole = rrift_study(f)
+    chunked = rrift_study(f, chunkSize=5)
+    for name in ('estKepRR', 'estKtRR', 'ciKepRR', 'numGoodVox'):
+        np.testing.assert_allclose(chunked[name], whole[name], rtol=1e-12, err_msg=name)
+    np.testing.assert_array_equal(chunked['maskCt'], whole['maskCt'])
+    for name in MAP_NAMES:
+        np.testing.assert_allclose(chunked[name].values, whole[name].values, rtol=1e-12)
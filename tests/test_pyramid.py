@@ -0,0 +1,58 @@
+import json
+import os
+
+import numpy as np
+
+from rriftpy.pyramid import block_mean, json_image, study_pyramid, tiles, write_pyramid
+
+
+def test_block_mean_averages_the_masked_finite_pixels():
+    image = np.array([[1, 2, 3],
+                      [3, np.nan, 5],
+                      [7, 8, 9]], dtype=float)
+    mask = np.ones((3, 3), dtype=bool)
+    mask[0, 0] = False
+    # Blocks are padded: 2 x 2 blocks of a 3 x 3 image give 2 x 2 means
+    np.testing.assert_allclose(block_mean(image, 2, mask), [[2.5, 4], [7.5, 9]])
+    np.testing.assert_allclose(block_mean(image, 2), [[2, 4], [7.5, 9]])
+    np.testing.assert_allclose(block_mean(image, 4), [[38 / 8]])
+    full = block_mean(image, 1, mask)
+    assert np.isnan(full[0, 0]) and np.isnan(full[1, 1]) and full[2, 2] == 9
+    assert np.isnan(block_mean(image, 2, np.zeros((3, 3), dtype=bool))).all()
+
+
+def test_tiles_skip_empty_ones_and_json_uses_null():
+    image = np.full((5, 7), np.nan)
+    image[4, 6] = 0.123456789
+    assert [(row, col) for row, col, _ in tiles(image, 3)] == [(1, 2)]
+    tile = next(tiles(image, 3))[2]
+    assert tile.shape == (2, 1)
+    assert json_image(tile) == [[None], [0.12346]]
+
+
+def test_pyramid_index_and_files(tmp_path):
+    volume = np.zeros((10, 12, 2))
+    mask = np.zeros((10, 12, 2), dtype=bool)
+    mask[1:3, 9:12, 1] = True
+    volume[mask] = 0.1
+    index = write_pyramid(str(tmp_path), {'mapKt': volume}, mask, factors=(2, 1), tileSize=4)
+    assert index['factors'] == [1, 2] and index['voxels'] == [0, 6]
+    assert index['tiles']['mapKt'][0] == {'1': [], '2': []}
+    assert index['tiles']['mapKt'][1] == {'1': ['0_2'], '2': ['0_1']}
+    with open(str(tmp_path / 'mapKt' / '1' / '2' / '0_1.json')) as fid:
+        assert json.load(fid) == [[0.1, 0.1], [0.1, 0.1], [None, None], [None, None]]
+    assert write_pyramid(None, {'mapKt': volume}, mask, (1, 2), 4) == index
+
+
+def test_study_pyramid_with_a_data_url_writes_no_tiles(c02_dir, tmp_path):
+    inFile = os.path.join(c02_dir, sorted(os.listdir(c02_dir))[0])
+    outDir = str(tmp_path / 'pyramid')
+    os.makedirs(outDir)
+    path = study_pyramid(inFile, outDir, ('mapKt',), include_plotlyjs=False,
+                         dataUrl='http://localhost:8000/tiles/')
+    assert os.listdir(outDir) == [os.path.basename(path)]
+    with open(path) as fid:
+        html = fid.read()
+    assert '"url":"http://localhost:8000/tiles/TCGA-00-0001-1"' in html
+    study_pyramid(inFile, outDir, ('mapKt',), include_plotlyjs=False)
+    assert os.path.isdir(os.path.join(outDir, 'TCGA-00-0001-1', 'mapKt'))
@@ -0,0 +1,77 @@
+import numpy as np
+
+from rriftpy.figures import share_arrays, to_json, write_views_html
+from rriftpy.simfigures import FIG2, fig2_slider, figure_views, slider_figure
+
+LIST_SIGMA = np.array([[0.01, 0.02, 0.03]])
+
+
+def fig2_vars():
+    rng = np.random.RandomState(0)
+    f = dict(listSigmaC=LIST_SIGMA)
+    for suffix, _, _, _ in FIG2.values():
+        f['errMd' + suffix] = rng.randn(4, 3)
+        f['errQt' + suffix] = np.stack([f['errMd' + suffix] - 1, f['errMd' + suffix] + 1], -1)
+    return f
+
+
+def test_swap_slider_carries_the_data_of_every_step():
+    f = fig2_vars()
+    plain = fig2_slider(f, 'Ktrans')
+    swapped = fig2_slider(f, 'Ktrans', swap=True)
+    assert len(plain['data']) == 4 and len(swapped['data']) == 1
+    assert swapped['data'][0]['visible']
+    steps = swapped['layout']['sliders'][0]['steps']
+    assert [s['method'] for s in steps] == ['skip'] * 4
+    assert [s['label'] for s in steps] == [s['label'] for s in
+                                           plain['layout']['sliders'][0]['steps']]
+    payload = swapped['payload']
+    assert payload['keys'] == ['x', 'y', 'error_y.array', 'error_y.arrayminus', 'line.color',
+                               'name']
+    assert payload['options'][0][0] is None
+    for k in range(1, 4):
+        update, trace = payload['options'][k][0], plain['data'][k]
+        np.testing.assert_array_equal(update['y'][0], trace['y'])
+        np.testing.assert_array_equal(update['error_y.arrayminus'][0],
+                                      trace['error_y']['arrayminus'])
+        assert update['line.color'] == [trace['line']['color']]
+
+
+def test_slider_figure_without_swap_toggles_visibility():
+    traces = [dict(type='scatter', x=[0], y=[k], name=str(k)) for k in range(3)]
+    fig = slider_figure(traces, ['a', 'b', 'c'], 'title', (0, 1), (0, 1), 'x', 'p: ')
+    steps = fig['layout']['sliders'][0]['steps']
+    assert [s['args'][0]['visible'] for s in steps] == [[True, False, False],
+                                                         [False, True, False],
+                                                         [False, False, True]]
+    assert 'payload' not in fig
+
+
+def test_views_share_the_arrays_of_their_figures(tmp_path):
+    views = figure_views('fig2', fig2_vars(), swap=True)
+    assert [name for name, _, _ in views] == ['fig2', 'fig2-1', 'fig2-2', 'fig2-3']
+    store, figs = share_arrays([fig for _, _, fig in views])
+    # The x values of every curve are one array
+    xRefs = {trace['x']['@ref'] for fig in figs for trace in fig['data']}
+    assert len(xRefs) == 1
+    np.testing.assert_array_equal(store[xRefs.pop()], LIST_SIGMA[0])
+    # The slider pages show the curves of the combined figure
+    combinedY = {trace['y']['@ref'] for trace in figs[0]['data']}
+    assert figs[1]['data'][0]['y']['@ref'] in combinedY
+    # The figures themselves are left as they are
+    assert isinstance(views[1][2]['data'][0]['x'], np.ndarray)
+
+    path = str(tmp_path / 'fig2.html')
+    write_views_html(views, path, include_plotlyjs='cdn')
+    with open(path) as fid:
+        html = fid.read()
+    assert html.count('<script src=') == 1
+    assert '<a id="view-fig2-1" href="#fig2-1">' in html
+    assert html.count(to_json(LIST_SIGMA[0])) == 1
+
+
+def test_share_arrays_tells_dtypes_and_shapes_apart():
+    a = np.arange(4.0)
+    store, (fig,) = share_arrays([dict(data=[a, a.copy(), a.reshape(2, 2), a.astype(int)])])
+    assert [x['@ref'] for x in fig['data']] == ['0', '0', '1', '2']
+    assert len(store) == 3
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from rriftpy.mainsim import run_main_simulation
+from rriftpy.rng import cell_generator
+from rriftpy.simulation import (cached_sim_map, cell_indices, compute_cells, downsample,
+                                run_adaptive_cell, run_cell)
+
+SPECS = [(0.07, 0.5, 0.02, 15), (0.07, 0.5, 0.04, 15)]
+
+
+def test_cell_generator_streams():
+    a = cell_generator(12345, 3, 1, 2).standard_normal(10)
+    np.testing.assert_array_equal(a, cell_generator(12345, 3, 1, 2).standard_normal(10))
+    assert not np.array_equal(a, cell_generator(12345, 4, 1, 2).standard_normal(10))
+    assert not np.array_equal(a, cell_generator(12346, 3, 1, 2).standard_normal(10))
+
+
+def test_cell_generator_rejects_bad_indices():
+    with pytest.raises(ValueError):
+        cell_generator(1, 0, 0, 0, 0)
+    with pytest.raises(ValueError):
+        cell_generator(1, -1)
+
+
+def test_cell_indices_identify_the_physical_cell():
+    assert cell_indices(0.07, 0.5, 0.02, 15) == cell_indices(0.07 + 1e-12, 0.5, 0.02, 15.0)
+    assert cell_indices(0.07, 0.5, 0.02, 15) != cell_indices(0.07, 0.5, 0.02, 10)
+
+
+def test_downsample_per_voxel_phase():
+    x = np.arange(10)[:, None] * np.ones((1, 2))
+    np.testing.assert_array_equal(downsample(x, 3, [0, 2]), [[0, 2], [3, 5], [6, 8]])
+    np.testing.assert_array_equal(downsample(np.arange(10), 3, [1, 1]), [[1, 1], [4, 4], [7, 7]])
+
+
+def test_compute_cells_does_not_depend_on_workers_or_blocks():
+    serial = compute_cells(SPECS, 5, seed=7, simMapPath=None, workers=1, blockSize=5)
+    parallel = compute_cells(SPECS, 5, seed=7, simMapPath=None, workers=3, blockSize=2)
+    for a, b in zip(serial, parallel):
+        assert a['pkCERRM'].shape == (100, 5, 5)
+        for key in a:
+            np.testing.assert_array_equal(a[key], b[key])
+    # Fewer replications give a prefix of the same streams
+    prefix = compute_cells(SPECS[:1], 2, seed=7, simMapPath=None, workers=1)[0]
+    np.testing.assert_array_equal(prefix['estKtRR'], serial[0]['estKtRR'][:2])
+
+
+def test_compute_cells_simulates_repeated_specs_once():
+    cells = compute_cells([SPECS[0], SPECS[1], SPECS[0]], 2, simMapPath=None, workers=1)
+    assert cells[0] is cells[2]
+    assert not np.array_equal(cells[0]['estKtRR'], cells[1]['estKtRR'])
+
+
+def test_adaptive_cell_is_a_prefix_of_the_fixed_run():
+    simMap = cached_sim_map(None)
+    fixed = run_cell(simMap, *SPECS[0], replications=range(6), seed=7)
+    early = run_adaptive_cell(simMap, *SPECS[0], seed=7, tol=1e6, blockSize=2, minRep=4,
+                              maxRep=6)
+    assert early['nRep'] == 4
+    np.testing.assert_array_equal(early['pkCERRM'], fixed['pkCERRM'][..., :4])
+    capped = run_adaptive_cell(simMap, *SPECS[0], seed=7, tol=0, blockSize=4, minRep=2, maxRep=6)
+    assert capped['nRep'] == 6 and capped['ciWidth'] > 0
+    np.testing.assert_array_equal(capped['estKtRR'], fixed['estKtRR'])
+
+
+def test_adaptive_main_simulation_records_replications():
+    results = run_main_simulation(None, TRes=(15,), listSigmaC=(0.02, 0.04), repF=4, seed=7,
+                                  workers=1, blockSize=2, tol=1e6, minRep=2)
+    assert results['nRep'].tolist() == [[2, 2]]
+    assert results['estKtRR'].shape == (2, 1, 2)
+    fixed = run_main_simulation(None, TRes=(15,), listSigmaC=(0.02, 0.04), repF=4, seed=7,
+                                workers=1)
+    np.testing.assert_array_equal(results['estKtRR'], fixed['estKtRR'][:2])
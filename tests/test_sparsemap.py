@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from rriftpy.sparsemap import SparseMap, dense_slice
+
+from conftest import SHAPE
+
+
+def volume():
+    x = np.zeros(SHAPE)
+    x[2:5, 1:3, 0] = [[1, 2], [3, np.nan], [5, 6]]
+    x[7, 5, 2] = 9
+    return x
+
+
+def test_round_trip_through_dense_and_slices():
+    x = volume()
+    m = SparseMap.from_dense(x)
+    # NaN voxels are kept, like any other non-zero value
+    assert m.index.size == 7
+    np.testing.assert_array_equal(m.dense(), x)
+    for z in range(SHAPE[2]):
+        np.testing.assert_array_equal(m.slice(z), x[:, :, z])
+        np.testing.assert_array_equal(dense_slice(m, z), dense_slice(x, z))
+    np.testing.assert_array_equal(m.dense(fill=np.nan)[0, 0, 0], np.nan)
+    assert m.nbytes < x.nbytes
+
+
+def test_from_dense_with_a_mask_keeps_zeros():
+    x = volume()
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[0, 0, 1] = mask[2, 1, 0] = True
+    m = SparseMap.from_dense(x, mask)
+    np.testing.assert_array_equal(m.values, [1, 0])
+    np.testing.assert_array_equal(m.dense(fill=-1)[0, 0, 1], 0)
+    np.testing.assert_array_equal(m.dense(fill=-1)[1, 1, 1], -1)
+
+
+def test_bbox_and_crop():
+    x = volume()
+    x[7, 5, 2] = 0
+    m = SparseMap.from_dense(x)
+    assert m.bbox() == (slice(2, 5), slice(1, 3), slice(0, 1))
+    assert m.bbox(pad=3) == (slice(0, 8), slice(0, 6), slice(0, 3))
+    np.testing.assert_array_equal(m.crop(), x[2:5, 1:3, 0:1])
+    box = (slice(3, None), slice(0, 2), slice(None))
+    np.testing.assert_array_equal(m.crop(box), x[box])
+    empty = SparseMap([], [], SHAPE)
+    assert empty.bbox() == (slice(0, 0),) * 3
+    assert empty.crop().shape == (0, 0, 0)
+
+
+def test_constructor_checks_the_index():
+    with pytest.raises(ValueError):
+        SparseMap([3, 1], [1.0, 2.0], SHAPE)
+    with pytest.raises(ValueError):
+        SparseMap([1, 1], [1.0, 2.0], SHAPE)
+    with pytest.raises(ValueError):
+        SparseMap([1, 2], [1.0], SHAPE)
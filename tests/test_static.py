@@ -0,0 +1,101 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from rriftpy import static
+from rriftpy.static import MANIFEST, asset_path, build_static, content_hash, hashed_name
+
+PAGE = b'<html>' + b'<p>figure</p>' * 200 + b'</html>'
+
+
+@pytest.fixture
+def files(tmp_path):
+    (tmp_path / 'figures').mkdir()
+    (tmp_path / 'figures' / 'fig2.html').write_bytes(PAGE)
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'images' / 'logo.png').write_bytes(os.urandom(200))
+    return tmp_path
+
+
+def test_hashed_names():
+    assert hashed_name('figures/fig2.html', PAGE) == 'figures/fig2.{}.html'.format(
+        content_hash(PAGE))
+    assert len(content_hash(PAGE)) == static.HASH_LENGTH
+
+
+def test_manifest_and_gzip_variants(files, monkeypatch):
+    monkeypatch.setattr(static, 'brotli', None)
+    outDir = str(files / 'static')
+    manifest = build_static([str(files / 'figures'), str(files / 'images')], outDir,
+                            str(files))
+    assert sorted(manifest) == ['figures/fig2.html', 'images/logo.png']
+    page = manifest['figures/fig2.html']
+    target = os.path.join(outDir, *page['file'].split('/'))
+    with open(target, 'rb') as fid:
+        assert fid.read() == PAGE
+    with open(target + '.gz', 'rb') as fid:
+        zipped = fid.read()
+    assert gzip.decompress(zipped) == PAGE and page['gzip'] == len(zipped) < page['size']
+    assert 'br' not in page
+    # Random bytes do not compress, so the image has no variant
+    logo = manifest['images/logo.png']
+    assert sorted(logo) == ['file', 'size']
+    assert not os.path.exists(os.path.join(outDir, *logo['file'].split('/')) + '.gz')
+    with open(os.path.join(outDir, MANIFEST)) as fid:
+        assert json.load(fid) == manifest
+
+    # A changed page gets a new name; the old one stays
+    (files / 'figures' / 'fig2.html').write_bytes(PAGE + b' ')
+    manifest = build_static([str(files / 'figures')], outDir, str(files))
+    assert manifest['figures/fig2.html']['file'] != page['file']
+    assert os.path.exists(target)
+    with pytest.raises(ValueError):
+        build_static([str(files / 'figures')], outDir, str(files / 'images'))
+
+
+def test_missing_variants_of_existing_files_are_made(files, monkeypatch):
+    monkeypatch.setattr(static, 'brotli', None)
+    outDir = str(files / 'static')
+    page = build_static([str(files / 'figures')], outDir, str(files))['figures/fig2.html']
+    target = os.path.join(outDir, *page['file'].split('/'))
+    os.remove(target + '.gz')
+    assert build_static([str(files / 'figures')], outDir, str(files))['figures/fig2.html'] == page
+    with open(target + '.gz', 'rb') as fid:
+        assert gzip.decompress(fid.read()) == PAGE
+
+
+def test_brotli_variant_added_to_an_earlier_build(files, monkeypatch):
+    brotli = pytest.importorskip('brotli')
+    outDir = str(files / 'static')
+    monkeypatch.setattr(static, 'brotli', None)
+    page = build_static([str(files / 'figures')], outDir, str(files))['figures/fig2.html']
+    assert 'br' not in page
+    monkeypatch.setattr(static, 'brotli', brotli)
+    page = build_static([str(files / 'figures')], outDir, str(files))['figures/fig2.html']
+    target = os.path.join(outDir, *page['file'].split('/'))
+    with open(target + '.br', 'rb') as fid:
+        assert brotli.decompress(fid.read()) == PAGE
+
+
+def test_asset_path_reads_the_manifest(files, monkeypatch):
+    monkeypatch.setattr(static, 'brotli', None)
+    outDir = str(files / 'static')
+    manifest = os.path.join(outDir, MANIFEST)
+    assert asset_path('figures/fig2.html', manifest) == 'figures/fig2.html'
+    entries = build_static([str(files / 'figures')], outDir, str(files))
+    assert asset_path('figures/fig2.html', manifest) == entries['figures/fig2.html']['file']
+    assert asset_path('figures/fig3.html', manifest) == 'figures/fig3.html'
+
+
+def test_a_run_keeps_the_manifest_entries_of_other_files(files, monkeypatch):
+    monkeypatch.setattr(static, 'brotli', None)
+    outDir = str(files / 'static')
+    first = build_static([str(files / 'figures'), str(files / 'images')], outDir, str(files))
+    (files / 'figures' / 'fig2.html').write_bytes(PAGE + b' ')
+    manifest = build_static([str(files / 'figures')], outDir, str(files))
+    assert manifest['images/logo.png'] == first['images/logo.png']
+    assert manifest['figures/fig2.html'] != first['figures/fig2.html']
+    with open(os.path.join(outDir, MANIFEST)) as fid:
+        assert json.load(fid) == manifest
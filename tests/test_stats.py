@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from rriftpy import stats
+from rriftpy.stats import (conf_interval, iqr_mean, iqr_stats, percent_error, quantile,
+                           quantile_filter)
+
+# Values computed by hand with MATLAB's definitions: quantile places the
+# sorted values at (i-0.5)/n, ConfInterval.m uses tinv with n-1 degrees of
+# freedom and counts NaNs in n
+X = np.array([[1, 1, np.nan],
+              [2, 2, np.nan],
+              [3, 3, np.nan],
+              [4, 4, np.nan],
+              [5, np.nan, np.nan]])
+
+
+def test_quantile_matches_matlab():
+    assert quantile([1, 2, 3, 4], 0.5) == 2.5
+    np.testing.assert_allclose(quantile([4, 1, 3, 2], [0.1, 0.25, 0.75, 0.95]),
+                               [1, 1.5, 3.5, 4])
+    assert quantile([1, 2, 3, 4, 5], 0.3) == 2
+    np.testing.assert_allclose(quantile(X, [0.25, 0.5], axis=0),
+                               [[1.75, 3], [1.5, 2.5], [np.nan, np.nan]])
+    np.testing.assert_allclose(quantile(X.T, 0.5, axis=1), [3, 2.5, np.nan])
+
+
+def test_quantile_of_many_nan_counts_sorts(monkeypatch):
+    rng = np.random.RandomState(0)
+    x = rng.randn(12, 20)
+    for k in range(20):
+        x[:k % 12, k] = np.nan
+    expected = np.array([[quantile(x[:, k][~np.isnan(x[:, k])], p) for p in (0.1, 0.5, 0.9)]
+                         for k in range(20)])
+    np.testing.assert_allclose(quantile(x, [0.1, 0.5, 0.9], axis=0), expected)
+    monkeypatch.setattr(stats, 'MAX_PARTITION_GROUPS', 100)
+    np.testing.assert_allclose(quantile(x, [0.1, 0.5, 0.9], axis=0), expected)
+
+
+def test_iqr_mean_matches_matlab():
+    # Quartiles 2.5 and 6.5; strictly inside are 3, 4, 5 and 6
+    assert iqr_mean(np.arange(1, 9)) == 4.5
+    with np.errstate(invalid='ignore'):
+        np.testing.assert_allclose(iqr_mean(X, axis=0), [3, 2.5, np.nan])
+    iqrM, iqrStd, ci, qtRange = iqr_stats(X[:, :2])
+    np.testing.assert_allclose(iqrM, [3, 2.5])
+    np.testing.assert_allclose(iqrStd, [1, np.sqrt(0.5)])
+    np.testing.assert_allclose(qtRange, [[1.75, 4.25], [1.5, 3.5]])
+    assert ci.shape == (2, 2)
+
+
+def test_conf_interval_matches_matlab():
+    CI, AVG = conf_interval(X[:, :2], axis=0)
+    np.testing.assert_allclose(AVG, [3, 2.5])
+    # Column 2: mean 2.5, std 1.2910 over 4 values, but n = 5 with the NaN
+    np.testing.assert_allclose(CI[1], [0.8970186711, 4.1029813289])
+    CI, _ = conf_interval([1, 2, 3, 4])
+    np.testing.assert_allclose(CI, [0.4457397432, 4.5542602568])
+    with pytest.warns(RuntimeWarning):
+        CI, AVG = conf_interval(X[:, 2], axis=0)
+    assert np.isnan(AVG) and np.all(np.isnan(CI))
+
+
+def test_quantile_filter_and_percent_error():
+    np.testing.assert_array_equal(quantile_filter([1, 2, 3, 4]), [np.nan, 2, 3, np.nan])
+    filtered = quantile_filter(X[:, :2], axis=0)
+    np.testing.assert_array_equal(np.isnan(filtered[:, 0]), [True, False, False, False, True])
+    np.testing.assert_allclose(percent_error([[1, 2], [3, 4]], [2, 4]), [[-50, 0], [-25, 0]])
+    np.testing.assert_allclose(percent_error([[1, 2], [3, 4], [5, 6]], [1, 2]),
+                               [[0, 0], [200, 100], [400, 200]])
+    assert np.isinf(percent_error(1, 0))
@@ -0,0 +1,39 @@
+import numpy as np
+
+from rriftpy.simulation import cached_sim_map
+from rriftpy.sweep import reference_grid, run_sweep, summarize_fig4, sweep_specs
+
+GRID = (np.array([0.05, 0.09]), np.array([0.12, 0.16]))
+
+
+def test_reference_grid_defaults_to_b04():
+    ktRR, veRR = reference_grid()
+    np.testing.assert_allclose(ktRR, np.arange(0.03, 0.111, 0.01))
+    np.testing.assert_allclose(veRR, np.arange(0.10, 0.181, 0.01))
+
+
+def test_sweep_specs_hold_the_other_parameter_nominal():
+    specs = sweep_specs(*GRID, ktRRNominal=0.07, veRRNominal=0.14)
+    assert specs['varKtRR'] == [(0.05, 0.05 / 0.14, 0.02, 15), (0.09, 0.09 / 0.14, 0.02, 15)]
+    assert specs['varVeRR'] == [(0.07, 0.07 / 0.12, 0.02, 15), (0.07, 0.07 / 0.16, 0.02, 15)]
+
+
+def test_sweep_does_not_depend_on_workers():
+    serial = run_sweep(None, *GRID, repF=3, workers=1, blockSize=2)
+    parallel = run_sweep(None, *GRID, repF=3, workers=2, blockSize=1)
+    for experiment in ('varKtRR', 'varVeRR'):
+        assert serial[experiment]['pkCERRM'].shape == (2, 100, 5, 3)
+        for key, x in serial[experiment].items():
+            np.testing.assert_array_equal(x, parallel[experiment][key])
+
+
+def test_summarize_fig4_layout():
+    results = run_sweep(None, *GRID, repF=3, workers=1)
+    for summary in ('quartile', 'mean'):
+        out = summarize_fig4(results, cached_sim_map(None), summary=summary)
+        for num in (1, 2, 3):
+            for name in ('Ktrans', 'Ve', 'Vp'):
+                assert out['{}_avg{}'.format(name, num)].shape == (2, 1)
+                assert out['{}_ci{}'.format(name, num)].shape == (2, 2)
+        np.testing.assert_array_equal(out['trueKtRR'][:, 0], GRID[0])
+        np.testing.assert_array_equal(out['trueVeRR'][:, 0], GRID[1])
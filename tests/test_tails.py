@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from rriftpy import models, tails
+from rriftpy.tails import main, rrift_tails, tail_sensitivity, threshold_summary
+
+
+def test_rrift_tails_matches_rrift_on_each_tail(c01_dir):
+    result = tail_sensitivity(c01_dir, tailList=[10, 33, 60])
+    assert result['estKtRR'].shape == (2, 3)
+    t = result['t'][:, 0]
+    Cp = models.georgiou_aif(t, t[5])[0]
+    Crr = models.tofts_kety(Cp, [0.07, 0.5], t)
+    kepRR = result['estKepRR'][0]
+    for k, frame in enumerate([10, 33, 60]):
+        f = frame - 1
+        expected = models.rrift(Cp[f:], Crr[f:], t[f:], kepRR)[0]
+        np.testing.assert_allclose(rrift_tails(Cp, Crr, t, kepRR, [frame])[0, 0], expected,
+                                   rtol=1e-10)
+        np.testing.assert_allclose(result['estKtRR'][0, k], expected, rtol=1e-6)
+
+
+def test_tail_sensitivity_is_quiet_by_default(c01_dir, capsys):
+    tail_sensitivity(c01_dir, tailList=[33])
+    assert capsys.readouterr().out == ''
+
+
+def test_threshold_summary():
+    t = np.arange(5.0)[:, None]
+    result = dict(tailList=np.array([1, 2, 3, 4]), t=t,
+                  estKtRR=np.array([[1.0, 1.1, 1.3, 2.0]]))
+    summary = threshold_summary(result, refFrame=2, tol=20)
+    np.testing.assert_allclose(summary['percentChange'], [[100 * (1 / 1.1 - 1), 0,
+                                                           100 * (1.3 / 1.1 - 1),
+                                                           100 * (2 / 1.1 - 1)]])
+    assert summary['firstFrame'] == 4
+    np.testing.assert_array_equal(summary['firstDuration'], [1])
+    assert np.isnan(threshold_summary(result, refFrame=2, tol=1000)['firstFrame'])
+
+
+@pytest.mark.parametrize('refFrame', [0, 70])
+def test_threshold_summary_rejects_frames_outside_the_grid(refFrame):
+    result = dict(tailList=np.arange(1, 70), t=np.zeros((70, 1)), estKtRR=np.ones((1, 69)))
+    with pytest.raises(ValueError, match='refFrame {} is not a tail start'.format(refFrame)):
+        threshold_summary(result, refFrame=refFrame)
+
+
+def test_main_checks_the_reference_frame_before_fitting(c01_dir, tmp_path, monkeypatch, capsys):
+    fits = []
+    monkeypatch.setattr(tails, 'tail_sensitivity', lambda *args, **kw: fits.append(args))
+    # The synthetic studies have 70 frames, so tails start at frames 1 to 69
+    for refFrame in ('0', '70'):
+        with pytest.raises(SystemExit):
+            main(['--in-dir', c01_dir, '--ref-frame', refFrame])
+        assert '1 to 69' in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        main(['--in-dir', str(tmp_path)])
+    assert fits == []
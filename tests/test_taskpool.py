@@ -0,0 +1,27 @@
+import os
+import time
+
+from rriftpy.taskpool import WORKER_DIED, run_tasks
+
+
+def square(x):
+    if x == 3:
+        time.sleep(0.2)  # let the other workers pick up tasks first
+        os._exit(1)
+    if x == 5:
+        raise ValueError('five')
+    time.sleep(0.05)
+    return x * x
+
+
+def test_only_the_task_that_kills_its_worker_fails():
+    out = {key: (result, error) for key, result, error in
+           run_tasks(square, [(x, (x,)) for x in range(10)], workers=2)}
+    assert sorted(out) == list(range(10))
+    assert out[3] == (None, WORKER_DIED)
+    assert out[5][0] is None and 'ValueError: five' in out[5][1]
+    assert all(out[x] == (x * x, None) for x in range(10) if x not in (3, 5))
+
+
+def test_no_tasks():
+    assert list(run_tasks(square, [], workers=2)) == []
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import savemat
+
+from rriftpy import voxelstore
+from rriftpy.patients import _HDF5Columns, load_preprocessed, read_preprocessed
+from rriftpy.voxelstore import VoxelStore, convert_preprocessed, save_store, slice_starts
+
+from conftest import SHAPE, STUDIES, synthetic_study
+
+
+def test_slice_starts_split_the_index_by_slice():
+    # 2 x 2 x 3 volume: voxels 1, 2 in slice 0, none in slice 1, 9 in slice 2
+    np.testing.assert_array_equal(slice_starts(np.array([1, 2, 9]), (2, 2, 3)), [0, 2, 2, 3])
+
+
+def test_store_round_trip(tmp_path):
+    f = synthetic_study(0)
+    path = str(tmp_path / 'study.vox')
+    save_store(path, f['Ct'], f['maskCt'], {'Cp': f['Cp']}, {'maskCp': f['maskCp']})
+    store = VoxelStore(path)
+    np.testing.assert_array_equal(store.Ct, f['Ct'])
+    np.testing.assert_array_equal(store.mask(), f['maskCt'])
+    np.testing.assert_array_equal(store.mask('maskCp'), f['maskCp'])
+    np.testing.assert_array_equal(store.variables['Cp'], f['Cp'])
+    # densify is map(maskCt) = values, and slices of it
+    values = np.arange(store.nVox) + 1.0
+    expected = np.zeros(np.prod(SHAPE))
+    expected[store.index] = values
+    expected = expected.reshape(SHAPE, order='F')
+    np.testing.assert_array_equal(store.densify(values), expected)
+    np.testing.assert_array_equal(store.densify(values, [1]), expected[:, :, [1]])
+    np.testing.assert_array_equal(store.slice_Ct(2), np.zeros((70, 0)))
+    with pytest.raises(ValueError):
+        save_store(path, f['Ct'][:, 1:], f['maskCt'])
+
+
+def test_converted_study_loads_like_the_mat_file(c01_dir, tmp_path):
+    matFile = os.path.join(c01_dir, STUDIES[0] + '.mat')
+    path = str(tmp_path / (STUDIES[0] + '.vox'))
+    convert_preprocessed(matFile, path, np.float32)
+    assert VoxelStore(path)._Ct.dtype == np.float32
+    a, b = load_preprocessed(matFile), load_preprocessed(path)
+    np.testing.assert_allclose(b['Ct'], a['Ct'], rtol=1e-6)
+    for name in ('Cp', 'Crr', 't', 'maskCt', 'maskCp', 'maskCrr', 'numGoodVox', 'sigmaCt'):
+        np.testing.assert_array_equal(b[name], a[name], err_msg=name)
+
+
+def test_converted_study_keeps_the_negative_concentrations(tmp_path):
+    f = synthetic_study(0)
+    f['Cp'][0] = f['Crr'][1] = -0.01
+    matFile = str(tmp_path / 'study.mat')
+    savemat(matFile, f)
+    path = str(tmp_path / 'study.vox')
+    convert_preprocessed(matFile, path)
+    variables = VoxelStore(path).variables
+    np.testing.assert_array_equal(variables['Cp'], f['Cp'].ravel())
+    np.testing.assert_array_equal(variables['Crr'], f['Crr'].ravel())
+    # ... which are set to zero when the store is read, as for the .mat file
+    g = read_preprocessed(path)
+    assert g['Cp'][0] == 0 and g['Crr'][1] == 0
+    np.testing.assert_array_equal(g['Cp'], read_preprocessed(matFile)['Cp'])
+    assert read_preprocessed(path, clip=False)['Cp'][0] == -0.01
+
+
+def test_on_disk_ct_is_copied_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(voxelstore, 'COPY_CHUNK_SIZE', 7)
+    f = synthetic_study(1)
+    # The HDF5 dataset of a -v7.3 file is Ct transposed
+    Ct = _HDF5Columns(np.ascontiguousarray(f['Ct'].T))
+    path = str(tmp_path / 'study.vox')
+    save_store(path, Ct, f['maskCt'])
+    np.testing.assert_array_equal(VoxelStore(path).Ct, f['Ct'])
+
+
+def test_convert_reads_v73_files(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    f = synthetic_study(0)
+    matFile = str(tmp_path / 'study.mat')
+    with h5py.File(matFile, 'w', userblock_size=512) as fid:
+        for name, x in f.items():
+            fid[name] = np.asarray(x, dtype=np.uint8 if name.startswith('mask') else float).T
+    # The MAT-file header MATLAB puts in the user block of -v7.3 files
+    with open(matFile, 'r+b') as fid:
+        fid.write(b'MATLAB 7.3 MAT-file'.ljust(116) + b'\0' * 8 + b'\x00\x02IM')
+    path = str(tmp_path / 'study.vox')
+    convert_preprocessed(matFile, path)
+    g = read_preprocessed(path)
+    np.testing.assert_array_equal(g['Ct'], f['Ct'])
+    np.testing.assert_array_equal(g['maskCrr'], f['maskCrr'])